@@ -1,5 +1,12 @@
 -- Build canonical and serving tables from raw ingestion layers.
 -- The bootstrap script replaces ${PROJECT_ID} with the runtime project.
+--
+-- The CAST/LPAD around the JV-Data key columns stay on purpose. This script runs unchanged against
+-- whatever jra_raw holds: untyped loads (STRING, or INT64 where autodetect saw numbers, e.g.
+-- MonthDay 106) and --typed loads (Year and Wakuban INT64, zero-padded codes STRING). CAST of a
+-- STRING to STRING and LPAD of an already padded code are no-ops, and race_id is built with
+-- CONCAT, which needs strings anyway. The incremental MERGE in loader_bq.py reads the table
+-- schemas instead and only converts columns whose types differ.
 
 CREATE OR REPLACE TABLE `${PROJECT_ID}.jra_core.ra_latest` AS
 SELECT * EXCEPT(_rn)
@@ -2,21 +2,31 @@
 import json
 import os
 
+from jra_van_loader.parsing import JvParser
+
 def extract_sample(filepath, target_type):
     print(f"Searching for {target_type} in {filepath}...")
+    # 種別の判定には遅延ビューを使い、見つかったレコードだけを現在のスキーマでパースする
+    parser = JvParser()
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             for line in f:
                 try:
                     record = json.loads(line)
-                    rtype = record.get("record_type")
-                    if not rtype:
-                        raw = record.get("raw_data", "")
-                        if raw: rtype = raw[:2]
+                    raw = record.get("raw_data", "")
+                    view = parser.view(raw) if raw else None
+                    if view is not None:
+                        rtype = view.record_type
+                    else:
+                        rtype = record.get("record_type") or raw[:2]
                     
                     if rtype == target_type:
                         print(f"\n--- Found {target_type} ---")
-                        print(f"Raw Length: {len(record.get('raw_data', '').encode('utf-8'))} bytes (approx)") # Output is unicode so length is char count
+                        if view is not None:
+                            print(f"Raw Length: {len(view.raw_bytes)} bytes (CP932)")
+                            print(json.dumps(view.to_dict(), ensure_ascii=False))
+                        else:
+                            print(f"Raw Length: {len(raw)} chars")
                         print(json.dumps(record, ensure_ascii=False))
                         return
                 except:
@@ -1,11 +1,20 @@
 
 import json
 import os
+import sys
 from collections import defaultdict
 
-def count_record_types(filepath):
+from jra_van_loader.parsing import JvParser
+
+def count_record_types(filepath, race_key=None):
+    """
+    レコード種別ごとの件数を数える
+    race_key (例: "2024010606010101" = 年+月日+場+回次+日次+R) を指定した場合はそのレースのレコードだけを数える
+    """
     counts = defaultdict(int)
     total_lines = 0
+    # 種別とレースキーだけをデコードする (フィールドを全てパースした dict は作らない)
+    parser = JvParser()
     
     print(f"Counting record types in {filepath}...")
     
@@ -15,15 +24,17 @@ def count_record_types(filepath):
                 total_lines += 1
                 try:
                     record = json.loads(line)
-                    # DataSaverが保存したキーは "record_type" を想定
-                    # もしなければ raw_data の先頭2文字
-                    rtype = record.get("record_type")
-                    if not rtype:
-                        raw = record.get("raw_data", "")
-                        if raw:
-                            rtype = raw[:2]
-                        else:
-                            rtype = "UNKNOWN"
+                    raw = record.get("raw_data", "")
+                    view = parser.view(raw) if raw else None
+                    if race_key is not None and (view is None or "".join(view.race_key) != race_key):
+                        continue
+                    if view is not None:
+                        # 定義済みの種別は raw_data から判定する
+                        rtype = view.record_type
+                    else:
+                        # DataSaverが保存したキーは "record_type" を想定
+                        # もしなければ raw_data の先頭2文字
+                        rtype = record.get("record_type") or raw[:2] or "UNKNOWN"
                     
                     counts[rtype] += 1
                             
@@ -36,10 +47,13 @@ def count_record_types(filepath):
     except Exception as e:
         print(f"Error: {e}")
 
-    print(f"\n--- Record Type Counts (Total: {total_lines}) ---")
+    matched = f", race {race_key}: {sum(counts.values())}" if race_key is not None else ""
+    print(f"\n--- Record Type Counts (Total: {total_lines}{matched}) ---")
     for rtype, count in sorted(counts.items()):
         print(f"{rtype}: {count}")
 
 if __name__ == "__main__":
     target_file = os.path.join("jra_van_loader", "output_test", "RACE_20240101000000.jsonl")
-    count_record_types(target_file)
+    if len(sys.argv) > 1:
+        target_file = sys.argv[1]
+    count_record_types(target_file, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,190 @@
+"""
+セットアップデータ (過去分) の一括取り込みを、期間 x データ種別のチャンクに分割して並列に実行するスクリプト。
+
+各チャンクは main.py を別プロセス (= 別の JV-Link セッション) として実行し、
+fromtime に "開始-終了" の期間指定を渡す。同時に実行するチャンク数は --concurrency で制限する。
+チャンクごとの状態 (pending / running / done / failed)・試行回数・終了コードを
+出力ディレクトリの _backfill_manifest.json に記録し、失敗したチャンクは --retries 回まで再実行する。
+再実行時は done のチャンクを飛ばし、それ以外は main.py のチェックポイントから再開する。
+
+使い方:
+    python backfill.py --specs RACE,BLOD --start 2010-01-01 --end 2024-12-31 --chunk-months 12 \\
+        --concurrency 2 --output backfill_output
+    (認識しない引数はそのまま main.py に渡す。例: --typed --format parquet --replay synthetic)
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "_backfill_manifest.json"
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def _add_months(d: date, months: int) -> date:
+    month = d.month - 1 + months
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def split_range(start: date, end: date, chunk_months: int) -> list:
+    """
+    [start, end] を chunk_months ヶ月ごとの期間に分割する (月初で区切る)
+    戻り値: (開始日, 終了日) のリスト (終了日を含む)
+    """
+    chunks = []
+    current = start
+    while current <= end:
+        next_start = _add_months(date(current.year, current.month, 1), chunk_months)
+        chunk_end = min(next_start - timedelta(days=1), end)
+        chunks.append((current, chunk_end))
+        current = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def build_chunks(specs: list, start: date, end: date, chunk_months: int) -> list:
+    chunks = []
+    for spec in specs:
+        for chunk_start, chunk_end in split_range(start, end, chunk_months):
+            chunk_id = f"{spec}_{chunk_start:%Y%m%d}_{chunk_end:%Y%m%d}"
+            chunks.append({
+                "id": chunk_id,
+                "spec": spec,
+                # JVOpen の fromtime の期間指定 (開始-終了)
+                "fromtime": f"{chunk_start:%Y%m%d}000000-{chunk_end:%Y%m%d}235959",
+            })
+    return chunks
+
+
+class BackfillManifest:
+    """
+    チャンクごとの実行状態を JSON ファイルに記録する (複数スレッドから更新される)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.chunks = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.chunks = json.load(f).get("chunks", {})
+
+    def register(self, chunk: dict):
+        with self.lock:
+            entry = self.chunks.setdefault(chunk["id"], {"status": "pending", "attempts": 0})
+            entry.update(spec=chunk["spec"], fromtime=chunk["fromtime"])
+
+    def status(self, chunk_id: str) -> str:
+        return self.chunks.get(chunk_id, {}).get("status", "pending")
+
+    def update(self, chunk_id: str, **values):
+        with self.lock:
+            self.chunks[chunk_id].update(values)
+            self._write()
+
+    def save(self):
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        # 一時ファイルに書いてから置き換える
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"chunks": self.chunks}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> dict:
+        counts = {}
+        for entry in self.chunks.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+
+def run_chunk(chunk: dict, args, extra_args: list, manifest: BackfillManifest) -> bool:
+    """
+    1チャンクを main.py で実行する。失敗した場合は retries 回まで再実行する
+    """
+    chunk_dir = os.path.join(args.output, chunk["id"])
+    os.makedirs(chunk_dir, exist_ok=True)
+    command = [
+        sys.executable, MAIN_SCRIPT,
+        "--spec", chunk["spec"],
+        "--from", chunk["fromtime"],
+        "--option", str(args.option),
+        "--output", chunk_dir,
+        *extra_args,
+    ]
+
+    for attempt in range(args.retries + 1):
+        attempts = manifest.chunks[chunk["id"]]["attempts"] + 1
+        started = time.monotonic()
+        manifest.update(chunk["id"], status="running", attempts=attempts, started_at=datetime.now().isoformat())
+        logger.info(f"Starting chunk {chunk['id']} (attempt {attempts})")
+
+        # 出力は chunk ごとのログファイルに追記する
+        with open(os.path.join(chunk_dir, "_main.log"), 'a', encoding='utf-8') as log:
+            returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+
+        duration = round(time.monotonic() - started, 1)
+        if returncode == 0:
+            manifest.update(chunk["id"], status="done", returncode=0, duration=duration,
+                            finished_at=datetime.now().isoformat())
+            logger.info(f"Chunk {chunk['id']} done in {duration}s")
+            return True
+
+        manifest.update(chunk["id"], status="failed", returncode=returncode, duration=duration,
+                        finished_at=datetime.now().isoformat())
+        logger.warning(f"Chunk {chunk['id']} failed with exit code {returncode} (attempt {attempts})")
+        if attempt < args.retries:
+            # 再実行は main.py のチェックポイントから再開する
+            time.sleep(args.retry_delay * (2 ** attempt))
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run chunked, parallel setup-mode backfills through main.py")
+    parser.add_argument("--specs", required=True, help="Comma-separated data specifications (e.g. RACE,BLOD)")
+    parser.add_argument("--start", required=True, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="End date (YYYY-MM-DD, default: today)")
+    parser.add_argument("--chunk-months", type=int, default=12, help="Months per chunk")
+    parser.add_argument("--option", type=int, default=4, help="JVOpen option (3: setup, 4: setup without dialog)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Chunks (JV-Link sessions) run in parallel")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per failed chunk")
+    parser.add_argument("--retry-delay", type=float, default=30.0, help="Initial delay before a retry in seconds")
+    parser.add_argument("--output", default="backfill_output", help="Output directory (one subdirectory per chunk)")
+    args, extra_args = parser.parse_known_args()
+
+    specs = [s.strip() for s in args.specs.split(",") if s.strip()]
+    start = date.fromisoformat(args.start)
+    end = date.fromisoformat(args.end) if args.end else date.today()
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest = BackfillManifest(os.path.join(args.output, MANIFEST_FILENAME))
+    chunks = build_chunks(specs, start, end, args.chunk_months)
+    for chunk in chunks:
+        manifest.register(chunk)
+    manifest.save()
+
+    pending = [chunk for chunk in chunks if manifest.status(chunk["id"]) != "done"]
+    logger.info(f"{len(chunks)} chunks, {len(chunks) - len(pending)} already done, {len(pending)} to run "
+                f"with concurrency {args.concurrency}")
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = [executor.submit(run_chunk, chunk, args, extra_args, manifest) for chunk in pending]
+        for future in as_completed(futures):
+            future.result()
+
+    summary = manifest.summary()
+    logger.info(f"Backfill finished: {summary}")
+    return 0 if summary.get("failed", 0) == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
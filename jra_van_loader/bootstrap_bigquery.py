@@ -5,6 +5,13 @@ from pathlib import Path
 
 from google.cloud import bigquery
 
+try:
+    from . import bq_metrics
+    from .bq_metrics import track_script
+except ImportError:
+    import bq_metrics
+    from bq_metrics import track_script
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -46,7 +53,7 @@ def run_sql_files(
         raw_sql = sql_file.read_text(encoding="utf-8")
         rendered_sql = raw_sql.replace("${PROJECT_ID}", project_id).replace("${BQ_LOCATION}", location)
         logger.info("Executing %s", sql_file.name)
-        client.query(rendered_sql, location=location).result()
+        track_script(client, client.query(rendered_sql, location=location), sql_file.name)
         logger.info("Completed %s", sql_file.name)
 
 
@@ -64,6 +71,12 @@ def main() -> None:
         default=str(Path(__file__).resolve().parents[1] / "bigquery"),
         help="Directory containing SQL files",
     )
+    parser.add_argument(
+        "--metrics-file",
+        default=bq_metrics.DEFAULT_METRICS_FILE,
+        help="Local JSONL file receiving per-job BigQuery statistics",
+    )
+    parser.add_argument("--audit-table", help="BigQuery table (dataset.table) receiving per-job statistics")
     args = parser.parse_args()
 
     if args.key:
@@ -74,13 +87,18 @@ def main() -> None:
         raise ValueError("Project ID is required. Set --project or GOOGLE_CLOUD_PROJECT.")
 
     client = bigquery.Client(project=project_id)
-    run_sql_files(
-        client=client,
-        sql_dir=Path(args.sql_dir),
-        location=args.location,
-        project_id=project_id,
-        only=args.only,
-    )
+    audit_table_id = f"{project_id}.{args.audit_table}" if args.audit_table else None
+    metrics = bq_metrics.configure("bootstrap_bigquery", args.metrics_file, client, audit_table_id)
+    try:
+        run_sql_files(
+            client=client,
+            sql_dir=Path(args.sql_dir),
+            location=args.location,
+            project_id=project_id,
+            only=args.only,
+        )
+    finally:
+        metrics.close()
 
 
 if __name__ == "__main__":
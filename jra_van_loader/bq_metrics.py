@@ -0,0 +1,269 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any
+
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_FILE = "bq_metrics.jsonl"
+
+AUDIT_TABLE_SCHEMA = [
+    bigquery.SchemaField("run_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("entry_point", "STRING", description="Script that ran the job"),
+    bigquery.SchemaField("label", "STRING", description="Statement label, e.g. merge RA_latest"),
+    bigquery.SchemaField("job_id", "STRING"),
+    bigquery.SchemaField("job_type", "STRING", description="query, load, copy or append (Storage Write API)"),
+    bigquery.SchemaField("parent_job_id", "STRING", description="Script job that ran this statement"),
+    bigquery.SchemaField("statement_type", "STRING"),
+    bigquery.SchemaField("state", "STRING"),
+    bigquery.SchemaField("error", "STRING"),
+    bigquery.SchemaField(
+        "wall_ms", "INT64", description="Client-side time waiting for the job (null for script statements)"
+    ),
+    bigquery.SchemaField("job_ms", "INT64", description="Job creation to end, as reported by BigQuery"),
+    bigquery.SchemaField("slot_ms", "INT64"),
+    bigquery.SchemaField("bytes_processed", "INT64"),
+    bigquery.SchemaField("bytes_billed", "INT64"),
+    bigquery.SchemaField("cache_hit", "BOOL"),
+    bigquery.SchemaField("rows", "INT64", description="Rows returned, affected by DML or written by a load"),
+    bigquery.SchemaField("recorded_at", "TIMESTAMP"),
+]
+
+
+class JobMetrics:
+    """Statistics of the BigQuery jobs run by one script invocation.
+
+    Each job is appended to a local JSONL file as soon as it finishes. With an audit table the
+    records are also inserted into BigQuery when the run is closed.
+    """
+
+    def __init__(
+        self,
+        entry_point: str,
+        path: str | None = DEFAULT_METRICS_FILE,
+        client: bigquery.Client | None = None,
+        audit_table_id: str | None = None,
+    ):
+        self.entry_point = entry_point
+        self.run_id = f"{entry_point}_{datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+        self.path = path
+        self.client = client
+        self.audit_table_id = audit_table_id
+        self.records: list[dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        job,
+        label: str,
+        wall_seconds: float | None,
+        error: Exception | None = None,
+        rows: int | None = None,
+        parent_job_id: str | None = None,
+    ) -> dict[str, Any]:
+        entry = {
+            "run_id": self.run_id,
+            "entry_point": self.entry_point,
+            "label": label,
+            **job_statistics(job),
+            "parent_job_id": parent_job_id,
+            "wall_ms": int(wall_seconds * 1000) if wall_seconds is not None else None,
+            "recorded_at": datetime.now().isoformat(),
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        if entry["rows"] is None:
+            entry["rows"] = rows
+        with self.lock:
+            self.records.append(entry)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        logger.debug("Job %s (%s): %s", label, entry["job_id"], entry)
+        return entry
+
+    def summary(self, top: int = 5) -> dict[str, Any]:
+        """Totals for the run and the most expensive statements (by bytes billed, then slot-ms).
+
+        A script job whose statements were recorded only counts for its wall time; its cost is the sum
+        of its statements'.
+        """
+        with self.lock:
+            records = list(self.records)
+        parents = {r["parent_job_id"] for r in records if r["parent_job_id"]}
+        statements = [r for r in records if r["job_id"] not in parents]
+        totals = {
+            "jobs": len(records),
+            "failed": sum(1 for r in records if r["error"]),
+            "cache_hits": sum(1 for r in statements if r["cache_hit"]),
+            "bytes_processed": sum(r["bytes_processed"] or 0 for r in statements),
+            "bytes_billed": sum(r["bytes_billed"] or 0 for r in statements),
+            "slot_ms": sum(r["slot_ms"] or 0 for r in statements),
+            "wall_ms": sum(r["wall_ms"] or 0 for r in records),
+            "rows": sum(r["rows"] or 0 for r in statements),
+        }
+        totals["top"] = sorted(
+            statements, key=lambda r: (r["bytes_billed"] or 0, r["slot_ms"] or 0), reverse=True
+        )[:top]
+        return totals
+
+    def log_summary(self, top: int = 5) -> None:
+        totals = self.summary(top)
+        if not totals["jobs"]:
+            return
+        logger.info(
+            "BigQuery run %s: jobs=%s failed=%s cache_hits=%s processed=%.1f MiB billed=%.1f MiB "
+            "slot=%.1fs wall=%.1fs rows=%s",
+            self.run_id, totals["jobs"], totals["failed"], totals["cache_hits"],
+            totals["bytes_processed"] / 2**20, totals["bytes_billed"] / 2**20,
+            totals["slot_ms"] / 1000, totals["wall_ms"] / 1000, totals["rows"],
+        )
+        for r in totals["top"]:
+            logger.info(
+                "  %s [%s] billed=%.1f MiB slot=%.1fs wall=%.1fs cache_hit=%s rows=%s",
+                r["label"], r["job_id"], (r["bytes_billed"] or 0) / 2**20,
+                (r["slot_ms"] or 0) / 1000, (r["wall_ms"] or 0) / 1000, r["cache_hit"], r["rows"],
+            )
+
+    def close(self) -> None:
+        """Log the run summary and insert the records into the audit table."""
+        self.log_summary()
+        if not (self.audit_table_id and self.records):
+            return
+        try:
+            table = self.client.get_table(self.audit_table_id)
+            known = {field.name for field in table.schema}
+            missing = [field for field in AUDIT_TABLE_SCHEMA if field.name not in known]
+            if missing:
+                # Tables created by an older version lack the newer (nullable) columns.
+                table.schema = list(table.schema) + missing
+                self.client.update_table(table, ["schema"])
+        except NotFound:
+            table = bigquery.Table(self.audit_table_id, schema=AUDIT_TABLE_SCHEMA)
+            table.time_partitioning = bigquery.TimePartitioning(field="recorded_at")
+            self.client.create_table(table, exists_ok=True)
+            logger.info("Created audit table %s", self.audit_table_id)
+        errors = self.client.insert_rows_json(self.audit_table_id, self.records)
+        if errors:
+            logger.warning(
+                "Failed to insert %s job records into %s: %s", len(self.records), self.audit_table_id, errors
+            )
+
+
+def _job_type(job) -> str:
+    job_type = getattr(job, "job_type", None)
+    if job_type:
+        return job_type
+    return type(job).__name__.removesuffix("Job").lower()
+
+
+def job_statistics(job) -> dict[str, Any]:
+    """Cost and latency statistics of a finished query, load or copy job."""
+    job_type = _job_type(job)
+    statistics = getattr(job, "_properties", {}).get("statistics", {})
+    slot_ms = getattr(job, "slot_millis", None)
+    if slot_ms is None and statistics.get("totalSlotMs") is not None:
+        # Load and copy jobs report slot time only in the raw statistics.
+        slot_ms = int(statistics["totalSlotMs"])
+    created, ended = getattr(job, "created", None), getattr(job, "ended", None)
+    error = getattr(job, "error_result", None)
+
+    rows = None
+    if job_type == "query":
+        rows = getattr(job, "num_dml_affected_rows", None)
+    elif job_type == "load":
+        rows = getattr(job, "output_rows", None)
+    return {
+        "job_id": getattr(job, "job_id", None),
+        "job_type": job_type,
+        "statement_type": getattr(job, "statement_type", None) if job_type == "query" else None,
+        "state": getattr(job, "state", None),
+        "job_ms": int((ended - created).total_seconds() * 1000) if created and ended else None,
+        "slot_ms": slot_ms,
+        "bytes_processed": getattr(job, "total_bytes_processed", None),
+        "bytes_billed": getattr(job, "total_bytes_billed", None),
+        "cache_hit": getattr(job, "cache_hit", None) if job_type == "query" else None,
+        "rows": rows,
+        "error": (error or {}).get("message"),
+    }
+
+
+_metrics: JobMetrics | None = None
+
+
+def configure(
+    entry_point: str,
+    path: str | None = DEFAULT_METRICS_FILE,
+    client: bigquery.Client | None = None,
+    audit_table_id: str | None = None,
+) -> JobMetrics:
+    """Set the metrics recorder that track_job reports to (call once from a script's main)."""
+    global _metrics
+    _metrics = JobMetrics(entry_point, path, client, audit_table_id)
+    return _metrics
+
+
+class _Append:
+    """A Storage Write API append, described like a job so that JobMetrics.record can store it."""
+
+    job_type = "append"
+
+    def __init__(self, stream: str, offset: int, error: Exception | None):
+        self.job_id = f"{stream}@{offset}"
+        self.state = "DONE" if error is None else "FAILED"
+
+
+def record_append(
+    label: str, stream: str, offset: int, rows: int, wall_seconds: float, error: Exception | None = None
+) -> None:
+    """Record one Storage Write API append attempt (appends create no job, so only rows and time are known)."""
+    if _metrics is not None:
+        _metrics.record(_Append(stream, offset, error), label, wall_seconds, error, rows=rows)
+
+
+def track_job(job, label: str, **result_kwargs):
+    """Wait for job and record its statistics. Returns job.result(**result_kwargs).
+
+    Without a configured recorder this is just job.result().
+    """
+    started = time.monotonic()
+    try:
+        result = job.result(**result_kwargs)
+    except Exception as e:
+        if _metrics is not None:
+            _metrics.record(job, label, time.monotonic() - started, e)
+        raise
+    if _metrics is not None:
+        _metrics.record(job, label, time.monotonic() - started, rows=getattr(result, "total_rows", None))
+    return result
+
+
+def record_child_jobs(client: bigquery.Client, job, label: str) -> None:
+    """Record the statement jobs of a finished (or failed) multi-statement script job.
+
+    BigQuery reports a script's cost only in total; its child jobs tell which statement was
+    expensive. They are labelled "<label> [n]" in execution order.
+    """
+    if _metrics is None or getattr(job, "statement_type", None) != "SCRIPT":
+        return
+    try:
+        children = sorted(client.list_jobs(parent_job=job), key=lambda child: child.created or datetime.min)
+    except Exception as e:
+        logger.warning("Could not list the statements of script job %s: %s", job.job_id, e)
+        return
+    for i, child in enumerate(children, 1):
+        _metrics.record(child, f"{label} [{i}]", None, parent_job_id=job.job_id)
+
+
+def track_script(client: bigquery.Client, job, label: str, **result_kwargs):
+    """track_job for a query that may be a multi-statement script; also records each statement's child job."""
+    try:
+        return track_job(job, label, **result_kwargs)
+    finally:
+        record_child_jobs(client, job, label)
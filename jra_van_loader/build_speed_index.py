@@ -3,11 +3,23 @@ import logging
 import os
 from dataclasses import dataclass
 from datetime import date
+from glob import glob
 
 import numpy as np
 import pandas as pd
 from google.cloud import bigquery
 
+try:
+    from . import bq_metrics
+    from .bq_metrics import track_job
+    from .columnar import iter_raw_data, parse_columns
+    from .schema.definitions import RECORD_SPECS, Field
+except ImportError:
+    import bq_metrics
+    from bq_metrics import track_job
+    from columnar import iter_raw_data, parse_columns
+    from schema.definitions import RECORD_SPECS, Field
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -21,6 +33,31 @@ SURFACE_TURF = "\u829d"
 SURFACE_DIRT = "\u30c0"
 VALID_SURFACES = [SURFACE_TURF, SURFACE_DIRT]
 
+# JV-Data track codes (RA.TrackCD): 10-22 turf, 23-29 dirt (27/28 sand), 51-59 jump races.
+TURF_TRACK_CODES = range(10, 23)
+DIRT_TRACK_CODES = range(23, 30)
+RACE_KEY_FIELDS = ["Year", "MonthDay", "JyoCD", "Kaiji", "Nichiji", "RaceNum"]
+# SE fields read only here. They stay out of SE_SCHEMA because every defined field changes the
+# ingest output: it becomes a column and moves the start of raw_body past it.
+# Offsets are 0-based CP932 byte positions from the JV-Data SE layout.
+SE_SOURCE_FIELDS = [
+    *RECORD_SPECS["SE"],
+    Field("SexCD", 78, 1, "code", "性別コード"),
+    Field("Barei", 82, 2, "int", "馬齢"),
+    Field("Futan", 288, 3, "decimal", "負担重量", 1),
+    # Time is M SS T (minutes, seconds, tenths), e.g. 1234 = 1:23.4; 0000 for runners without a time.
+    Field("Time", 338, 4, "int", "走破タイム"),
+]
+# SE.SexCD -> the sex labels of the analysis view.
+SEX_NAMES = {"1": "\u7261", "2": "\u725d", "3": "\u30bb"}
+# Covariates of the analysis view that the JSONL source cannot fill: the going and the race class
+# are in RA fields that RA_SCHEMA does not define.
+JSONL_MISSING_COLUMNS = ["track_condition", "class_name"]
+SOURCE_COLUMNS = [
+    "horse_key", "horse_name", "surface", "time_sec", "distance", "weight",
+    "num_horses", "age", "sex", "track_condition", "venue", "class_name",
+]
+
 
 @dataclass
 class SourceColumns:
@@ -108,6 +145,77 @@ def build_source_query(table_id: str, cols: SourceColumns) -> str:
     """
 
 
+def _jsonl_columns(
+    input_dir: str, record_type: str, fields: list[Field] | None = None
+) -> dict[str, np.ndarray]:
+    """Parse the raw_data of every <record_type>_*.jsonl[.gz] file in input_dir as one columnar batch.
+
+    fields replaces the RECORD_SPECS definition of the record type.
+    """
+    paths = sorted(glob(os.path.join(input_dir, f"{record_type}_*.jsonl")))
+    paths += sorted(glob(os.path.join(input_dir, f"{record_type}_*.jsonl.gz")))
+    raws = (raw for path in paths for raw in iter_raw_data(path))
+    specs = {record_type: fields} if fields is not None else None
+    return parse_columns(raws, record_spec=record_type, specs=specs, typed=True, groups=False)
+
+
+def _race_ids(columns: dict[str, np.ndarray]) -> np.ndarray:
+    race_id = np.ma.getdata(columns[RACE_KEY_FIELDS[0]]).astype(str)
+    for name in RACE_KEY_FIELDS[1:]:
+        race_id = np.char.add(race_id, np.ma.getdata(columns[name]).astype(str))
+    return race_id
+
+
+def load_jsonl_source_frame(input_dir: str) -> pd.DataFrame:
+    """Build the source frame from local SE/RA JSONL (main.py output) instead of the analysis view.
+
+    The records are parsed with columnar.parse_columns, so full-history SE files are read as arrays
+    rather than one dict per record. Later records of the same race or runner replace earlier ones.
+    venue is the JyoCD code. track_condition and class_name stay empty (see JSONL_MISSING_COLUMNS),
+    so fit_surface_index fits a reduced model without those covariates and the index differs from
+    one built from the analysis view.
+    """
+    logger.warning(
+        "JSONL source has no %s; the speed index is fitted without these covariates",
+        ", ".join(JSONL_MISSING_COLUMNS),
+    )
+    ra = _jsonl_columns(input_dir, "RA")
+    se = _jsonl_columns(input_dir, "SE", SE_SOURCE_FIELDS)
+    if not ra or not se:
+        return pd.DataFrame(columns=SOURCE_COLUMNS)
+
+    track = ra["TrackCD"].astype(str)
+    track_num = np.where(np.char.isdigit(track), track, "0").astype(np.int64)
+    races = pd.DataFrame({
+        "race_id": _race_ids(ra),
+        "surface": np.select(
+            [np.isin(track_num, TURF_TRACK_CODES), np.isin(track_num, DIRT_TRACK_CODES)],
+            [SURFACE_TURF, SURFACE_DIRT],
+            default="",
+        ),
+        "distance": ra["Kyori"].astype(np.float64).filled(np.nan),
+    }).drop_duplicates("race_id", keep="last")
+
+    time = se["Time"].astype(np.float64).filled(np.nan)
+    runners = pd.DataFrame({
+        "race_id": _race_ids(se),
+        "horse_key": se["KettoNum"],
+        "horse_name": se["Bamei"],
+        "venue": se["JyoCD"],
+        "sex": pd.Series(se["SexCD"]).map(SEX_NAMES),
+        "age": se["Barei"].astype(np.float64).filled(np.nan),
+        "weight": se["Futan"],
+        "time_sec": (time // 1000) * 60 + (time % 1000) / 10,
+    }).drop_duplicates(["race_id", "horse_key"], keep="last")
+    runners["num_horses"] = runners.groupby("race_id")["race_id"].transform("size")
+
+    data = runners.merge(races, on="race_id", how="inner")
+    for c in SOURCE_COLUMNS:
+        if c not in data:
+            data[c] = None
+    return data[SOURCE_COLUMNS]
+
+
 def normalize_source_frame(df: pd.DataFrame) -> pd.DataFrame:
     data = df.copy()
     data["horse_key"] = data["horse_key"].astype(str).str.strip()
@@ -210,12 +318,17 @@ def build_speed_index_table(
     shrinkage_lambda: float,
     min_rows: int,
     asof_date: date,
+    source_jsonl: str | None = None,
 ) -> None:
-    source_cols = inspect_source_columns(client, source_table_id)
-    query = build_source_query(source_table_id, source_cols)
-    logger.info("Loading source data from %s", source_table_id)
-    rows = list(client.query(query, location=location).result())
-    df = pd.DataFrame([dict(row.items()) for row in rows])
+    if source_jsonl:
+        logger.info("Loading source data from SE/RA JSONL in %s", source_jsonl)
+        df = load_jsonl_source_frame(source_jsonl)
+    else:
+        source_cols = inspect_source_columns(client, source_table_id)
+        query = build_source_query(source_table_id, source_cols)
+        logger.info("Loading source data from %s", source_table_id)
+        rows = list(track_job(client.query(query, location=location), f"read {source_table_id}"))
+        df = pd.DataFrame([dict(row.items()) for row in rows])
     logger.info("Loaded rows=%s", len(df))
 
     source = normalize_source_frame(df)
@@ -260,25 +373,31 @@ def build_speed_index_table(
 
     logger.info("Writing %s rows to %s", len(master), output_table_id)
     master_rows = master.to_dict(orient="records")
-    client.load_table_from_json(
-        master_rows,
-        output_table_id,
-        job_config=bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",
-            autodetect=True,
+    track_job(
+        client.load_table_from_json(
+            master_rows,
+            output_table_id,
+            job_config=bigquery.LoadJobConfig(
+                write_disposition="WRITE_TRUNCATE",
+                autodetect=True,
+            ),
         ),
-    ).result()
+        f"write {output_table_id}",
+    )
 
     logger.info("Writing %s rows to %s", len(baseline), baseline_table_id)
     baseline_rows = baseline.to_dict(orient="records")
-    client.load_table_from_json(
-        baseline_rows,
-        baseline_table_id,
-        job_config=bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",
-            autodetect=True,
+    track_job(
+        client.load_table_from_json(
+            baseline_rows,
+            baseline_table_id,
+            job_config=bigquery.LoadJobConfig(
+                write_disposition="WRITE_TRUNCATE",
+                autodetect=True,
+            ),
         ),
-    ).result()
+        f"write {baseline_table_id}",
+    )
 
 
 def main() -> None:
@@ -286,6 +405,11 @@ def main() -> None:
     parser.add_argument("--project", "-p", help="GCP project ID")
     parser.add_argument("--dataset", default=DEFAULT_DATASET, help="BigQuery dataset (default: jra_common)")
     parser.add_argument("--source-table", default=DEFAULT_SOURCE_TABLE, help="Source table/view name")
+    parser.add_argument(
+        "--source-jsonl",
+        help="Read SE/RA records from this directory of main.py JSONL output instead of --source-table "
+        "(fits without the track_condition and class_name covariates)",
+    )
     parser.add_argument("--output-table", default=DEFAULT_OUTPUT_TABLE, help="Output master table name")
     parser.add_argument("--baseline-table", default=DEFAULT_BASELINE_TABLE, help="Output baseline table name")
     parser.add_argument("--location", "-l", default=DEFAULT_LOCATION, help="BigQuery location")
@@ -302,6 +426,12 @@ def main() -> None:
         default=date.today().isoformat(),
         help="As-of date (YYYY-MM-DD) stored in output tables",
     )
+    parser.add_argument(
+        "--metrics-file",
+        default=bq_metrics.DEFAULT_METRICS_FILE,
+        help="Local JSONL file receiving per-job BigQuery statistics",
+    )
+    parser.add_argument("--audit-table", help="BigQuery table (dataset.table) receiving per-job statistics")
     args = parser.parse_args()
 
     if args.key:
@@ -318,16 +448,22 @@ def main() -> None:
     output_table_id = f"{project_id}.{args.dataset}.{args.output_table}"
     baseline_table_id = f"{project_id}.{args.dataset}.{args.baseline_table}"
 
-    build_speed_index_table(
-        client=client,
-        source_table_id=source_table_id,
-        output_table_id=output_table_id,
-        baseline_table_id=baseline_table_id,
-        location=args.location,
-        shrinkage_lambda=args.shrinkage_lambda,
-        min_rows=args.min_rows,
-        asof_date=asof_date,
-    )
+    audit_table_id = f"{project_id}.{args.audit_table}" if args.audit_table else None
+    metrics = bq_metrics.configure("build_speed_index", args.metrics_file, client, audit_table_id)
+    try:
+        build_speed_index_table(
+            client=client,
+            source_table_id=source_table_id,
+            output_table_id=output_table_id,
+            baseline_table_id=baseline_table_id,
+            location=args.location,
+            shrinkage_lambda=args.shrinkage_lambda,
+            min_rows=args.min_rows,
+            asof_date=asof_date,
+            source_jsonl=args.source_jsonl,
+        )
+    finally:
+        metrics.close()
     logger.info("Completed speed-index build.")
 
 
@@ -0,0 +1,237 @@
+"""
+main.py の取り込みのチェックポイント (中断からの再開) を管理するモジュール。
+
+チェックポイントファイルには次の内容を記録する。
+- JVOpen の引数 (dataspec / fromtime / option) と戻り値 (readcount / downloadcount / lastTimestamp)
+- 取り込みが完了した JV ファイル名 (JVRead のファイル切り替わりで確定する)
+- 書き込み中の出力ファイルごとの位置 (バイト数・レコード数)
+- その時点の _manifest.jsonl の行数
+
+再開時は restore_outputs() で出力ファイルをチェックポイント時点の内容に戻し
+(途中まで書かれたレコードを切り詰め、チェックポイント後に作られたファイルを削除する)、
+完了済みの JV ファイルは JVLinkClient.read(skip_files=...) で読み飛ばす。
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+from glob import glob
+from typing import Any, Dict, List, Optional
+
+try:
+    from .sinks import MANIFEST_FILENAME, PART_SUFFIX, convert_arrow_part, pq, write_parquet
+except ImportError:
+    from sinks import MANIFEST_FILENAME, PART_SUFFIX, convert_arrow_part, pq, write_parquet
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILENAME = "_ingest_checkpoint.json"
+
+
+def _read_manifest(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _truncate_gzip(path: str, records: int) -> int:
+    """
+    gzip の JSONL を先頭 records 行だけにして書き直す (末尾が壊れていても読めた範囲を使う)
+    戻り値: 非圧縮のバイト数
+    """
+    lines = []
+    try:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if len(lines) >= records:
+                    break
+                lines.append(line)
+    except (EOFError, OSError):
+        pass
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, 'wb') as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+    return sum(len(line) for line in lines)
+
+
+def _restore_arrow_chunk(location: str, position: Dict[str, Any]):
+    """
+    ParquetSink の書き込み中のチャンクを記録時点のレコードまでの Parquet にする
+    """
+    path = position["path"]
+    compression, row_group_records = position["parquet_compression"], position["row_group_records"]
+    if location == position["part_path"]:
+        # Arrow IPC ストリームをバッチの境界 (記録時点のバイト数) に切り詰めて変換する
+        with open(location, 'r+b') as f:
+            f.truncate(position["bytes"])
+        convert_arrow_part(location, path, compression, row_group_records)
+    else:
+        # チェックポイント後に Parquet に変換済み: 先頭 records 行だけにして書き直す
+        table = pq.read_table(path).slice(0, position["records"])
+        write_parquet(table, path, compression, row_group_records)
+
+
+class IngestCheckpoint:
+    """
+    1回の取り込み (dataspec / fromtime / option の組) のチェックポイント
+
+    同じ引数で未完了のチェックポイントが残っていれば、それを読み込んで再開する (resuming=True)。
+    引数が異なるか、前回の取り込みが完了している場合は新しく始める。
+    """
+    def __init__(self, path: str, output_dir: str, dataspec: str, fromtime: str, option: int):
+        self.path = path
+        self.output_dir = output_dir
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+        key = {"dataspec": dataspec, "fromtime": fromtime, "option": option}
+
+        state = None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("key") != key or state.get("completed"):
+                logger.info("Ignoring checkpoint %s (different request or already completed)", path)
+                state = None
+
+        self.resuming = state is not None
+        self.state = state or {
+            "key": key,
+            "read_count": 0,
+            "download_count": 0,
+            "last_timestamp": "",
+            "completed_files": [],
+            "outputs": {},
+            "manifest_lines": len(_read_manifest(self.manifest_path)),
+            "completed": False,
+        }
+        self.completed_files = set(self.state["completed_files"])
+        if self.resuming:
+            logger.info("Resuming from checkpoint %s (%s JV files completed)", path, len(self.completed_files))
+
+    def save(self):
+        # 一時ファイルに書いてから置き換える (書き込み途中で中断してもチェックポイントが壊れない)
+        self.state["updated_at"] = datetime.now().isoformat()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def set_open_result(self, read_count: int, download_count: int, last_timestamp: str):
+        self.state["read_count"] = read_count
+        self.state["download_count"] = download_count
+        self.state["last_timestamp"] = last_timestamp
+        self.save()
+
+    def record_output(self, position: Dict[str, Any]):
+        """
+        出力ファイルを新しく開いたときの位置を記録する (シンクの on_open に設定する)
+        書き込み前に保存するので、中断後はこのファイルを開く前の状態に戻せる
+        """
+        self.state["outputs"][position["path"]] = position
+        self.save()
+
+    def mark_file_done(self, filename: str, outputs: List[Dict[str, Any]]):
+        """
+        JV ファイル1つの取り込み完了を記録する (DataSaver.checkpoint() の直後に呼ぶ)
+        """
+        self.completed_files.add(filename)
+        self.state["completed_files"].append(filename)
+        self.state["outputs"] = {position["path"]: position for position in outputs}
+        self.state["manifest_lines"] = len(_read_manifest(self.manifest_path))
+        self.save()
+
+    def mark_completed(self):
+        self.state["completed"] = True
+        self.save()
+
+    def restore_outputs(self):
+        """
+        出力ディレクトリをチェックポイント時点の状態に戻す
+
+        - 記録された出力ファイルは記録時点のバイト数 (gzip はレコード数) に切り詰める
+          チャンク (.part) は切り詰めた上で完成させ、manifest に記録する
+          (Parquet のチャンクは Arrow IPC ストリームをバッチの境界で切り詰めてから Parquet に変換する)
+        - 記録された出力のうち、チェックポイント後に commit() で完成したチャンクはそのまま残す
+        - チェックポイント後に完成したチャンク・作られた .part は削除する
+        """
+        manifest = _read_manifest(self.manifest_path)
+        kept = manifest[:self.state["manifest_lines"]]
+        kept_files = {entry["file"] for entry in kept}
+        finished_after = {entry["file"]: entry for entry in manifest[len(kept):]}
+        recovered = []
+
+        for position in self.state["outputs"].values():
+            path, part_path = position["path"], position.get("part_path")
+            location = part_path if part_path and os.path.exists(part_path) else path
+            if not os.path.exists(location) or os.path.basename(path) in kept_files:
+                continue
+            finished = finished_after.get(os.path.basename(path))
+            if finished is not None and location == path and finished["records"] == position["records"]:
+                # 記録した時点で閉じていたチャンク: 内容はチェックポイントの時点と同じなので書き直さない
+                recovered.append(finished)
+                continue
+
+            if position.get("format") == "arrow":
+                if position["records"] == 0:
+                    os.remove(location)
+                    continue
+                _restore_arrow_chunk(location, position)
+                raw_bytes = None
+            elif position.get("compression") == "gzip":
+                raw_bytes = _truncate_gzip(location, position["records"])
+            else:
+                with open(location, 'r+b') as f:
+                    f.truncate(position["bytes"])
+                raw_bytes = position["bytes"]
+
+            if position["records"] == 0 and (part_path or position["bytes"] == 0):
+                # チェックポイント後に作られたファイル
+                os.remove(location)
+                continue
+            if part_path:
+                if location == part_path and os.path.exists(part_path):
+                    os.replace(part_path, path)
+                entry = {
+                    "record_type": position.get("record_type"),
+                    "date": position.get("date"),
+                    "file": os.path.basename(path),
+                    "records": position["records"],
+                    "raw_bytes": raw_bytes,
+                    "bytes": os.path.getsize(path),
+                    "finished_at": datetime.now().isoformat(),
+                }
+                if raw_bytes is None:
+                    # Parquet のチャンクは ParquetSink と同じく非圧縮のバイト数を記録しない
+                    del entry["raw_bytes"]
+                recovered.append(entry)
+            logger.info("Restored %s to checkpoint (%s records)", os.path.basename(path), position["records"])
+
+        recovered_files = {entry["file"] for entry in recovered}
+        for entry in manifest[len(kept):]:
+            filepath = os.path.join(self.output_dir, entry["file"])
+            if entry["file"] not in recovered_files and os.path.exists(filepath):
+                logger.info("Removing chunk written after checkpoint: %s", entry["file"])
+                os.remove(filepath)
+        for part_path in glob(os.path.join(self.output_dir, "*" + PART_SUFFIX)):
+            logger.info("Removing partial chunk: %s", os.path.basename(part_path))
+            os.remove(part_path)
+
+        if manifest or recovered:
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in kept + recovered:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.manifest_path)
+
+        # 戻した出力はそれぞれ完成済み・または前回の内容になったので、以降は新しいファイルとして扱う
+        self.state["outputs"] = {}
+        self.state["manifest_lines"] = len(kept) + len(recovered)
+        self.save()
+
+    @property
+    def last_timestamp(self) -> Optional[str]:
+        return self.state.get("last_timestamp") or None
@@ -0,0 +1,268 @@
+"""
+同一レコード種別の固定長レコードをまとめて列指向でパースするモジュール。
+
+N件のレコードを N×L のバイト行列とみなし、schema/definitions.py の Field オフセットから
+構造化 dtype を組み立てて np.frombuffer でビューを作る。レコード毎の dict を作らず、
+フィールドごとの列配列 (または DataFrame) を返す。
+"""
+import codecs
+import gzip
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
+except ImportError:
+    from schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
+
+logger = logging.getLogger(__name__)
+
+RawRecord = Union[str, bytes, bytearray, memoryview]
+
+
+def _item_format(item: SchemaItem):
+    if isinstance(item, Repeat):
+        # 繰り返し項目は「要素1件分の構造体」x count のサブ配列にする
+        return (build_record_dtype(item.fields, itemsize=item.stride), (item.count,))
+    return f"S{item.length}"
+
+
+def build_record_dtype(fields: List[SchemaItem], itemsize: Optional[int] = None) -> np.dtype:
+    """
+    Field 定義から1レコード分の構造化 dtype を生成する (各フィールドは固定長バイト列 S{length})
+    """
+    max_end = max((f.start + f.length for f in fields), default=0)
+    return np.dtype({
+        "names": [f.name for f in fields],
+        "formats": [_item_format(f) for f in fields],
+        "offsets": [f.start for f in fields],
+        "itemsize": max(itemsize or 0, max_end),
+    })
+
+
+def _to_bytes(raw: RawRecord) -> bytes:
+    if isinstance(raw, bytes):
+        return raw
+    if isinstance(raw, str):
+        return raw.encode("cp932", errors="replace")
+    return bytes(raw)
+
+
+def decode_column(column: np.ndarray) -> np.ndarray:
+    """
+    固定長バイト列の列をデコードして前後の空白を除いた文字列配列にする
+
+    列全体が ASCII の場合 (コード・数値項目) は astype によるベクトル化変換を使い、
+    全角文字を含む列 (馬名・レース名など) だけ CP932 コーデックでデコードする。
+    """
+    if column.size == 0:
+        return column.astype("U1")
+    width = column.dtype.itemsize
+    raw = np.ascontiguousarray(column).view(np.uint8)
+    if (raw < 0x80).all():
+        decoded = column.astype(f"U{width}")
+    else:
+        decoded = np.char.decode(column, "cp932", errors="replace")
+    return np.char.strip(decoded)
+
+
+def _parse_ints(values: np.ndarray) -> np.ma.MaskedArray:
+    """
+    文字列配列を int64 に変換する。数字でない要素 (空欄等) はマスクする
+    """
+    body = np.char.lstrip(values, "+-")
+    valid = np.char.isdigit(body) & (np.char.str_len(values) - np.char.str_len(body) <= 1)
+    ints = np.zeros(values.shape, dtype=np.int64)
+    ints[valid] = values[valid].astype(np.int64)
+    return np.ma.masked_array(ints, mask=~valid)
+
+
+def convert_column(values: np.ndarray, field: Field) -> np.ndarray:
+    """
+    decode_column の結果を Field.dtype に従ってベクトル化して型変換する
+    (JvParser の convert_* のバッチ版)
+
+    int     -> int64 の MaskedArray (変換できない要素はマスク)
+    date    -> datetime64[D] (不正な日付は NaT)
+    decimal -> float64 (変換できない要素は NaN)
+    str / code はそのまま文字列配列
+    """
+    if field.dtype == "int":
+        return _parse_ints(values)
+    if field.dtype == "decimal":
+        ints = _parse_ints(values)
+        return (ints.astype(np.float64) / (10 ** field.scale)).filled(np.nan)
+    if field.dtype == "date":
+        ints = _parse_ints(values)
+        ymd = ints.filled(0)
+        year, month, day = ymd // 10000, ymd // 100 % 100, ymd % 100
+        valid = ~np.ma.getmaskarray(ints) & (np.char.str_len(values) == 8) & (month >= 1) & (month <= 12) & (day >= 1)
+        months = (year - 1970) * 12 + (month - 1)
+        dates = months.astype("datetime64[M]").astype("datetime64[D]") + (day - 1)
+        # 月末を超える日付 (2月30日など) は翌月に繰り上がるので無効とする
+        valid &= dates.astype("datetime64[M]") == months.astype("datetime64[M]")
+        return np.where(valid, dates, np.datetime64("NaT"))
+    return values
+
+
+def parse_columns(
+    records: Iterable[RawRecord],
+    record_spec: Optional[str] = None,
+    specs: Optional[Dict[str, List[SchemaItem]]] = None,
+    typed: bool = False,
+    groups: bool = True,
+) -> Dict[str, np.ndarray]:
+    """
+    同一種別のレコード群を列配列の辞書にパースする
+
+    record_spec を省略した場合は先頭レコードの種別を使う。種別が異なるレコードは読み飛ばす。
+    各列の値は JvParser.parse が返す文字列と同じ (デコード後に strip 済み)。
+    typed=True の場合は convert_column で Field.dtype に従って型変換する。
+    繰り返し項目は "{項目名}.{要素の項目名}" をキーとする N x count の2次元配列になる
+    (空欄の要素も除外せず、位置をそのまま保持する)。groups=False の場合は繰り返し項目を読み飛ばす。
+    """
+    specs = RECORD_SPECS if specs is None else specs
+
+    rows: List[bytes] = []
+    skipped = 0
+    spec_bytes = record_spec.encode("cp932") if record_spec is not None else None
+    for raw in records:
+        raw_bytes = _to_bytes(raw)
+        if spec_bytes is None:
+            spec_bytes = raw_bytes[0:2]
+            record_spec = spec_bytes.decode("cp932", errors="replace")
+        if raw_bytes[0:2] != spec_bytes:
+            skipped += 1
+            continue
+        rows.append(raw_bytes)
+
+    if skipped:
+        logger.warning("Skipped %s records whose type is not %s", skipped, record_spec)
+    if record_spec is None:
+        return {}
+    if record_spec not in specs:
+        raise ValueError(f"Record type is not defined in RECORD_SPECS: {record_spec}")
+
+    fields = specs[record_spec]
+    if not groups:
+        fields = [f for f in fields if not isinstance(f, Repeat)]
+    dtype = build_record_dtype(fields)
+    lengths = {len(row) for row in rows}
+    if len(lengths) == 1 and lengths.pop() >= dtype.itemsize:
+        # 全レコードが同じ長さ (固定長) ならそのまま連結し、レコード長を itemsize にする
+        dtype = build_record_dtype(fields, itemsize=len(rows[0]))
+        buf = b"".join(rows)
+    else:
+        # 定義より短いレコードは空白で埋める (strip 後は JvParser の切り詰めと同じ結果になる)
+        width = dtype.itemsize
+        buf = b"".join(row[:width].ljust(width, b" ") for row in rows)
+    matrix = np.frombuffer(buf, dtype=dtype)
+
+    columns: Dict[str, np.ndarray] = {"record_type": np.full(len(rows), record_spec)}
+    for item in fields:
+        if isinstance(item, Repeat):
+            group = matrix[item.name]
+            for field in item.fields:
+                values = decode_column(group[field.name])
+                columns[f"{item.name}.{field.name}"] = convert_column(values, field) if typed else values
+        else:
+            values = decode_column(matrix[item.name])
+            columns[item.name] = convert_column(values, item) if typed else values
+    return columns
+
+
+def _column_values(values: np.ndarray, field: Field, typed: bool) -> List[Any]:
+    """
+    列配列を JvParser.parse と同じ Python の値のリストにする
+    (型変換できなかった値・空欄のコードは None、日付は ISO 形式の文字列)
+    """
+    if not typed or field.dtype == "str":
+        return values.tolist()
+    if field.dtype == "code":
+        return [v or None for v in values.tolist()]
+    if field.dtype == "date":
+        dates = np.datetime_as_string(values, unit="D").tolist()
+        return [None if nat else d for d, nat in zip(dates, np.isnat(values).tolist())]
+    if field.dtype == "decimal":
+        return [None if v != v else v for v in values.tolist()]
+    # int の MaskedArray はマスクされた要素が None になる
+    return values.tolist()
+
+
+def parse_records(
+    records: List[bytes],
+    record_spec: str,
+    specs: Optional[Dict[str, List[SchemaItem]]] = None,
+    typed: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    同一種別の CP932 バイト列をまとめてパースし、JvParser.parse と同じ辞書のリストを返す
+
+    フィールドのデコード・型変換は parse_columns で列ごとにまとめて行い、レコード毎には辞書の組み立てと
+    raw_body の切り出しだけを行う。繰り返し項目は JvParser の既定と同じく展開しない。
+    records は全て record_spec のレコードであること (種別の異なるレコードは呼び出し側で振り分ける)。
+    """
+    specs = RECORD_SPECS if specs is None else specs
+    if not records:
+        return []
+    items = specs[record_spec]
+    fields = [f for f in items if not isinstance(f, Repeat)]
+    columns = parse_columns(records, record_spec=record_spec, specs=specs, typed=typed, groups=False)
+    if len(columns["record_type"]) != len(records):
+        raise ValueError(f"All records must be of type {record_spec}")
+
+    names = ["record_type", "_parsed"] + [f.name for f in fields]
+    rows = zip(
+        [record_spec] * len(records),
+        [True] * len(records),
+        *[_column_values(columns[f.name], f, typed) for f in fields],
+    )
+    parsed = [dict(zip(names, row)) for row in rows]
+
+    # 定義されていない残りの部分は JvParser と同じく raw_body として保持する
+    max_end = max((f.start + f.length for f in items), default=0)
+    for record, raw in zip(parsed, records):
+        if max_end < len(raw):
+            record["raw_body"] = codecs.decode(raw[max_end:], "cp932", "replace").strip()
+    return parsed
+
+
+def to_dataframe(columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    parse_columns の結果を DataFrame に変換する
+    (int の MaskedArray は pandas の nullable Int64 列、繰り返し項目の2次元配列は行ごとの配列を持つ列にする)
+    """
+    data = {}
+    for name, values in columns.items():
+        if values.ndim > 1:
+            data[name] = list(values)
+        elif isinstance(values, np.ma.MaskedArray):
+            data[name] = pd.arrays.IntegerArray(values.data, np.ma.getmaskarray(values))
+        else:
+            data[name] = values
+    return pd.DataFrame(data)
+
+
+def read_jsonl_columns(
+    file_path: str, record_spec: Optional[str] = None, typed: bool = False
+) -> Dict[str, np.ndarray]:
+    """
+    DataSaver が出力した JSONL (.jsonl.gz も可) の raw_data を読み込み、列指向でパースする
+    """
+    return parse_columns(iter_raw_data(file_path), record_spec=record_spec, typed=typed)
+
+
+def iter_raw_data(file_path: str) -> Iterator[str]:
+    """
+    DataSaver が出力した JSONL / JSONL.gz から raw_data を順に返す (raw_data のない行は読み飛ばす)
+    """
+    opener = gzip.open if file_path.endswith(".gz") else open
+    with opener(file_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            raw = json.loads(line).get("raw_data")
+            if raw:
+                yield raw
@@ -0,0 +1,286 @@
+"""Shared pytest fixtures, including a minimal in-memory stand-in for bigquery.Client.
+
+FakeBigQueryClient implements the calls made by loader_bq.py, load_manifest.py, bq_metrics.py,
+bootstrap_bigquery.py and watch.py. Tables are lists of row dicts. Load, copy and query calls
+return job stubs that finish immediately; query() understands the statements those modules
+generate (CREATE TABLE ... AS SELECT, SELECT into a destination, DELETE by batch id, MERGE on
+key columns, the race_date range query) and records everything else without running it.
+"""
+import gzip
+import io
+import itertools
+import json
+import os
+import re
+import sys
+from datetime import date, datetime
+
+import pytest
+
+# Tests import the package the same way test_parser.py does.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from google.api_core.exceptions import BadRequest, NotFound  # noqa: E402
+from google.cloud import bigquery  # noqa: E402
+
+_TABLE_REF = re.compile(r"`([\w-]+\.[\w-]+\.[\w-]+)`")
+
+
+def _strip_comments(sql: str) -> str:
+    return "\n".join(line for line in sql.splitlines() if not line.lstrip().startswith("--")).strip()
+
+
+class FakeTable:
+    def __init__(self, table_id: str, schema=None, time_partitioning=None):
+        self.project, self.dataset_id, self.table_id = table_id.split(".")
+        self.schema = list(schema or [])
+        self.time_partitioning = time_partitioning
+        self.rows: list[dict] = []
+
+    @property
+    def full_id(self) -> str:
+        return f"{self.project}.{self.dataset_id}.{self.table_id}"
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.rows)
+
+    def add_columns(self, names) -> None:
+        known = {field.name for field in self.schema}
+        for name in names:
+            if name not in known:
+                self.schema.append(bigquery.SchemaField(name, "STRING"))
+                known.add(name)
+
+
+class FakeJob:
+    def __init__(self, job_id: str, job_type: str, rows=None, error: Exception | None = None, **stats):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.state = "DONE"
+        self.created = self.ended = datetime.now()
+        self.error_result = {"message": str(error)} if error else None
+        self._rows = rows or []
+        self._error = error
+        self.statement_type = stats.pop("statement_type", None)
+        self.num_dml_affected_rows = stats.pop("num_dml_affected_rows", None)
+        self.output_rows = stats.pop("output_rows", None)
+        self.total_bytes_processed = stats.pop("total_bytes_processed", 0)
+        self.total_bytes_billed = stats.pop("total_bytes_billed", 0)
+        self.slot_millis = stats.pop("slot_millis", 0)
+        self.cache_hit = False
+        self.children: list[FakeJob] = []
+
+    def result(self, **kwargs):
+        if self._error is not None:
+            raise self._error
+        return iter(self._rows)
+
+
+class FakeBigQueryClient:
+    def __init__(self, project: str = "test-project"):
+        self.project = project
+        self.datasets: set[str] = set()
+        self.tables: dict[str, FakeTable] = {}
+        self.jobs: list[FakeJob] = []
+        self.queries: list[str] = []
+        self.inserted: dict[str, list[dict]] = {}
+        self._failures: list[tuple[str, str]] = []
+        self._ids = itertools.count(1)
+
+    # Test helpers
+
+    def fail_next(self, job_type: str, match: str = "") -> None:
+        """Make the next job_type job ("load", "copy", "query") whose target or SQL contains match fail."""
+        self._failures.append((job_type, match))
+
+    def rows(self, table_id: str) -> list[dict]:
+        return self.tables[table_id].rows if table_id in self.tables else []
+
+    def _job(self, job_type: str, description: str | None, rows=None, **stats) -> FakeJob:
+        """A finished job; it fails if a fail_next() match is in description (None never fails)."""
+        error = None
+        for failure in self._failures if description is not None else []:
+            if failure[0] == job_type and failure[1] in description:
+                self._failures.remove(failure)
+                error = BadRequest(f"Injected {job_type} failure: {failure[1] or description[:40]}")
+                break
+        job = FakeJob(f"job_{next(self._ids)}", job_type, rows, error, **stats)
+        self.jobs.append(job)
+        return job
+
+    # Datasets and tables
+
+    def dataset(self, dataset_id: str) -> bigquery.DatasetReference:
+        return bigquery.DatasetReference(self.project, dataset_id)
+
+    def get_dataset(self, dataset_ref):
+        if dataset_ref.dataset_id not in self.datasets:
+            raise NotFound(f"Dataset {dataset_ref.dataset_id}")
+        return bigquery.Dataset(dataset_ref)
+
+    def create_dataset(self, dataset, timeout=None, exists_ok=False):
+        self.datasets.add(dataset.dataset_id)
+        return dataset
+
+    def get_table(self, table_id):
+        table_id = str(table_id) if not isinstance(table_id, str) else table_id
+        if table_id not in self.tables:
+            raise NotFound(f"Table {table_id}")
+        return self.tables[table_id]
+
+    def create_table(self, table, exists_ok=False):
+        table_id = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        if table_id not in self.tables:
+            self.tables[table_id] = FakeTable(table_id, table.schema, table.time_partitioning)
+        return self.tables[table_id]
+
+    def update_table(self, table, fields):
+        return table
+
+    def _table(self, table_id: str, like: FakeTable | None = None) -> FakeTable:
+        if table_id not in self.tables:
+            self.tables[table_id] = FakeTable(table_id, like.schema if like else None)
+        return self.tables[table_id]
+
+    def insert_rows_json(self, table_id, rows):
+        self.inserted.setdefault(str(table_id), []).extend(rows)
+        return []
+
+    # Jobs
+
+    def load_table_from_file(self, source, table_id, job_config=None, rewind=False):
+        if rewind:
+            source.seek(0)
+        data = source.read()
+        if job_config.source_format == bigquery.SourceFormat.PARQUET:
+            import pyarrow.parquet as pq
+
+            rows = pq.read_table(io.BytesIO(data)).to_pylist()
+        else:
+            if data[:2] == b"\x1f\x8b":
+                data = gzip.decompress(data)
+            rows = [json.loads(line) for line in data.splitlines() if line.strip()]
+        job = self._job("load", table_id, output_rows=len(rows))
+        if job._error is None:
+            table = self._table(table_id)
+            if job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+                table.rows = []
+                table.schema = list(job_config.schema or [])
+            if job_config.schema and not table.schema:
+                table.schema = list(job_config.schema)
+            table.add_columns(name for row in rows for name in row)
+            table.rows.extend(rows)
+        return job
+
+    def copy_table(self, source_table_id, destination_table_id, job_config=None):
+        job = self._job("copy", destination_table_id)
+        if job._error is None:
+            source = self.get_table(source_table_id)
+            destination = self._table(destination_table_id, like=source)
+            destination.rows.extend(dict(row) for row in source.rows)
+        return job
+
+    def list_jobs(self, project=None, parent_job=None, **kwargs):
+        if parent_job is None:
+            return iter(self.jobs)
+        return iter(parent_job.children)
+
+    def query(self, sql: str, job_config=None, **kwargs):
+        self.queries.append(sql)
+        statements = [_strip_comments(s) for s in sql.split(";") if _strip_comments(s)]
+        if len(statements) > 1:
+            # Failures are injected into the statements, which then fail the script.
+            parent = self._job("query", None, statement_type="SCRIPT")
+            for statement in statements:
+                child = self._run_statement(statement, job_config)
+                parent.children.append(child)
+                if child._error is not None:
+                    # Like BigQuery, a failing statement fails the script and the rest never runs.
+                    parent._error, parent.error_result = child._error, child.error_result
+                    break
+            return parent
+        return self._run_statement(sql.strip(), job_config)
+
+    def _run_statement(self, sql: str, job_config) -> FakeJob:
+        tables = _TABLE_REF.findall(sql)
+        keyword = sql.split(None, 1)[0].upper()
+        job = self._job("query", sql, statement_type=keyword)
+        if job._error is not None:
+            return job
+
+        if sql.startswith("CREATE TABLE IF NOT EXISTS"):
+            target, source = tables[0], tables[-1]
+            if target not in self.tables:
+                table = self._table(target, like=self.get_table(source))
+                if "PARTITION BY" in sql:
+                    table.schema = table.schema + [bigquery.SchemaField("race_date", "DATE")]
+                    table.time_partitioning = bigquery.TimePartitioning(field="race_date")
+        elif keyword == "DELETE":
+            batch_ids = set(job_config.query_parameters[0].values)
+            table = self.get_table(tables[0])
+            before = len(table.rows)
+            table.rows = [row for row in table.rows if row.get("_batch_id") not in batch_ids]
+            job.num_dml_affected_rows = before - len(table.rows)
+        elif keyword == "MERGE":
+            try:
+                job.num_dml_affected_rows = self._merge(tables[0], tables[-1], sql)
+            except BadRequest as e:
+                job._error, job.error_result = e, {"message": str(e)}
+        elif keyword == "SELECT" and "MIN(" in sql:
+            job._rows = [self._race_date_range(tables[-1])]
+        elif keyword == "SELECT" and job_config is not None and job_config.destination is not None:
+            source = self.get_table(tables[-1])
+            destination = self._table(str(job_config.destination), like=source)
+            destination.add_columns(field.name for field in source.schema)
+            destination.rows.extend(dict(row) for row in source.rows)
+        return job
+
+    @staticmethod
+    def _race_date(row: dict) -> date | None:
+        try:
+            return datetime.strptime(f"{int(row['Year']):04d}{int(row['MonthDay']):04d}", "%Y%m%d").date()
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _race_date_range(self, stage_table_id: str) -> dict:
+        dates = [self._race_date(row) for row in self.rows(stage_table_id)]
+        valid = [d for d in dates if d is not None]
+        return {
+            "min_date": min(valid, default=None),
+            "max_date": max(valid, default=None),
+            "null_dates": len(dates) - len(valid),
+        }
+
+    def _merge(self, target_table_id: str, stage_table_id: str, sql: str) -> int:
+        keys = re.findall(r"T\.`(\w+)` = S\.`\1`", sql)
+        keys = keys or re.findall(r"T\.`(\w+)` IS NOT DISTINCT FROM S\.`\1`", sql)
+        # The partitioned MERGE derives race_date and drops staged rows without a valid one.
+        partitioned = "race_date" in keys
+        target = self.get_table(target_table_id)
+        # Like BigQuery, the UPDATE and INSERT column lists must name existing target columns.
+        insert_columns = re.search(r"INSERT \(([^)]*)\)", sql)
+        known = {field.name for field in target.schema}
+        unknown = [c for c in re.findall(r"`(\w+)`", insert_columns.group(1)) if c not in known]
+        if unknown:
+            raise BadRequest(f"Name {unknown[0]} not found inside T")
+
+        def key(row):
+            return tuple(str(row.get(k)) for k in keys)
+
+        latest = {}
+        for row in self.rows(stage_table_id):
+            row = dict(row)
+            if partitioned:
+                race_date = self._race_date(row)
+                if race_date is None:
+                    continue
+                row["race_date"] = race_date.isoformat()
+            latest[key(row)] = row
+        target.rows = [row for row in target.rows if key(row) not in latest] + list(latest.values())
+        return len(latest)
+
+
+@pytest.fixture
+def fake_bq():
+    return FakeBigQueryClient()
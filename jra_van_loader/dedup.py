@@ -0,0 +1,72 @@
+"""
+取り込み中に同じ内容のレコードを読み飛ばすフィルタ (main.py --dedup)。
+
+JV-Link は同じレコードを複数の JV ファイルで返すことがある (セットアップデータと差分データの重なり、
+速報オッズ・払戻の再送など)。レコードを JvParser.view で開いて種別とレースキーだけをデコードし、
+(種別, レースキー) ごとにレコード全体のダイジェストを記録して、2回目以降の同じレコードを読み飛ばす。
+読み飛ばすレコードは dict にもフィールド文字列にもならず、パース・書き出しにも回らない。
+
+記録はこの実行のメモリ上にだけ持つ (1レコード当たりダイジェスト8バイトと set の要素分)。
+中断後に再開した場合、再開前に完了した JV ファイルのレコードとの重複は検出しない。
+
+記録する (種別, レースキー) は max_keys 個までで、超えた分は最後に使ってから最も長く経ったものから捨てる (LRU)。
+JV-Link の重複は近い位置で返される (同じ日の再送、差分データとセットアップデータの境目) ため、
+開催日順に読み進めたセットアップデータでは終わったレースの記録から捨てられる。
+捨てたレースのレコードがもう一度来た場合は重複として検出されずに取り込まれるが、
+core への MERGE は同じキーの行を上書きするため、raw に行が増えるだけで結果は変わらない。
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+try:
+    from .parsing import JvParser, RawRecord
+except ImportError:
+    from parsing import JvParser, RawRecord
+
+
+class RecordDeduplicator:
+    """
+    (レコード種別, レースキー) ごとに取り込んだレコードのダイジェストを記録する
+
+    record_types を指定した場合はその種別だけを対象にする。
+    未定義の種別・短すぎるレコードなど view で開けないレコードは重複とみなさない。
+    max_keys: 記録する (種別, レースキー) の上限 (超えた分は LRU で捨てる)
+    """
+    def __init__(self, parser: JvParser, record_types: Optional[Iterable[str]] = None,
+                 max_keys: int = 20000):
+        self.parser = parser
+        self.record_types = set(record_types) if record_types else None
+        self.max_keys = max(1, max_keys)
+        # (種別, レースキー) -> ダイジェストの集合 (最後に使ったものが末尾)
+        self.seen: "OrderedDict[tuple, Set[bytes]]" = OrderedDict()
+        # レコード種別ごとの読み飛ばした件数
+        self.stats: Dict[str, int] = {}
+        # 上限を超えて捨てた (種別, レースキー) の数
+        self.evicted = 0
+
+    def is_duplicate(self, raw_data: RawRecord) -> bool:
+        """
+        raw_data が既に取り込んだレコードと同じ内容なら True を返す (初出のレコードは記録して False)
+        """
+        view = self.parser.view(raw_data)
+        if view is None:
+            return False
+        record_type = view.record_type
+        if self.record_types is not None and record_type not in self.record_types:
+            return False
+        digest = hashlib.blake2b(view.raw_bytes, digest_size=8).digest()
+        key = (record_type,) + view.race_key
+        digests = self.seen.get(key)
+        if digests is None:
+            digests = self.seen[key] = set()
+            if len(self.seen) > self.max_keys:
+                self.seen.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.seen.move_to_end(key)
+        if digest in digests:
+            self.stats[record_type] = self.stats.get(record_type, 0) + 1
+            return True
+        digests.add(digest)
+        return False
@@ -0,0 +1,68 @@
+"""
+取り込み済みの JV ファイルを記録する、実行をまたいで使うマニフェスト (_ingest_manifest.jsonl)。
+
+JV ファイル1つ分のレコードをすべて書き出した後に、ファイル名・データ種別・レコード数を1行追記する。
+次回以降の実行では、ここに記録されたファイルを JVLinkClient.read(skip_files=...) で
+JVSkip により読み飛ばす (--from の期間が重なる取得や、差分取得の繰り返しで同じファイルを読み直さない)。
+
+チェックポイント (checkpoint.py) は1回の取り込みの中断・再開用で、完了すると使われなくなるのに対し、
+こちらは出力ディレクトリに対して取り込んだファイルをすべて記録し続ける。
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+INGEST_MANIFEST_FILENAME = "_ingest_manifest.jsonl"
+
+
+class IngestManifest:
+    """
+    取り込み済みの JV ファイル名とレコード数
+
+    ファイルへは追記のみ行う (途中で中断しても、それまでの行は失われない)。
+    同じファイル名が複数回記録されている場合は最後の行を使う。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書き込み途中で中断した最後の行
+                        continue
+                    self.files[entry["file"]] = entry
+            logger.info("Ingest manifest %s: %s JV files already ingested", path, len(self.files))
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def records(self, filename: str) -> Optional[int]:
+        entry = self.files.get(filename)
+        return entry["records"] if entry else None
+
+    def add(self, filename: str, records: int, dataspec: str, fromtime: str):
+        """
+        JV ファイル1つの取り込み完了を記録する (出力をディスクに同期した後に呼ぶ)
+        """
+        entry = {
+            "file": filename,
+            "records": records,
+            "dataspec": dataspec,
+            "fromtime": fromtime,
+            "ingested_at": datetime.now().isoformat(),
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.files[filename] = entry
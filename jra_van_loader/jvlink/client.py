@@ -1,30 +1,103 @@
 import os
 import sys
+import time
 import logging
-import win32com.client
-import pythoncom
 
 # ロガー設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class AdaptivePoller:
+    """
+    短い間隔から始め、状況が変わらない間は間隔を伸ばしていく待機 (指数バックオフ)
+    進捗があったら reset() で最初の間隔に戻す
+    """
+    def __init__(self, initial: float = 0.05, maximum: float = 1.0, factor: float = 2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.interval = initial
+
+    def wait(self):
+        time.sleep(self.interval)
+        self.interval = min(self.interval * self.factor, self.maximum)
+
+    def reset(self):
+        self.interval = self.initial
+
+
+class DownloadProgress:
+    """
+    JVStatus のダウンロード済みファイル数から進捗と残り時間 (ETA) をログに出す
+    """
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+
+    @property
+    def eta(self):
+        if self.done <= 0 or self.total <= 0:
+            return None
+        elapsed = time.monotonic() - self.started
+        return elapsed / self.done * (self.total - self.done)
+
+    def update(self, done: int) -> bool:
+        """
+        進捗を更新する。ダウンロード済みファイル数が増えた場合は True を返す
+        """
+        if done <= self.done:
+            return False
+        self.done = done
+        eta = self.eta
+        eta_str = f"{eta:.1f}s" if eta is not None else "unknown"
+        logger.info(f"Downloading... {done}/{self.total} ({done * 100 // max(self.total, 1)}%), ETA {eta_str}")
+        return True
+
+    @property
+    def completed(self) -> bool:
+        return self.done >= self.total
+
+
 class JVLinkClient:
     """
     JRA-VAN JV-Link クライアント (win32com版)
     DllSurrogateを利用して64bit Pythonから32bit JV-Link COMを操作する。
+
+    backend を指定した場合は COM の代わりにそのオブジェクトを使う
+    (JV-Link と同じメソッドを持つもの。例: jvlink.replay.ReplayJVLink)。
     """
-    def __init__(self, sid: str = "AntigravityPy"):
+    def __init__(self, sid: str = "AntigravityPy", backend=None):
         self.sid = sid
         self.jv = None
         self.is_open = False
+        # ダウンロード待ちの進捗とポーリング間隔
+        self.progress = None
+        self.poller = AdaptivePoller()
+        # JVOpen の結果 (チェックポイント用)
+        self.read_count = 0
+        self.download_count = 0
+        self.last_timestamp = ""
+        # 読み込み中の JV ファイル名と、JVRead が正常終了 (Code 0) したかどうか
+        self.current_file = None
+        self.read_completed = False
+        # 読み終えた JV ファイルごとのレコード数と、JVSkip で読み飛ばしたファイル名
+        self.file_records = {}
+        self.skipped_files = []
         
         try:
-            # COMオブジェクトの生成
-            # レジストリ設定(DllSurrogate)が正しければ、ここでdllhost.exe経由でJV-Linkが起動する
-            # EnsureDispatchを使うと、タイプライブラリからPythonコードを生成し、厳密な型チェックと引数処理が行われる
-            # JVReadなどのByRef引数を正しく扱うために重要
-            self.jv = win32com.client.gencache.EnsureDispatch("JVDTLab.JVLink")
-            logger.info("JV-Link COM Object created (EnsureDispatch).")
+            if backend is None:
+                # COMオブジェクトの生成
+                # レジストリ設定(DllSurrogate)が正しければ、ここでdllhost.exe経由でJV-Linkが起動する
+                # EnsureDispatchを使うと、タイプライブラリからPythonコードを生成し、厳密な型チェックと引数処理が行われる
+                # JVReadなどのByRef引数を正しく扱うために重要
+                # (win32com は Windows 専用なので、COM を使う場合だけ読み込む)
+                import win32com.client
+                self.jv = win32com.client.gencache.EnsureDispatch("JVDTLab.JVLink")
+                logger.info("JV-Link COM Object created (EnsureDispatch).")
+            else:
+                self.jv = backend
+                logger.info(f"Using JV-Link backend: {type(backend).__name__}")
             
             # 初期化
             res = self.jv.JVInit(self.sid)
@@ -42,9 +115,14 @@ class JVLinkClient:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
-    def open(self, dataspec: str, fromtime: str, option: int = 1):
+    def open(self, dataspec: str, fromtime: str, option: int = 1, wait: bool = True,
+             poll_interval: float = 0.05, max_poll_interval: float = 1.0):
         """
         データ取得プロセスを開始する
+
+        wait=True の場合は全ファイルのダウンロード完了まで待つ。
+        wait=False の場合はすぐに戻り、read() がダウンロード済みのファイルから順に返す (ストリーミング)。
+        JVStatus のポーリング間隔は poll_interval から始めて、進捗がない間は max_poll_interval まで伸ばす。
         """
         logger.info(f"Opening JV-Link stream: spec={dataspec}, from={fromtime}")
         
@@ -55,61 +133,126 @@ class JVLinkClient:
             res = self.jv.JVOpen(dataspec, fromtime, option, 0, 0, "")
             
             ret_code = res
+            read_count = 0
             download_count = 0
+            last_timestamp = ""
             if isinstance(res, tuple):
                 ret_code = res[0]
+                if len(res) > 1:
+                    read_count = res[1]
                 if len(res) > 2:
                     # ユーザー情報: returnval[2] が downloadcount
                     download_count = res[2]
+                if len(res) > 3:
+                    # 今回の取得対象の最新タイムスタンプ (次回の差分取得の fromtime に使う)
+                    last_timestamp = res[3]
             
+            self.read_completed = False
+            if ret_code == -1:
+                # 該当データなし (差分取得で新しいデータがない場合など)。エラーではなく、読み込むものがないだけ
+                logger.info("JVOpen: no data to read (Code -1).")
+                self.read_count = 0
+                self.download_count = 0
+                self.read_completed = True
+                self.jv.JVClose()
+                return
             if ret_code != 0:
                 raise RuntimeError(f"JVOpen failed with code: {ret_code}")
                 
             self.is_open = True
-            logger.info(f"JVOpen success. Download count: {download_count}, Return Code: {ret_code}")
+            self.read_count = read_count
+            self.download_count = download_count
+            self.last_timestamp = last_timestamp
+            logger.info(f"JVOpen success. Read count: {read_count}, Download count: {download_count}, "
+                        f"Last timestamp: {last_timestamp}, Return Code: {ret_code}")
             
-            # ダウンロード待ち (JVStatus)
-            # JVOpen直後にダウンロードが始まるため、完了するまで待つ必要があるかもしれない
-            import time
-            while True:
-                status = self.jv.JVStatus()
-                # JVStatus戻り値:
-                # 正の値: ダウンロード済みファイル数
-                # 負の値: エラーコード？ いや、仕様では「残りファイル数」の可能性もあるが、通常は進捗
-                # ユーザー情報では: downloadcount == status で完了
-                
-                if status < 0:
-                     logger.error(f"JVStatus returned error: {status}")
-                     break
-                     
-                if status == download_count:
-                     logger.info(f"Download completed: {status}/{download_count}")
-                     break
-                else:
-                     logger.info(f"Downloading... {status}/{download_count}")
-                     time.sleep(1)
+            self.progress = DownloadProgress(download_count)
+            self.poller = AdaptivePoller(poll_interval, max_poll_interval)
+            if wait:
+                self.wait_for_download()
             
         except Exception as e:
             logger.error(f"JVOpen/Status Error: {e}")
             self.close()
             raise e
 
-    def read(self):
+    def poll_status(self) -> int:
+        """
+        JVStatus を1回呼んで進捗を更新する
+        JVStatus戻り値:
+        正の値: ダウンロード済みファイル数 (downloadcount == status で完了)
+        負の値: エラー
+        """
+        status = self.jv.JVStatus()
+        if status < 0:
+            logger.error(f"JVStatus returned error: {status}")
+        elif self.progress is not None and self.progress.update(status):
+            self.poller.reset()
+        return status
+
+    def wait_for_download(self):
+        """
+        ダウンロード完了まで JVStatus をポーリングする (JVOpen直後にダウンロードが始まる)
+        """
+        if self.progress is None or self.progress.completed:
+            return
+        while True:
+            status = self.poll_status()
+            if status < 0:
+                break
+            if self.progress.completed:
+                logger.info(f"Download completed: {status}/{self.progress.total}")
+                break
+            self.poller.wait()
+
+    def _end_file(self, on_file_end, skipping: bool, records: int):
+        # 読み込み中の JV ファイルが終わった (スキップしたファイルは通知しない)
+        if self.current_file and not skipping:
+            self.file_records[self.current_file] = records
+            if on_file_end is not None:
+                on_file_end(self.current_file)
+        self.current_file = None
+
+    def read(self, as_bytes: bool = False, on_file_end=None, skip_files=None):
         """
         データを1行ずつ読み込むジェネレータ
+
+        as_bytes=True の場合は JVGets (バイト配列版の読み込み) を使い、
+        COM 側で文字列に変換せず CP932 のバイト列 (bytes / memoryview) をそのまま返す。
+
+        on_file_end: JV ファイル1つ分のレコードをすべて返し終えたときに、そのファイル名で呼ばれる
+                     (呼び出し時点で、そのファイルのレコードはすべて呼び出し元に渡し済み)
+        skip_files: 取り込み済みの JV ファイル名の集合 (in 演算子が使えるもの)。該当ファイルは JVSkip で読み飛ばす
+        読み終えたファイルのレコード数は file_records に、読み飛ばしたファイル名は skipped_files に記録する
         """
         if not self.is_open:
             return
 
-        # バッファサイズ: JRA-VANの最大レコード長に合わせる (40KB)
-        buff_size = 40960
+        self.current_file = None
+        self.read_completed = False
+        self.file_records = {}
+        self.skipped_files = []
+        skipping = False
+        file_records = 0
+
+        # バッファサイズ: JRA-VANの最大レコード長に合わせる
+        # (最大は H6 票数3連単の 102890 バイト。40KB では O6/H6 が切り詰められる)
+        buff_size = 110000
         
         while True:
             try:
-                # JVRead("", size, "")
-                # win32com + EnsureDispatch では、[in, out] 引数はタプルとして返ってくる
-                # 戻り値構造: (RetCode, DataString, BufferSize, Filename)
-                result = self.jv.JVRead("", int(buff_size), "")
+                if as_bytes:
+                    # JVGets(buff, size, filename)
+                    # 戻り値構造: (RetCode, ByteArray, Filename)
+                    result = self.jv.JVGets(None, int(buff_size), "")
+                    data_index, filename_index = 1, 2
+                else:
+                    # JVRead("", size, "")
+                    # win32com + EnsureDispatch では、[in, out] 引数はタプルとして返ってくる
+                    # 戻り値構造: (RetCode, DataString, BufferSize, Filename)
+                    result = self.jv.JVRead("", int(buff_size), "")
+                    # Index 3: Filename (Index 2 is likely the input buffer size echoed back)
+                    data_index, filename_index = 1, 3
                 
                 ret_code = 0
                 raw_data = ""
@@ -118,16 +261,34 @@ class JVLinkClient:
                 if isinstance(result, tuple):
                     ret_code = result[0]
                     # Index 1: Data
-                    if len(result) > 1:
-                         raw_data = result[1]
-                    # Index 3: Filename (Index 2 is likely the input buffer size echoed back)
-                    if len(result) > 3:
-                         filename = result[3]
+                    if len(result) > data_index:
+                         raw_data = result[data_index]
+                    if len(result) > filename_index:
+                         filename = result[filename_index]
                 else:
                     ret_code = result
                     logger.warning(f"JVRead returned non-tuple: {result}")
 
+                if as_bytes and raw_data and ret_code > 0:
+                    # JVGets の戻り値は読み込んだバイト数。バッファの余りは捨てる
+                    raw_data = memoryview(raw_data)[:ret_code]
+
+                if ret_code > 0 and filename and filename != self.current_file:
+                     # ファイル切り替わり (-1) を経ずにファイル名が変わった場合も前のファイルは完了とみなす
+                     self._end_file(on_file_end, skipping, file_records)
+                     self.current_file = filename
+                     file_records = 0
+                     skipping = skip_files is not None and filename in skip_files
+                     if skipping:
+                         # 取り込み済みのファイルは残りのレコードを読まずに次のファイルへ進む
+                         logger.info(f"Skipping already ingested file: {filename}")
+                         self.skipped_files.append(filename)
+                         self.jv.JVSkip()
+                         continue
+
                 if ret_code == 0: # 完了
+                     self._end_file(on_file_end, skipping, file_records)
+                     self.read_completed = True
                      logger.info("JVRead completed (Code 0).")
                      break
                 elif ret_code == -1: # ファイル切り替わり
@@ -136,13 +297,21 @@ class JVLinkClient:
                          logger.info(f"File switched to: {filename}")
                      
                      # 切り替わりタイミングでもデータが含まれる場合があるためyield
-                     if raw_data: 
+                     if raw_data and not skipping:
+                         file_records += 1
                          yield raw_data
+                     self._end_file(on_file_end, skipping, file_records)
+                     skipping = False
                      continue
                 elif ret_code > 0: # 正常読み込み
                      # データがあればyield
-                     if raw_data:
+                     if raw_data and not skipping:
+                         file_records += 1
                          yield raw_data
+                elif ret_code == -3: # ダウンロード中 (次のファイルがまだダウンロードされていない)
+                     if self.poll_status() < 0:
+                         break
+                     self.poller.wait()
                 else:
                      logger.error(f"JVRead error code: {ret_code}")
                      break
@@ -151,6 +320,14 @@ class JVLinkClient:
                 logger.error(f"JVRead Exception: {e}")
                 break
 
+    def close_stream(self):
+        """
+        JVOpen で開始したデータ取得を終了する (JV-Link のセッションは維持し、続けて JVOpen できる)
+        """
+        if self.jv and self.is_open:
+            self.jv.JVClose()
+        self.is_open = False
+
     def close(self):
         """
         接続を閉じる
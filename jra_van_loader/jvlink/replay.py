@@ -0,0 +1,266 @@
+"""
+JV-Link COM の代わりに、記録済みのレコードファイルや合成レコードを返す再生用バックエンド。
+
+JVLinkClient(backend=ReplayJVLink(...)) として使うと、Windows / JV-Link なしで
+main.py + DataSaver の取り込み処理を動かしたり、スループットを計測したりできる。
+
+JV-Link と同じメソッド (JVInit / JVOpen / JVStatus / JVRead / JVGets / JVSkip / JVClose) と
+戻り値の形 (win32com の [in, out] 引数を含むタプル) を再現する。
+- JVRead / JVGets: >0 = 読み込んだバイト数, -1 = ファイル切り替わり, 0 = 全ファイル読み込み完了,
+  -3 = ダウンロード中 (download_delay 指定時), その他の負値 = エラー (fail_after 指定時)
+- JVOpen: release_interval を指定した場合は、JV ファイルが release_interval 秒ごとに1つずつ
+  公開されていく状況を再現する (各ファイルのタイムスタンプが fromtime より新しく、公開済みのものだけを返す。
+  該当するファイルがなければ -1 = 該当データなし)。ウォッチモード (watch.py) の確認用
+- JVStatus: ダウンロード済みファイル数
+- JVSkip: 読み込み中のファイルの残りを読み飛ばす (読み飛ばしたレコード数を records_skipped に数える)
+
+再生元:
+- ディレクトリ / ファイル: *.jsonl / *.jsonl.gz (DataSaver の出力) は各行の raw_data を、
+  それ以外のファイルは1行1レコード (CP932) として読み込む。ファイル1つを JV ファイル1つとして返す
+- ReplayJVLink.synthetic(): RECORD_SPECS のレイアウトに沿った合成レコードを生成する
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from glob import glob
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+try:
+    from ..schema.definitions import RECORD_SPECS
+except ImportError:
+    from schema.definitions import RECORD_SPECS
+
+logger = logging.getLogger(__name__)
+
+# JV-Data 仕様上のレコード長 (末尾の CRLF を含む)。
+# RECORD_SPECS は主要項目のみ定義しているため、定義の終端より長い種別はここで補う
+RECORD_LENGTHS = {
+    "RA": 1272,
+    "SE": 555,
+}
+
+# 合成データの既定の構成 (1レース分): レース詳細・馬毎レース情報 x 14頭・払戻・オッズ
+DEFAULT_SYNTHETIC_TYPES = ("RA",) + ("SE",) * 14 + ("HR", "O1", "O2", "O3", "O4")
+
+JVFile = Tuple[str, List[bytes]]
+
+
+def _record_length(record_spec: str) -> int:
+    if record_spec in RECORD_LENGTHS:
+        return RECORD_LENGTHS[record_spec]
+    fields = RECORD_SPECS.get(record_spec, [])
+    return max((f.start + f.length for f in fields), default=27) + 2
+
+
+def synthetic_record(record_spec: str, race_index: int, make_date: str = "20240101") -> bytes:
+    """
+    共通ヘッダだけ値を持ち、残りを "0" で埋めた合成レコード (CP932 バイト列) を生成する
+    """
+    header = (
+        record_spec.encode("cp932") + b"7" + make_date.encode("ascii") + make_date[:4].encode("ascii")
+        + make_date[4:].encode("ascii")
+        + b"%02d" % (race_index // 12 % 10 + 1) + b"01" + b"01" + b"%02d" % (race_index % 12 + 1)
+    )
+    length = _record_length(record_spec)
+    return header + b"0" * (length - len(header) - 2) + b"\r\n"
+
+
+def _read_records(path: str) -> List[bytes]:
+    if path.endswith(".jsonl") or path.endswith(".jsonl.gz"):
+        opener = gzip.open if path.endswith(".gz") else open
+        records = []
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                raw = json.loads(line).get("raw_data")
+                if raw:
+                    records.append(raw.encode("cp932", errors="replace"))
+        return records
+    with open(path, "rb") as f:
+        return [line for line in f.read().splitlines(keepends=True) if line.strip()]
+
+
+class ReplayJVLink:
+    """
+    JV-Link (JVDTLab.JVLink) の再生用スタンドイン
+
+    rate: 1秒あたりに返すレコード数の上限 (None は無制限)
+    download_delay: JV ファイル1つのダウンロードにかかる秒数 (0 の場合はダウンロード済み扱い)
+    fail_after: 指定したレコード数を返した後、JVRead / JVGets が fail_code を返す (エラー再現用)
+    release_interval: JV ファイルを1つ公開する間隔 (秒)。None の場合は全ファイルを最初から公開済みとする
+    """
+    def __init__(
+        self,
+        files: Sequence[JVFile],
+        rate: Optional[float] = None,
+        download_delay: float = 0.0,
+        fail_after: Optional[int] = None,
+        fail_code: int = -502,
+        last_timestamp: Optional[str] = None,
+        release_interval: Optional[float] = None,
+    ):
+        self.files = [(name, records) for name, records in files if records]
+        self.release_interval = release_interval
+        self._source_files = self.files
+        self._created_at = time.monotonic()
+        self.rate = rate
+        self.download_delay = download_delay
+        self.fail_after = fail_after
+        self.fail_code = fail_code
+        self.last_timestamp = last_timestamp or datetime.now().strftime("%Y%m%d%H%M%S")
+        # 公開モードでのファイルごとのタイムスタンプ (1ファイルごとに1秒ずつ進める)
+        base = datetime.strptime(self.last_timestamp, "%Y%m%d%H%M%S")
+        self._file_timestamps = [
+            (base + timedelta(seconds=i)).strftime("%Y%m%d%H%M%S") for i in range(len(self.files))
+        ]
+        self.is_open = False
+        self.download_count = 0
+        self.records_returned = 0
+        self.records_skipped = 0
+        self._file_index = 0
+        self._record_index = 0
+        self._opened_at = None
+        self._read_started = None
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs) -> "ReplayJVLink":
+        """
+        記録済みのファイル (またはディレクトリ内の全ファイル) から生成する
+        """
+        if os.path.isdir(path):
+            paths = sorted(
+                p for p in glob(os.path.join(path, "*"))
+                if os.path.isfile(p) and not os.path.basename(p).startswith("_")
+            )
+        else:
+            paths = [path]
+        files = [(os.path.basename(p), _read_records(p)) for p in paths]
+        logger.info(f"Replay source: {len(files)} files, {sum(len(r) for _, r in files)} records from {path}")
+        return cls(files, **kwargs)
+
+    @classmethod
+    def synthetic(
+        cls,
+        files: int = 10,
+        races_per_file: int = 12,
+        record_types: Iterable[str] = DEFAULT_SYNTHETIC_TYPES,
+        **kwargs,
+    ) -> "ReplayJVLink":
+        """
+        合成レコードから生成する (JV ファイル1つ = races_per_file レース分)
+        """
+        record_types = tuple(record_types)
+        jv_files = []
+        race_index = 0
+        for file_index in range(files):
+            records = []
+            for _ in range(races_per_file):
+                records.extend(synthetic_record(spec, race_index) for spec in record_types)
+                race_index += 1
+            jv_files.append((f"SYNTH{file_index:05d}.jvd", records))
+        return cls(jv_files, **kwargs)
+
+    @property
+    def total_records(self) -> int:
+        return sum(len(records) for _, records in self._source_files)
+
+    # --- JV-Link API ---
+
+    def JVInit(self, sid: str) -> int:
+        return 0
+
+    def JVOpen(self, dataspec: str, fromtime: str, option: int, read_count=0, download_count=0, last_timestamp=""):
+        # 戻り値: (RetCode, readcount, downloadcount, lastTimestamp)
+        last_timestamp = self.last_timestamp
+        if self.release_interval is not None:
+            released = int((time.monotonic() - self._created_at) / self.release_interval) + 1
+            since = fromtime.split("-")[0][:14]
+            selected = [
+                i for i in range(min(released, len(self._source_files)))
+                if self._file_timestamps[i] > since
+            ]
+            self.files = [self._source_files[i] for i in selected]
+            if selected:
+                last_timestamp = self._file_timestamps[selected[-1]]
+        if not self.files:
+            # 該当データなし
+            return (-1, 0, 0, "")
+        self.is_open = True
+        self._file_index = 0
+        self._record_index = 0
+        self._opened_at = time.monotonic()
+        self._read_started = None
+        self.records_returned = 0
+        self.records_skipped = 0
+        self.download_count = len(self.files) if self.download_delay > 0 else 0
+        return (0, len(self.files), self.download_count, last_timestamp)
+
+    def JVStatus(self) -> int:
+        if not self.is_open:
+            return -201
+        return self._downloaded()
+
+    def _downloaded(self) -> int:
+        if self.download_delay <= 0:
+            return self.download_count
+        elapsed = time.monotonic() - self._opened_at
+        return min(self.download_count, int(elapsed / self.download_delay))
+
+    def _next(self):
+        """
+        次に返すもの: (RetCode, レコード, ファイル名)
+        """
+        if not self.is_open:
+            return -201, None, ""
+        if self._file_index >= len(self.files):
+            return 0, None, ""
+        name, records = self.files[self._file_index]
+        if self._record_index >= len(records):
+            # ファイルの終わり: 次の呼び出しから次のファイルを返す
+            self._file_index += 1
+            self._record_index = 0
+            return -1, None, name
+        if self.download_delay > 0 and self._file_index >= self._downloaded():
+            return -3, None, ""
+        if self.fail_after is not None and self.records_returned >= self.fail_after:
+            return self.fail_code, None, ""
+
+        self._throttle()
+        record = records[self._record_index]
+        self._record_index += 1
+        self.records_returned += 1
+        return len(record), record, name
+
+    def _throttle(self):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        if self._read_started is None:
+            self._read_started = now
+        ahead = self.records_returned / self.rate - (now - self._read_started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def JVRead(self, buff="", size=0, filename=""):
+        # 戻り値: (RetCode, DataString, BufferSize, Filename)
+        ret, record, name = self._next()
+        data = record.decode("cp932", errors="replace") if record is not None else ""
+        return (ret, data, size, name)
+
+    def JVGets(self, buff=None, size=0, filename=""):
+        # 戻り値: (RetCode, ByteArray, Filename)
+        ret, record, name = self._next()
+        return (ret, bytearray(record) if record is not None else None, name)
+
+    def JVSkip(self):
+        # 読み込み中のファイルの残りを読み飛ばす
+        if self.is_open and self._file_index < len(self.files):
+            records = self.files[self._file_index][1]
+            self.records_skipped += len(records) - self._record_index
+            self._record_index = len(records)
+
+    def JVClose(self) -> int:
+        self.is_open = False
+        return 0
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Iterable, NamedTuple
+
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+try:
+    from .bq_metrics import track_job
+except ImportError:
+    from bq_metrics import track_job
+
+logger = logging.getLogger(__name__)
+
+LOAD_MANIFEST_FILENAME = "_load_manifest.jsonl"
+
+CONTROL_TABLE_SCHEMA = [
+    bigquery.SchemaField("file", "STRING", mode="REQUIRED", description="Path relative to the input directory"),
+    bigquery.SchemaField("start", "INT64", description="First loaded byte"),
+    bigquery.SchemaField("size", "INT64", description="Bytes loaded through (end offset)"),
+    bigquery.SchemaField("file_size", "INT64", description="File size when it was planned"),
+    bigquery.SchemaField("mtime", "FLOAT64", description="File mtime when it was planned"),
+    bigquery.SchemaField("sha256", "STRING", description="SHA-256 of bytes [0, size)"),
+    bigquery.SchemaField("batch_id", "STRING"),
+    bigquery.SchemaField("state", "STRING", description="loaded, or pending while the batch is appended to raw"),
+    bigquery.SchemaField("loaded_at", "TIMESTAMP"),
+]
+
+LOADED = "loaded"
+# Recorded before a batch is appended to a raw table: rows with its batch_id may be in raw
+# although the batch did not finish, and are deleted before the files are loaded again.
+PENDING = "pending"
+
+_HASH_BLOCK = 1024 * 1024
+
+
+class LoadPiece(NamedTuple):
+    """A file, or the byte range [start, end) of an appended JSONL file, to load in one job."""
+
+    path: str
+    start: int = 0
+    end: int | None = None
+    sha256: str | None = None
+    file_size: int | None = None
+    mtime: float | None = None
+
+    @property
+    def size(self) -> int:
+        end = self.end if self.end is not None else os.path.getsize(self.path)
+        return end - self.start
+
+
+def _is_appendable(file_path: str) -> bool:
+    # Only plain JSONL can be loaded from a byte offset; gzip streams and Parquet are loaded whole.
+    return file_path.endswith(".jsonl")
+
+
+def _last_line_end(file_path: str, size: int) -> int:
+    """Offset just past the last newline before size (a record being written is left out)."""
+    with open(file_path, "rb") as f:
+        pos = size
+        while pos > 0:
+            block = min(_HASH_BLOCK, pos)
+            f.seek(pos - block)
+            data = f.read(block)
+            index = data.rfind(b"\n")
+            if index >= 0:
+                return pos - block + index + 1
+            pos -= block
+    return 0
+
+
+def _hash_prefixes(file_path: str, checkpoint: int | None, end: int) -> tuple[str | None, str]:
+    """SHA-256 of bytes [0, checkpoint) and [0, end) in one pass."""
+    hasher = hashlib.sha256()
+    prefix_hash = None
+    position = 0
+    with open(file_path, "rb") as f:
+        while position < end:
+            limit = end
+            if checkpoint is not None and position < checkpoint:
+                limit = checkpoint
+            data = f.read(min(_HASH_BLOCK, limit - position))
+            if not data:
+                break
+            hasher.update(data)
+            position += len(data)
+            if checkpoint is not None and position == checkpoint:
+                prefix_hash = hasher.hexdigest()
+    if checkpoint == 0:
+        prefix_hash = hashlib.sha256().hexdigest()
+    return prefix_hash, hasher.hexdigest()
+
+
+class LoadManifest:
+    """Files and byte ranges already loaded into BigQuery.
+
+    Entries are appended to a local JSONL file in the input directory and, when a control table
+    is given, inserted into that BigQuery table as well (so a fresh checkout or another machine
+    sees the same history). The latest entry per file wins.
+    Pending entries (see begin) are kept apart from the loaded ones, so an unfinished batch does
+    not change which bytes of a file count as loaded.
+    """
+
+    def __init__(
+        self,
+        input_dir: str,
+        path: str | None = None,
+        client: bigquery.Client | None = None,
+        control_table_id: str | None = None,
+    ):
+        self.input_dir = input_dir
+        self.path = path or os.path.join(input_dir, LOAD_MANIFEST_FILENAME)
+        self.client = client
+        self.control_table_id = control_table_id
+        self.entries: dict[str, dict] = {}
+        self.pending: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._add_entry(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Last line of an interrupted run.
+                        continue
+        if control_table_id:
+            self._read_control_table()
+        logger.info("Load manifest: %s files already loaded", len(self.entries))
+
+    def _add_entry(self, entry: dict) -> None:
+        entries = self.pending if entry.get("state") == PENDING else self.entries
+        current = entries.get(entry["file"])
+        if current is None or entry["loaded_at"] >= current["loaded_at"]:
+            entries[entry["file"]] = entry
+
+    def _read_control_table(self) -> None:
+        table = bigquery.Table(self.control_table_id, schema=CONTROL_TABLE_SCHEMA)
+        try:
+            self.client.get_table(self.control_table_id)
+        except NotFound:
+            self.client.create_table(table, exists_ok=True)
+            logger.info("Created load control table %s", self.control_table_id)
+            return
+        query = f"""
+        SELECT * EXCEPT(_rn)
+        FROM (
+          SELECT
+            *,
+            ROW_NUMBER() OVER (PARTITION BY file, IFNULL(state, '{LOADED}') ORDER BY loaded_at DESC) AS _rn
+          FROM `{self.control_table_id}`
+        )
+        WHERE _rn = 1
+        """
+        for row in track_job(self.client.query(query), f"read {self.control_table_id}"):
+            entry = dict(row.items())
+            entry["loaded_at"] = entry["loaded_at"].isoformat()
+            self._add_entry(entry)
+
+    def key(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.input_dir).replace(os.sep, "/")
+
+    def plan(self, file_path: str, force: bool = False) -> LoadPiece | None:
+        """Return what still has to be loaded from file_path, or None if it is fully loaded.
+
+        Unchanged files (same size and mtime) are skipped without reading them. A JSONL file that
+        grew, and whose previously loaded bytes still hash the same, yields only the appended
+        range. Any other change reloads the whole file.
+        """
+        stat = os.stat(file_path)
+        entry = None if force else self.entries.get(self.key(file_path))
+        if entry and entry.get("file_size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            return None
+
+        end = _last_line_end(file_path, stat.st_size) if _is_appendable(file_path) else stat.st_size
+        if end == 0:
+            return None
+        loaded = entry["size"] if entry and _is_appendable(file_path) and entry["size"] <= end else None
+        prefix_hash, full_hash = _hash_prefixes(file_path, loaded, end)
+
+        if entry and entry.get("sha256") == full_hash and entry["size"] == end:
+            # Same content (e.g. only touched, or only a partial line was added): remember the new stat.
+            self.record([LoadPiece(file_path, end, end, full_hash, stat.st_size, stat.st_mtime)], entry.get("batch_id"))
+            return None
+        if loaded is not None and prefix_hash == entry.get("sha256"):
+            return LoadPiece(file_path, loaded, end, full_hash, stat.st_size, stat.st_mtime)
+        if entry:
+            logger.warning("%s changed since it was loaded; loading the whole file again", self.key(file_path))
+        return LoadPiece(file_path, 0, end, full_hash, stat.st_size, stat.st_mtime)
+
+    def pending_batches(self, pieces: Iterable[LoadPiece]) -> set[str]:
+        """Batch ids of unfinished earlier attempts at loading these files."""
+        batch_ids = set()
+        for piece in pieces:
+            key = self.key(piece.path)
+            pending, loaded = self.pending.get(key), self.entries.get(key)
+            if pending and pending.get("batch_id") and (loaded is None or pending["loaded_at"] > loaded["loaded_at"]):
+                batch_ids.add(pending["batch_id"])
+        return batch_ids
+
+    def begin(self, pieces: Iterable[LoadPiece], batch_id: str) -> None:
+        """Record pieces as pending before batch_id is appended to a raw table."""
+        self.record(pieces, batch_id, state=PENDING)
+
+    def record(self, pieces: Iterable[LoadPiece], batch_id: str | None, state: str = LOADED) -> None:
+        """Record pieces as loaded (call after the batch containing them succeeded)."""
+        loaded_at = datetime.now().isoformat()
+        rows = [
+            {
+                "file": self.key(piece.path),
+                "start": piece.start,
+                "size": piece.end if piece.end is not None else piece.file_size,
+                "file_size": piece.file_size,
+                "mtime": piece.mtime,
+                "sha256": piece.sha256,
+                "batch_id": batch_id,
+                "state": state,
+                "loaded_at": loaded_at,
+            }
+            for piece in pieces
+        ]
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            for row in rows:
+                self._add_entry(row)
+        if self.control_table_id:
+            errors = self.client.insert_rows_json(self.control_table_id, rows)
+            if errors:
+                logger.warning("Failed to record %s rows in %s: %s", len(rows), self.control_table_id, errors)
@@ -1,12 +1,30 @@
 import argparse
+import gzip
+import json
 import logging
 import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
 from glob import glob
-from typing import Iterable
+from typing import BinaryIO, Iterable, Iterator
 
 from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 
+try:
+    from . import bq_metrics
+    from .bq_metrics import track_job
+    from .load_manifest import LoadManifest, LoadPiece
+    from .schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
+except ImportError:
+    import bq_metrics
+    from bq_metrics import track_job
+    from load_manifest import LoadManifest, LoadPiece
+    from schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -19,6 +37,42 @@ MERGE_KEYS: dict[str, list[str]] = {
 }
 
 
+INPUT_PATTERNS = ("*.jsonl", "*.jsonl.gz", "*.parquet")
+
+# Core tables are partitioned by month of this column (derived from Year + MonthDay) and
+# clustered by it plus the leading race key columns.
+PARTITION_COLUMN = "race_date"
+RACE_DATE_COLUMNS = ("Year", "MonthDay")
+
+SCHEMA_MODES = ("autodetect", "explicit")
+
+# Field.dtype -> BigQuery type for files written with JvParser(typed=True).
+BQ_TYPES: dict[str, str] = {
+    "str": "STRING",
+    "code": "STRING",
+    "int": "INT64",
+    "decimal": "FLOAT64",
+    "date": "DATE",
+}
+
+# Column added to every loaded row, identifying the load batch (one upload) it came from.
+BATCH_ID_COLUMN = "_batch_id"
+
+DEFAULT_CONCURRENCY = 8
+# Upper bound on the input bytes combined into one load job.
+DEFAULT_BATCH_BYTES = 4 * 1024**3
+
+
+def list_input_files(input_dir: str) -> list[str]:
+    # Chunks still being written end with ".part" and are not matched, so finished chunks
+    # can be loaded while ingestion continues. Files starting with "_" are loader bookkeeping
+    # (chunk manifest, checkpoints) rather than record data.
+    files: list[str] = []
+    for pattern in INPUT_PATTERNS:
+        files.extend(glob(os.path.join(input_dir, pattern)))
+    return sorted(f for f in files if not os.path.basename(f).startswith("_"))
+
+
 def infer_record_type(file_path: str) -> str | None:
     filename = os.path.basename(file_path)
     parts = filename.split("_")
@@ -50,30 +104,252 @@ def create_dataset_if_not_exists(
         logger.info("Created dataset %s.%s in %s", client.project, dataset.dataset_id, location)
 
 
-def load_jsonl_to_table(
-    client: bigquery.Client,
+def _bq_field(item: Field, typed: bool) -> bigquery.SchemaField:
+    field_type = BQ_TYPES.get(item.dtype, "STRING") if typed else "STRING"
+    return bigquery.SchemaField(item.name, field_type, description=item.desc or None)
+
+
+def bigquery_schema(fields: list[SchemaItem], typed: bool) -> list[bigquery.SchemaField]:
+    """Build the table schema for JvParser.parse + DataSaver output of one record type.
+
+    With typed=False every parsed field is a STRING, matching the untyped JSONL output.
+    Repeating groups are not parsed at ingest time; group_view_sql expands them from raw_data.
+    """
+    return [
+        bigquery.SchemaField("record_type", "STRING"),
+        bigquery.SchemaField("_parsed", "BOOL"),
+        *[_bq_field(item, typed) for item in fields if not isinstance(item, Repeat)],
+        bigquery.SchemaField("raw_body", "STRING", description="Bytes after the last defined field"),
+        bigquery.SchemaField("fetched_at", "TIMESTAMP"),
+        bigquery.SchemaField("raw_data", "STRING"),
+        bigquery.SchemaField(BATCH_ID_COLUMN, "STRING", description="Load batch that wrote the row"),
+    ]
+
+
+def schema_for_record_type(record_type: str, schema_mode: str, typed: bool) -> list[bigquery.SchemaField] | None:
+    """Return the explicit schema for a record type, or None to fall back to autodetect."""
+    if schema_mode != "explicit" or record_type not in RECORD_SPECS:
+        return None
+    return bigquery_schema(RECORD_SPECS[record_type], typed)
+
+
+def _group_value_expr(field: Field, value: str) -> str:
+    if field.dtype == "int":
+        return f"SAFE_CAST({value} AS INT64)"
+    if field.dtype == "decimal":
+        divisor = f" / {10 ** field.scale}" if field.scale else ""
+        return f"SAFE_CAST({value} AS INT64){divisor}"
+    return f"NULLIF({value}, '')"
+
+
+def group_view_sql(record_type: str, group: Repeat, raw_table_id: str, view_id: str) -> str:
+    """SQL for a view with one row per element of a repeating group, expanded from raw_data.
+
+    Offsets in RECORD_SPECS are CP932 byte positions. They are used as character positions here,
+    which is exact for the all-ASCII odds, vote and payout records that define repeating groups.
+    Elements whose bytes are all blank (unregistered horses, unsold combinations) are skipped.
+    """
+    header = [f"t.`{f.name}`" for f in RECORD_SPECS[record_type] if isinstance(f, Field)]
+    element = f"SUBSTR(t.raw_data, {group.start + 1} + i * {group.stride}, {group.stride})"
+    columns = [
+        _group_value_expr(f, f"TRIM(SUBSTR({element}, {f.start + 1}, {f.length}))") + f" AS `{f.name}`"
+        for f in group.fields
+    ]
+    return f"""
+    CREATE OR REPLACE VIEW `{view_id}` AS
+    SELECT
+      {", ".join(header)},
+      i AS element_index,
+      {", ".join(columns)},
+      t.fetched_at
+    FROM `{raw_table_id}` AS t, UNNEST(GENERATE_ARRAY(0, {group.count - 1})) AS i
+    WHERE TRIM({element}) != ''
+    """
+
+
+def create_group_views(client: bigquery.Client, raw_dataset_id: str, record_types: Iterable[str]) -> None:
+    """Create a {record_type}_{group} view in the raw dataset for every repeating group."""
+    for record_type in record_types:
+        raw_table_id = get_table_id(client.project, raw_dataset_id, record_type)
+        for group in RECORD_SPECS.get(record_type, []):
+            if not isinstance(group, Repeat):
+                continue
+            view_id = get_table_id(client.project, raw_dataset_id, f"{record_type}_{group.name}")
+            track_job(client.query(group_view_sql(record_type, group, raw_table_id, view_id)), f"view {view_id}")
+            logger.info("Created view %s", view_id)
+
+
+def build_load_job_config(
     file_path: str,
-    table_id: str,
     write_disposition: str,
     allow_field_addition: bool,
-) -> None:
-    job_config = bigquery.LoadJobConfig(
-        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-        write_disposition=write_disposition,
-        autodetect=True,
-        ignore_unknown_values=True,
-    )
+    schema: list[bigquery.SchemaField] | None = None,
+) -> bigquery.LoadJobConfig:
+    if file_path.endswith(".parquet"):
+        # Parquet carries its own typed schema, so no autodetect is needed.
+        # List inference maps list<struct> columns to REPEATED RECORD instead of list.element wrappers.
+        parquet_options = bigquery.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=write_disposition,
+        )
+        job_config.parquet_options = parquet_options
+    elif schema is not None:
+        # An explicit schema skips the autodetect sampling and keeps column types stable across loads.
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=write_disposition,
+            schema=schema,
+            ignore_unknown_values=True,
+        )
+    else:
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=write_disposition,
+            autodetect=True,
+            ignore_unknown_values=True,
+        )
     if allow_field_addition:
         job_config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+    return job_config
 
-    filename = os.path.basename(file_path)
-    logger.info("Loading %s -> %s (%s)", filename, table_id, write_disposition)
-    with open(file_path, "rb") as source_file:
-        job = client.load_table_from_file(source_file, table_id, job_config=job_config)
-    job.result()
 
-    table = client.get_table(table_id)
-    logger.info("Loaded rows=%s columns=%s into %s", table.num_rows, len(table.schema), table_id)
+def group_files_by_record_type(
+    files: Iterable[str | LoadPiece], batch_bytes: int = DEFAULT_BATCH_BYTES
+) -> dict[str, list[list[LoadPiece]]]:
+    """Group files (or byte ranges of files) into load batches per record type.
+
+    JSONL files of one record type share a batch until batch_bytes is reached. Parquet files
+    cannot be concatenated, so each one is its own batch.
+    """
+    groups: dict[str, list[list[LoadPiece]]] = {}
+    batch_sizes: dict[str, int] = {}
+    for piece in files:
+        if isinstance(piece, str):
+            piece = LoadPiece(piece)
+        record_type = infer_record_type(piece.path)
+        if not record_type:
+            logger.warning("Skipping file with invalid name format: %s", os.path.basename(piece.path))
+            continue
+        batches = groups.setdefault(record_type, [])
+        size = piece.size
+        if piece.path.endswith(".parquet"):
+            batches.append([piece])
+            continue
+        open_batch = batches[-1] if batches and not batches[-1][0].path.endswith(".parquet") else None
+        if open_batch is None or batch_sizes[record_type] + size > batch_bytes:
+            batches.append([piece])
+            batch_sizes[record_type] = size
+        else:
+            open_batch.append(piece)
+            batch_sizes[record_type] += size
+    return groups
+
+
+def new_batch_id(record_type: str) -> str:
+    return f"{record_type}_{datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+
+def _tag_records(chunk: bytes, tag: bytes, at_line_start: bool) -> bytes:
+    # Every JSONL record is an object, so the batch id is inserted right after each line's "{".
+    tagged = chunk.replace(b"\n{", b"\n{" + tag)
+    if at_line_start and tagged.startswith(b"{"):
+        tagged = b"{" + tag + tagged[1:]
+    return tagged
+
+
+def _write_tagged_parquet(file_path: str, out: BinaryIO, batch_id: str) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(file_path)
+    table = table.append_column(BATCH_ID_COLUMN, pa.array([batch_id] * table.num_rows, pa.string()))
+    pq.write_table(table, out, compression="zstd")
+
+
+def _read_range(source_file: BinaryIO, piece: LoadPiece) -> Iterator[bytes]:
+    if piece.path.endswith(".gz") or piece.end is None:
+        # Compressed files are always loaded whole.
+        while chunk := source_file.read(1024 * 1024):
+            yield chunk
+        return
+    source_file.seek(piece.start)
+    remaining = piece.end - piece.start
+    while remaining > 0 and (chunk := source_file.read(min(1024 * 1024, remaining))):
+        remaining -= len(chunk)
+        yield chunk
+
+
+@contextmanager
+def open_load_source(
+    files: list[str | LoadPiece], batch_id: str | None = None
+) -> Iterator[tuple[BinaryIO, str]]:
+    """Yield a binary stream with the contents of files and a file name describing its format.
+
+    Several JSONL files (or byte ranges of appended files) are concatenated into a temporary
+    file so that they can be sent in one load job. If any input is gzip-compressed the combined
+    file is gzip-compressed as well.
+    With batch_id, every record gets a `_batch_id` field (Parquet: column) on the way through.
+    """
+    pieces = [LoadPiece(f) if isinstance(f, str) else f for f in files]
+    if len(pieces) == 1 and batch_id is None and pieces[0].start == 0 and pieces[0].end is None:
+        with open(pieces[0].path, "rb") as source_file:
+            yield source_file, pieces[0].path
+        return
+
+    if pieces[0].path.endswith(".parquet"):
+        # Parquet batches always hold a single whole file (see group_files_by_record_type).
+        with tempfile.TemporaryFile() as tagged:
+            _write_tagged_parquet(pieces[0].path, tagged, batch_id)
+            tagged.seek(0)
+            yield tagged, pieces[0].path
+        return
+
+    tag = f'"{BATCH_ID_COLUMN}":{json.dumps(batch_id)},'.encode() if batch_id else b""
+    compressed = any(p.path.endswith(".gz") for p in pieces)
+    with tempfile.TemporaryFile() as combined:
+        out = gzip.GzipFile(fileobj=combined, mode="wb", compresslevel=1) if compressed else combined
+        try:
+            for piece in pieces:
+                opener = gzip.open if piece.path.endswith(".gz") else open
+                with opener(piece.path, "rb") as source_file:
+                    last = b"\n"
+                    for chunk in _read_range(source_file, piece):
+                        out.write(_tag_records(chunk, tag, last == b"\n") if tag else chunk)
+                        last = chunk[-1:]
+                    if last != b"\n":
+                        # Keep records of consecutive files on separate lines.
+                        out.write(b"\n")
+        finally:
+            if compressed:
+                out.close()
+        combined.seek(0)
+        yield combined, "combined.jsonl.gz" if compressed else "combined.jsonl"
+
+
+def start_load_job(
+    client: bigquery.Client,
+    source: BinaryIO,
+    source_name: str,
+    table_id: str,
+    write_disposition: str,
+    allow_field_addition: bool,
+    schema: list[bigquery.SchemaField] | None = None,
+) -> bigquery.LoadJob:
+    job_config = build_load_job_config(source_name, write_disposition, allow_field_addition, schema)
+    logger.info("Loading %s -> %s (%s)", os.path.basename(source_name), table_id, write_disposition)
+    return client.load_table_from_file(source, table_id, job_config=job_config, rewind=True)
+
+
+def wait_load_job(
+    client: bigquery.Client, job: bigquery.LoadJob, table_id: str, log_table_stats: bool = False
+) -> None:
+    track_job(job, f"load {table_id}")
+    logger.info("Loaded rows=%s into %s", job.output_rows, table_id)
+    if log_table_stats:
+        table = client.get_table(table_id)
+        logger.info("Table %s: rows=%s columns=%s", table_id, table.num_rows, len(table.schema))
 
 
 def create_table_if_not_exists_from_stage(
@@ -85,7 +361,150 @@ def create_table_if_not_exists_from_stage(
     FROM `{stage_table_id}`
     WHERE 1 = 0
     """
-    client.query(query).result()
+    track_job(client.query(query), f"create {target_table_id}")
+
+
+def _padded_string_expr(column: str, field_type: str | None, length: int) -> str:
+    """column as a zero-padded string. STRING columns (untyped or typed codes) are already padded."""
+    if field_type == "STRING":
+        return f"`{column}`"
+    if field_type == "INT64":
+        return f"FORMAT('%0{length}d', `{column}`)"
+    return f"LPAD(CAST(`{column}` AS STRING), {length}, '0')"
+
+
+def race_date_expr(column_types: dict[str, str] | None = None) -> str:
+    """SQL expression deriving the race date from the Year/MonthDay columns.
+
+    column_types (column name -> BigQuery type) drops the casts the columns do not need, e.g. for
+    typed loads only the INT64 Year is formatted. Without it the expression works for any type.
+    """
+    column_types = column_types or {}
+    year = _padded_string_expr("Year", column_types.get("Year"), 4)
+    month_day = _padded_string_expr("MonthDay", column_types.get("MonthDay"), 4)
+    return f"SAFE.PARSE_DATE('%Y%m%d', CONCAT({year}, {month_day}))"
+
+
+def _column_types(table: bigquery.Table) -> dict[str, str]:
+    return {field.name: field.field_type for field in table.schema}
+
+
+def add_missing_columns(client: bigquery.Client, target_table_id: str, stage_table: bigquery.Table) -> bigquery.Table:
+    """Add the staged columns the target table lacks, so the MERGE column lists resolve.
+
+    Core tables created by an older version lack newer columns such as `_batch_id`.
+    Added columns are NULLABLE; existing rows get NULL.
+    """
+    target_table = client.get_table(target_table_id)
+    known = {field.name for field in target_table.schema}
+    missing = [field for field in stage_table.schema if field.name not in known]
+    if not missing:
+        return target_table
+    target_table.schema = list(target_table.schema) + [
+        bigquery.SchemaField.from_api_repr({**field.to_api_repr(), "mode": "NULLABLE"})
+        if field.mode == "REQUIRED" else field
+        for field in missing
+    ]
+    target_table = client.update_table(target_table, ["schema"])
+    logger.info("Added columns %s to %s", ", ".join(field.name for field in missing), target_table_id)
+    return target_table
+
+
+def key_lengths_for(record_type: str) -> dict[str, int]:
+    return {f.name: f.length for f in RECORD_SPECS.get(record_type, []) if isinstance(f, Field)}
+
+
+def core_cluster_columns(merge_keys: Iterable[str]) -> list[str]:
+    # BigQuery allows four clustering columns: the race date plus the leading race key columns below it.
+    return [PARTITION_COLUMN] + [k for k in merge_keys if k not in RACE_DATE_COLUMNS][:3]
+
+
+def is_race_date_partitioned(table: bigquery.Table) -> bool:
+    return table.time_partitioning is not None and table.time_partitioning.field == PARTITION_COLUMN
+
+
+def create_partitioned_table_if_not_exists_from_stage(
+    client: bigquery.Client,
+    target_table_id: str,
+    stage_table_id: str,
+    cluster_columns: list[str],
+    column_types: dict[str, str] | None = None,
+) -> None:
+    query = f"""
+    CREATE TABLE IF NOT EXISTS `{target_table_id}`
+    PARTITION BY DATE_TRUNC(`{PARTITION_COLUMN}`, MONTH)
+    CLUSTER BY {", ".join(f"`{c}`" for c in cluster_columns)}
+    AS
+    SELECT *, {race_date_expr(column_types)} AS `{PARTITION_COLUMN}`
+    FROM `{stage_table_id}`
+    WHERE 1 = 0
+    """
+    track_job(client.query(query), f"create {target_table_id}")
+
+
+def repartition_core_table(client: bigquery.Client, target_table_id: str, merge_keys: Iterable[str]) -> bool:
+    """Rebuild an existing unpartitioned core table as race_date-partitioned and clustered."""
+    try:
+        table = client.get_table(target_table_id)
+    except NotFound:
+        return False
+    if is_race_date_partitioned(table):
+        return False
+    columns = [field.name for field in table.schema]
+    select = (
+        "*" if PARTITION_COLUMN in columns
+        else f"*, {race_date_expr(_column_types(table))} AS `{PARTITION_COLUMN}`"
+    )
+    query = f"""
+    CREATE OR REPLACE TABLE `{target_table_id}`
+    PARTITION BY DATE_TRUNC(`{PARTITION_COLUMN}`, MONTH)
+    CLUSTER BY {", ".join(f"`{c}`" for c in core_cluster_columns(merge_keys))}
+    AS
+    SELECT {select}
+    FROM `{target_table_id}`
+    """
+    track_job(client.query(query), f"repartition {target_table_id}")
+    logger.info("Repartitioned %s by %s", target_table_id, PARTITION_COLUMN)
+    return True
+
+
+def staged_race_date_range(
+    client: bigquery.Client, stage_table_id: str, column_types: dict[str, str] | None = None
+) -> tuple:
+    race_date = race_date_expr(column_types)
+    query = f"""
+    SELECT
+      MIN({race_date}) AS min_date,
+      MAX({race_date}) AS max_date,
+      COUNTIF({race_date} IS NULL) AS null_dates
+    FROM `{stage_table_id}`
+    """
+    row = list(track_job(client.query(query), f"race_date range {stage_table_id}"))[0]
+    return row["min_date"], row["max_date"], row["null_dates"]
+
+
+def _key_expr(key: str, stage_type: str | None, target_type: str | None, length: int | None) -> str:
+    """Convert a staged key column to the target column type, so the target side stays unwrapped."""
+    column = f"`{key}`"
+    if stage_type == target_type or target_type is None:
+        return column
+    if target_type == "STRING":
+        # Zero-padded codes that were loaded as numbers (e.g. Umaban 1 -> "01").
+        as_string = f"TRIM(CAST({column} AS STRING))"
+        return f"LPAD({as_string}, {length}, '0')" if length else as_string
+    return f"SAFE_CAST({column} AS {target_type})"
+
+
+def _key_replace_clause(
+    key_list: list[str], stage_types: dict[str, str], target_types: dict[str, str], key_lengths: dict[str, int]
+) -> str:
+    """SELECT * REPLACE clause converting the staged keys whose type differs from the target's."""
+    replace_keys = []
+    for k in key_list:
+        expr = _key_expr(k, stage_types.get(k), target_types.get(k), key_lengths.get(k))
+        if expr != f"`{k}`":
+            replace_keys.append(f"{expr} AS `{k}`")
+    return f" REPLACE ({', '.join(replace_keys)})" if replace_keys else ""
 
 
 def merge_stage_into_target(
@@ -93,6 +512,7 @@ def merge_stage_into_target(
     stage_table_id: str,
     target_table_id: str,
     merge_keys: Iterable[str],
+    key_lengths: dict[str, int] | None = None,
 ) -> bool:
     stage_table = client.get_table(stage_table_id)
     columns = [field.name for field in stage_table.schema]
@@ -106,17 +526,36 @@ def merge_stage_into_target(
         )
         return False
 
+    if all(c in columns for c in RACE_DATE_COLUMNS):
+        create_partitioned_table_if_not_exists_from_stage(
+            client, target_table_id, stage_table_id, core_cluster_columns(key_list), _column_types(stage_table)
+        )
+        target_table = add_missing_columns(client, target_table_id, stage_table)
+        if is_race_date_partitioned(target_table):
+            merge_stage_into_partitioned_target(
+                client, stage_table_id, stage_table, target_table, key_list, key_lengths or {}
+            )
+            return True
+        logger.warning(
+            "%s is not partitioned by %s; merging without partition pruning (run with --repartition-core)",
+            target_table_id,
+            PARTITION_COLUMN,
+        )
+
     create_table_if_not_exists_from_stage(client, target_table_id, stage_table_id)
+    target_types = _column_types(add_missing_columns(client, target_table_id, stage_table))
+    replace_clause = _key_replace_clause(
+        key_list, _column_types(stage_table), target_types, key_lengths or {}
+    )
 
     order_expr = (
         "SAFE_CAST(`fetched_at` AS TIMESTAMP) DESC, `fetched_at` DESC"
         if "fetched_at" in columns
-        else ", ".join([f"CAST(`{k}` AS STRING) DESC" for k in key_list])
-    )
-    partition_expr = ", ".join([f"CAST(`{k}` AS STRING)" for k in key_list])
-    on_clause = " AND ".join(
-        [f"COALESCE(CAST(T.`{k}` AS STRING), '') = COALESCE(CAST(S.`{k}` AS STRING), '')" for k in key_list]
+        else ", ".join([f"`{k}` DESC" for k in key_list])
     )
+    partition_expr = ", ".join([f"`{k}`" for k in key_list])
+    # Keys have the target column types, so they are compared as they are (NULL keys match each other).
+    on_clause = " AND ".join([f"T.`{k}` IS NOT DISTINCT FROM S.`{k}`" for k in key_list])
     update_clause = ", ".join([f"`{c}` = S.`{c}`" for c in columns])
     insert_columns = ", ".join([f"`{c}`" for c in columns])
     insert_values = ", ".join([f"S.`{c}`" for c in columns])
@@ -132,7 +571,7 @@ def merge_stage_into_target(
             PARTITION BY {partition_expr}
             ORDER BY {order_expr}
           ) AS _rn
-        FROM `{stage_table_id}`
+        FROM (SELECT *{replace_clause} FROM `{stage_table_id}`)
       )
       WHERE _rn = 1
     ) AS S
@@ -143,65 +582,294 @@ def merge_stage_into_target(
       INSERT ({insert_columns})
       VALUES ({insert_values})
     """
-    client.query(query).result()
+    track_job(client.query(query), f"merge {target_table_id}")
     return True
 
 
-def load_jsonl_to_raw(client: bigquery.Client, file_path: str, raw_dataset_id: str) -> str | None:
-    record_type = infer_record_type(file_path)
-    if not record_type:
-        logger.warning("Skipping file with invalid name format: %s", os.path.basename(file_path))
-        return None
+def merge_stage_into_partitioned_target(
+    client: bigquery.Client,
+    stage_table_id: str,
+    stage_table: bigquery.Table,
+    target_table: bigquery.Table,
+    key_list: list[str],
+    key_lengths: dict[str, int],
+) -> None:
+    """MERGE restricted to the race_date range of the staged rows.
 
-    raw_table_id = get_table_id(client.project, raw_dataset_id, record_type)
-    load_jsonl_to_table(
-        client=client,
-        file_path=file_path,
-        table_id=raw_table_id,
+    Staged keys are converted to the target column types so the target columns are compared
+    unwrapped, and the target is filtered by constant race_date bounds. BigQuery then scans only
+    the partitions and clustered blocks touched by the staging data.
+    """
+    target_table_id = f"{target_table.project}.{target_table.dataset_id}.{target_table.table_id}"
+    stage_types = _column_types(stage_table)
+    min_date, max_date, null_dates = staged_race_date_range(client, stage_table_id, stage_types)
+    if null_dates:
+        logger.warning("Skip %s staged rows without a valid race date for %s", null_dates, target_table_id)
+    if min_date is None:
+        return
+
+    columns = [field.name for field in stage_table.schema]
+    replace_clause = _key_replace_clause(key_list, stage_types, _column_types(target_table), key_lengths)
+    order_expr = (
+        "SAFE_CAST(`fetched_at` AS TIMESTAMP) DESC, `fetched_at` DESC"
+        if "fetched_at" in columns
+        else ", ".join([f"`{k}` DESC" for k in key_list])
+    )
+    all_columns = columns + [PARTITION_COLUMN]
+    on_clause = " AND ".join(
+        [
+            f"T.`{PARTITION_COLUMN}` BETWEEN DATE '{min_date.isoformat()}' AND DATE '{max_date.isoformat()}'",
+            f"T.`{PARTITION_COLUMN}` = S.`{PARTITION_COLUMN}`",
+        ]
+        + [f"T.`{k}` = S.`{k}`" for k in key_list]
+    )
+    update_clause = ", ".join([f"`{c}` = S.`{c}`" for c in all_columns])
+    insert_columns = ", ".join([f"`{c}`" for c in all_columns])
+    insert_values = ", ".join([f"S.`{c}`" for c in all_columns])
+
+    query = f"""
+    MERGE `{target_table_id}` AS T
+    USING (
+      SELECT * EXCEPT(_rn)
+      FROM (
+        SELECT
+          *,
+          ROW_NUMBER() OVER (
+            PARTITION BY {", ".join(f"`{k}`" for k in key_list)}
+            ORDER BY {order_expr}
+          ) AS _rn
+        FROM (
+          SELECT *{replace_clause}, {race_date_expr(stage_types)} AS `{PARTITION_COLUMN}`
+          FROM `{stage_table_id}`
+        )
+        WHERE `{PARTITION_COLUMN}` IS NOT NULL
+      )
+      WHERE _rn = 1
+    ) AS S
+    ON {on_clause}
+    WHEN MATCHED THEN
+      UPDATE SET {update_clause}
+    WHEN NOT MATCHED THEN
+      INSERT ({insert_columns})
+      VALUES ({insert_values})
+    """
+    job = client.query(query)
+    track_job(job, f"merge {target_table_id}")
+    logger.info(
+        "Merged %s..%s into %s (bytes processed=%s)",
+        min_date, max_date, target_table_id, getattr(job, "total_bytes_processed", None),
+    )
+
+
+def _schema_signature(fields: Iterable[bigquery.SchemaField]) -> list[tuple]:
+    return [(f.name, f.field_type, f.mode, tuple(_schema_signature(f.fields))) for f in fields]
+
+
+def promote_stage_to_raw(client: bigquery.Client, stage_table_id: str, raw_table_id: str) -> None:
+    """Append the staging table to the raw table without uploading the data again.
+
+    A copy job is used when the raw table is missing or has the same schema as the staging
+    table. Otherwise (e.g. autodetect produced a different column set) the rows are appended
+    with a query that allows new and relaxed columns.
+    """
+    try:
+        raw_table = client.get_table(raw_table_id)
+    except NotFound:
+        raw_table = None
+    stage_table = client.get_table(stage_table_id)
+
+    if raw_table is None or _schema_signature(raw_table.schema) == _schema_signature(stage_table.schema):
+        job_config = bigquery.CopyJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+        track_job(client.copy_table(stage_table_id, raw_table_id, job_config=job_config), f"promote {raw_table_id}")
+        logger.info("Copied %s into %s", stage_table_id, raw_table_id)
+        return
+
+    job_config = bigquery.QueryJobConfig(
+        destination=raw_table_id,
         write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-        allow_field_addition=True,
+        schema_update_options=[
+            bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION,
+            bigquery.SchemaUpdateOption.ALLOW_FIELD_RELAXATION,
+        ],
     )
-    return record_type
+    track_job(client.query(f"SELECT * FROM `{stage_table_id}`", job_config=job_config), f"promote {raw_table_id}")
+    logger.info("Appended %s into %s (schemas differ)", stage_table_id, raw_table_id)
 
 
-def sync_core_latest_table(
+def delete_raw_batches(client: bigquery.Client, raw_table_id: str, batch_ids: Iterable[str]) -> None:
+    """Delete the rows of earlier unfinished load batches from a raw table."""
+    batch_ids = sorted(batch_ids)
+    if not batch_ids:
+        return
+    try:
+        client.get_table(raw_table_id)
+    except NotFound:
+        return
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("batch_ids", "STRING", batch_ids)]
+    )
+    query = f"DELETE FROM `{raw_table_id}` WHERE `{BATCH_ID_COLUMN}` IN UNNEST(@batch_ids)"
+    job = client.query(query, job_config=job_config)
+    track_job(job, f"delete stale batches {raw_table_id}")
+    logger.info(
+        "Deleted %s rows of unfinished batches %s from %s",
+        job.num_dml_affected_rows, ", ".join(batch_ids), raw_table_id,
+    )
+
+
+def begin_raw_append(
     client: bigquery.Client,
-    file_path: str,
-    record_type: str,
-    core_dataset_id: str,
-    staging_prefix: str,
-    core_table_suffix: str,
+    manifest: LoadManifest | None,
+    files: list[LoadPiece],
+    batch_id: str,
+    raw_table_id: str,
 ) -> None:
-    merge_keys = MERGE_KEYS.get(record_type)
-    if not merge_keys:
-        logger.info("Skip core merge for record_type=%s", record_type)
+    """Make appending batch_id to the raw table safe to repeat.
+
+    Rows left in raw by earlier attempts at the same files that did not finish (e.g. the MERGE
+    into core failed after promotion, or the process died before the manifest was written) are
+    deleted, and the batch is recorded as pending before anything is appended.
+    """
+    if manifest is None:
         return
+    delete_raw_batches(client, raw_table_id, manifest.pending_batches(files))
+    manifest.begin(files, batch_id)
+
 
+def load_record_type(
+    client: bigquery.Client,
+    record_type: str,
+    batches: list[list[LoadPiece]],
+    raw_dataset_id: str,
+    core_dataset_id: str,
+    merge: bool,
+    staging_prefix: str = "_stg_",
+    core_table_suffix: str = "_latest",
+    log_table_stats: bool = False,
+    schema_mode: str = "autodetect",
+    typed: bool = False,
+    manifest: LoadManifest | None = None,
+) -> int:
+    """Load the batches of one record type in order. Returns the number of files that failed.
+
+    Each batch is uploaded once, tagged with a fresh `_batch_id`. Types without a core MERGE are
+    appended straight to the raw table. Merged types are loaded into the staging table, promoted
+    to raw by promote_stage_to_raw and merged into core from staging.
+    Batches of one type run sequentially because they share the staging table.
+    Successful batches are recorded in the manifest so later runs skip them. A batch that failed
+    after reaching raw is removed from raw when its files are loaded again (see begin_raw_append).
+    """
+    raw_table_id = get_table_id(client.project, raw_dataset_id, record_type)
+    merge_keys = MERGE_KEYS.get(record_type) if merge else None
+    if merge and not merge_keys:
+        logger.info("Skip core merge for record_type=%s", record_type)
     stage_table_id = get_table_id(client.project, core_dataset_id, f"{staging_prefix}{record_type}")
     target_table_id = get_table_id(client.project, core_dataset_id, f"{record_type}{core_table_suffix}")
+    schema = schema_for_record_type(record_type, schema_mode, typed)
 
-    load_jsonl_to_table(
-        client=client,
-        file_path=file_path,
-        table_id=stage_table_id,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-        allow_field_addition=False,
-    )
+    failures = 0
+    for files in batches:
+        batch_id = new_batch_id(record_type)
+        try:
+            with open_load_source(files, batch_id) as (source, source_name):
+                if merge_keys:
+                    table_id = stage_table_id
+                    job = start_load_job(
+                        client, source, source_name, stage_table_id,
+                        bigquery.WriteDisposition.WRITE_TRUNCATE, allow_field_addition=False, schema=schema,
+                    )
+                else:
+                    table_id = raw_table_id
+                    begin_raw_append(client, manifest, files, batch_id, raw_table_id)
+                    job = start_load_job(
+                        client, source, source_name, raw_table_id,
+                        bigquery.WriteDisposition.WRITE_APPEND, allow_field_addition=True, schema=schema,
+                    )
+            wait_load_job(client, job, table_id, log_table_stats)
+
+            if merge_keys:
+                begin_raw_append(client, manifest, files, batch_id, raw_table_id)
+                promote_stage_to_raw(client, stage_table_id, raw_table_id)
+                merged = merge_stage_into_target(
+                    client=client,
+                    stage_table_id=stage_table_id,
+                    target_table_id=target_table_id,
+                    merge_keys=merge_keys,
+                    key_lengths=key_lengths_for(record_type),
+                )
+                if merged:
+                    logger.info("Merged %s into %s", record_type, target_table_id)
+            if manifest is not None:
+                manifest.record(files, batch_id)
+            logger.info("Loaded %s file(s) of %s as batch %s", len(files), record_type, batch_id)
+        except Exception as e:
+            logger.exception(
+                "Failed processing %s file(s) of %s (%s): %s",
+                len(files), record_type, ", ".join(os.path.basename(f.path) for f in files), e,
+            )
+            failures += len(files)
+    return failures
 
-    merged = merge_stage_into_target(
-        client=client,
-        stage_table_id=stage_table_id,
-        target_table_id=target_table_id,
-        merge_keys=merge_keys,
-    )
-    if merged:
-        table = client.get_table(target_table_id)
-        logger.info("Merged %s into %s. Rows=%s", record_type, target_table_id, table.num_rows)
+
+def load_files(
+    client: bigquery.Client,
+    files: Iterable[str],
+    raw_dataset_id: str,
+    core_dataset_id: str,
+    merge_types: set[str],
+    staging_prefix: str = "_stg_",
+    core_table_suffix: str = "_latest",
+    skip_core_merge: bool = False,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_bytes: int = DEFAULT_BATCH_BYTES,
+    log_table_stats: bool = False,
+    schema_mode: str = "autodetect",
+    typed: bool = False,
+    manifest: LoadManifest | None = None,
+    force: bool = False,
+) -> int:
+    """Load files into raw tables and MERGE the configured types into core. Returns the failure count.
+
+    Files are combined into one load job per record type (see group_files_by_record_type) and
+    up to `concurrency` record types are loaded at the same time. With schema_mode="explicit"
+    the JSONL loads use schemas generated from RECORD_SPECS (typed: files were written with --typed).
+    With a manifest, files that are already loaded are skipped and appended JSONL files only
+    load their new bytes (force=True loads everything again).
+    """
+    if manifest is not None:
+        pieces = [piece for f in files if (piece := manifest.plan(f, force=force)) is not None]
+        logger.info("%s file(s) with new data to load", len(pieces))
+    else:
+        pieces = list(files)
+    groups = group_files_by_record_type(pieces, batch_bytes)
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [
+            executor.submit(
+                load_record_type,
+                client,
+                record_type,
+                batches,
+                raw_dataset_id=raw_dataset_id,
+                core_dataset_id=core_dataset_id,
+                merge=not skip_core_merge and record_type in merge_types,
+                staging_prefix=staging_prefix,
+                core_table_suffix=core_table_suffix,
+                log_table_stats=log_table_stats,
+                schema_mode=schema_mode,
+                typed=typed,
+                manifest=manifest,
+            )
+            for record_type, batches in groups.items()
+        ]
+        for future in as_completed(futures):
+            failures += future.result()
+    return failures
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Load JRA-VAN JSONL to BigQuery")
-    parser.add_argument("--input", "-i", required=True, help="Input directory containing JSONL files")
+    parser = argparse.ArgumentParser(description="Load JRA-VAN JSONL/Parquet files to BigQuery")
+    parser.add_argument("--input", "-i", required=True, help="Input directory containing JSONL/Parquet files")
     parser.add_argument("--project", "-p", help="GCP Project ID")
     parser.add_argument("--dataset", "-d", default=DEFAULT_RAW_DATASET, help="Raw BigQuery dataset ID")
     parser.add_argument("--core-dataset", default=DEFAULT_CORE_DATASET, help="Core BigQuery dataset ID")
@@ -219,6 +887,56 @@ def main() -> None:
     parser.add_argument("--skip-core-merge", action="store_true", help="Skip core MERGE synchronization")
     parser.add_argument("--key", "-k", help="Path to Service Account JSON key")
     parser.add_argument("--location", "-l", default="asia-northeast1", help="Dataset location")
+    parser.add_argument(
+        "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Record types loaded in parallel"
+    )
+    parser.add_argument(
+        "--batch-bytes",
+        type=int,
+        default=DEFAULT_BATCH_BYTES,
+        help="Max input bytes combined into one load job per record type",
+    )
+    parser.add_argument(
+        "--table-stats", action="store_true", help="Fetch and log table row/column counts after each load"
+    )
+    parser.add_argument(
+        "--schema",
+        dest="schema_mode",
+        choices=SCHEMA_MODES,
+        default="autodetect",
+        help="JSONL load schema: autodetect, or explicit schemas generated from RECORD_SPECS",
+    )
+    parser.add_argument(
+        "--manifest-table",
+        help="BigQuery control table (dataset.table) recording loaded files, in addition to the local manifest",
+    )
+    parser.add_argument(
+        "--no-manifest", action="store_true", help="Load every input file without consulting the load manifest"
+    )
+    parser.add_argument(
+        "--force-reload", action="store_true", help="Load all files again and record them in the manifest"
+    )
+    parser.add_argument(
+        "--repartition-core",
+        action="store_true",
+        help="Rebuild existing unpartitioned core tables as race_date-partitioned and clustered",
+    )
+    parser.add_argument(
+        "--group-views",
+        action="store_true",
+        help="Create {type}_{group} views expanding repeating groups (odds, votes, payouts) from raw_data",
+    )
+    parser.add_argument(
+        "--typed",
+        action="store_true",
+        help="Input JSONL was written with main.py --typed (explicit schemas use INT64/DATE/FLOAT64 columns)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=bq_metrics.DEFAULT_METRICS_FILE,
+        help="Local JSONL file receiving per-job BigQuery statistics",
+    )
+    parser.add_argument("--audit-table", help="BigQuery table (dataset.table) receiving per-job statistics")
     args = parser.parse_args()
 
     if args.key:
@@ -230,32 +948,54 @@ def main() -> None:
         logger.error("Failed to create BigQuery client: %s", e)
         return
 
+    audit_table_id = f"{client.project}.{args.audit_table}" if args.audit_table else None
+    metrics = bq_metrics.configure("loader_bq", args.metrics_file, client, audit_table_id)
+    try:
+        run_load(client, args)
+    finally:
+        metrics.close()
+
+
+def run_load(client: bigquery.Client, args: argparse.Namespace) -> None:
     create_dataset_if_not_exists(client, args.dataset, args.location)
     if not args.skip_core_merge:
         create_dataset_if_not_exists(client, args.core_dataset, args.location)
 
     merge_types = parse_merge_types(args.merge_types)
-    files = sorted(glob(os.path.join(args.input, "*.jsonl")))
-    logger.info("Found %s files in %s", len(files), args.input)
-
-    for file_path in files:
-        filename = os.path.basename(file_path)
-        try:
-            record_type = load_jsonl_to_raw(client, file_path, args.dataset)
-            if not record_type:
-                continue
-
-            if not args.skip_core_merge and record_type in merge_types:
-                sync_core_latest_table(
-                    client=client,
-                    file_path=file_path,
-                    record_type=record_type,
-                    core_dataset_id=args.core_dataset,
-                    staging_prefix=args.staging_prefix,
-                    core_table_suffix=args.core_table_suffix,
+    if args.repartition_core and not args.skip_core_merge:
+        for record_type in sorted(merge_types):
+            merge_keys = MERGE_KEYS.get(record_type)
+            if merge_keys:
+                target_table_id = get_table_id(
+                    client.project, args.core_dataset, f"{record_type}{args.core_table_suffix}"
                 )
-        except Exception as e:
-            logger.exception("Failed processing %s: %s", filename, e)
+                repartition_core_table(client, target_table_id, merge_keys)
+    files = list_input_files(args.input)
+    logger.info("Found %s files in %s", len(files), args.input)
+    manifest = None
+    if not args.no_manifest:
+        control_table_id = f"{client.project}.{args.manifest_table}" if args.manifest_table else None
+        manifest = LoadManifest(args.input, client=client, control_table_id=control_table_id)
+
+    load_files(
+        client,
+        files,
+        raw_dataset_id=args.dataset,
+        core_dataset_id=args.core_dataset,
+        merge_types=merge_types,
+        staging_prefix=args.staging_prefix,
+        core_table_suffix=args.core_table_suffix,
+        skip_core_merge=args.skip_core_merge,
+        concurrency=args.concurrency,
+        batch_bytes=args.batch_bytes,
+        log_table_stats=args.table_stats,
+        schema_mode=args.schema_mode,
+        typed=args.typed,
+        manifest=manifest,
+        force=args.force_reload,
+    )
+    if args.group_views:
+        create_group_views(client, args.dataset, sorted({infer_record_type(f) for f in files} - {None}))
 
 
 if __name__ == "__main__":
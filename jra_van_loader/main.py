@@ -1,17 +1,136 @@
+import os
 import sys
+import time
 import argparse
 from jvlink.client import JVLinkClient
+from jvlink.replay import ReplayJVLink
 from storage import DataSaver
+from sinks import JsonlSink, ParquetSink
+from checkpoint import CHECKPOINT_FILENAME, IngestCheckpoint
+from dedup import RecordDeduplicator
+from ingest_manifest import INGEST_MANIFEST_FILENAME, IngestManifest
+from pipeline import IngestPipeline
+from streaming import STREAM_STATE_FILENAME, FakeWriteEndpoint, StorageWriteEndpoint, StreamingSink
 
 
 def main():
     parser = argparse.ArgumentParser(description="JRA-VAN Data Loader")
     parser.add_argument("--spec", required=True, help="Data Specification (e.g., RACE, diff)")
-    parser.add_argument("--from", dest="from_time", default="20240101000000", help="From Time (YYYYMMDDHHMMSS)")
+    parser.add_argument("--sid", default="AntigravityPy", help="Software ID passed to JVInit")
+    parser.add_argument(
+        "--from",
+        dest="from_time",
+        default="20240101000000",
+        help="From Time (YYYYMMDDHHMMSS, or YYYYMMDDHHMMSS-YYYYMMDDHHMMSS for a range)",
+    )
     parser.add_argument("--option", type=int, default=1, help="JVOpen Option (1:Normal, 2:Setup, 4:Update)")
     parser.add_argument("--output", default="output_data", help="Output directory")
+    parser.add_argument(
+        "--bytes",
+        dest="as_bytes",
+        action="store_true",
+        help="Read records as cp932 bytes via JVGets and parse without str round trips",
+    )
+    parser.add_argument(
+        "--typed",
+        action="store_true",
+        help="Convert fields by their schema dtype (int/date/code/decimal) instead of plain strings",
+    )
+    parser.add_argument(
+        "--buffer-records", type=int, default=1000, help="Records to buffer before writing (1: write each record)"
+    )
+    parser.add_argument("--flush-interval", type=float, default=1.0, help="Max seconds between buffer flushes")
+    parser.add_argument("--fsync", action="store_true", help="fsync output files on every flush")
+    parser.add_argument(
+        "--format",
+        dest="output_format",
+        choices=["jsonl", "parquet"],
+        default="jsonl",
+        help="Output file format (parquet: typed columns per record type, requires pyarrow)",
+    )
+    parser.add_argument(
+        "--compression",
+        default=None,
+        help="Output compression (jsonl: gzip; parquet: zstd (default), snappy, gzip, none)",
+    )
+    parser.add_argument(
+        "--rotate-bytes", type=int, default=None, help="Rotate JSONL chunks after this many uncompressed bytes"
+    )
+    parser.add_argument("--rotate-records", type=int, default=None, help="Rotate output chunks after this many records")
+    parser.add_argument(
+        "--max-open-files", type=int, default=64, help="Max JSONL file handles kept open (LRU eviction)"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Parser processes for pipelined ingest (0: parse and write on the reader thread)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Start reading files as soon as they are downloaded instead of waiting for the whole download",
+    )
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help="Replay recorded records (file or directory) or 'synthetic' instead of the JV-Link COM server",
+    )
+    parser.add_argument("--replay-rate", type=float, default=None, help="Replay speed limit in records/s")
+    parser.add_argument(
+        "--replay-download-delay", type=float, default=0.0, help="Simulated download time per JV file in seconds"
+    )
+    parser.add_argument("--synthetic-files", type=int, default=10, help="JV files generated by --replay synthetic")
+    parser.add_argument(
+        "--synthetic-races", type=int, default=12, help="Races per JV file generated by --replay synthetic"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help=f"Checkpoint file for crash-safe resume (default: <output>/{CHECKPOINT_FILENAME})",
+    )
+    parser.add_argument("--no-resume", action="store_true", help="Ignore any existing checkpoint and start over")
+    parser.add_argument(
+        "--ingest-manifest",
+        default=None,
+        help=f"Manifest of JV files ingested by earlier runs (default: <output>/{INGEST_MANIFEST_FILENAME})",
+    )
+    parser.add_argument(
+        "--reingest", action="store_true", help="Read JV files again even if the ingest manifest lists them"
+    )
+    parser.add_argument(
+        "--dedup",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="TYPES",
+        help="Skip records identical to one already read in this run (optionally only these types, e.g. O1,HR)",
+    )
+    parser.add_argument(
+        "--dedup-keys",
+        type=int,
+        default=20000,
+        help="Max (record type, race) keys remembered by --dedup; the least recently used are forgotten",
+    )
+
+    parser.add_argument(
+        "--stream-types",
+        default=None,
+        help="Record types to stream to BigQuery instead of writing files (e.g. O1,O2,O3,O4,O5,O6)",
+    )
+    parser.add_argument("--stream-dataset", default=None, help="BigQuery dataset for streamed records (Storage Write API)")
+    parser.add_argument(
+        "--stream-fake", default=None, help="Stream into a local fake write endpoint in this directory instead"
+    )
+    parser.add_argument("--stream-batch-records", type=int, default=500, help="Max records per streamed append")
+    parser.add_argument(
+        "--stream-latency", type=float, default=1.0, help="Max seconds a streamed record waits for its batch"
+    )
 
     args = parser.parse_args()
+    if args.stream_types and not (args.stream_dataset or args.stream_fake):
+        parser.error("--stream-types requires --stream-dataset or --stream-fake")
 
     # Windows console output encoding
     sys.stdout.reconfigure(encoding="utf-8")
@@ -19,15 +138,148 @@ def main():
     print("=== JRA-VAN Loader Start ===")
     print(f"Spec: {args.spec}, From: {args.from_time}")
 
-    saver = DataSaver(output_dir=args.output)
+    os.makedirs(args.output, exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(args.output, CHECKPOINT_FILENAME)
+    if args.no_resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = IngestCheckpoint(checkpoint_path, args.output, args.spec, args.from_time, args.option)
+    if checkpoint.resuming:
+        # 前回中断した時点の出力に戻してから取り込みを再開する
+        print(f"Resuming: {len(checkpoint.completed_files)} JV files already ingested")
+        checkpoint.restore_outputs()
+
+    # 以前の実行で取り込み済みの JV ファイルは JVSkip で読み飛ばす
+    ingest_manifest = IngestManifest(args.ingest_manifest or os.path.join(args.output, INGEST_MANIFEST_FILENAME))
+    skip_files = set(checkpoint.completed_files)
+    if not args.reingest:
+        skip_files.update(ingest_manifest.files)
+
+    if args.output_format == "parquet":
+        sink = ParquetSink(
+            args.output,
+            typed=args.typed,
+            compression=args.compression or "zstd",
+            max_records=args.rotate_records,
+        )
+    else:
+        if args.compression not in (None, "none", "gzip"):
+            parser.error("JSONL output supports only gzip compression")
+        sink = JsonlSink(
+            args.output,
+            fsync=args.fsync,
+            compression="gzip" if args.compression == "gzip" else None,
+            max_bytes=args.rotate_bytes,
+            max_records=args.rotate_records,
+            max_open_files=args.max_open_files,
+        )
+
+    saver = DataSaver(
+        output_dir=args.output,
+        typed=args.typed,
+        buffer_records=args.buffer_records,
+        flush_interval=args.flush_interval,
+        sink=sink,
+    )
+    sink.on_open = checkpoint.record_output
+
+    # 同じ内容のレコードはパース・書き出しの前に読み飛ばす (ストリーミングするレコード種別は対象外)
+    dedup = None
+    if args.dedup is not None:
+        dedup_types = [t.strip().upper() for t in args.dedup.split(",") if t.strip()]
+        dedup = RecordDeduplicator(saver.parser, dedup_types, max_keys=args.dedup_keys)
 
+    # 鮮度が必要なレコード種別はファイルを経由せずに BigQuery へストリーミングする
+    streamer = None
+    metrics = None
+    if args.stream_types:
+        if args.stream_fake:
+            endpoint = FakeWriteEndpoint(args.stream_fake)
+        else:
+            from google.cloud import bigquery
+            import bq_metrics
+
+            bq_client = bigquery.Client()
+            # 追記ごとの行数・所要時間を loader_bq.py と同じ形式で記録する
+            metrics = bq_metrics.configure("main", client=bq_client)
+            endpoint = StorageWriteEndpoint(bq_client, args.stream_dataset, typed=args.typed)
+        streamer = StreamingSink(
+            endpoint,
+            os.path.join(args.output, STREAM_STATE_FILENAME),
+            record_types=[t.strip().upper() for t in args.stream_types.split(",") if t.strip()],
+            typed=args.typed,
+            batch_records=args.stream_batch_records,
+            max_latency=args.stream_latency,
+        )
+
+    def on_file_end(filename):
+        # JV ファイル1つ分を書き出してディスクに同期してから、完了を記録する
+        if streamer is not None:
+            streamer.file_end(filename)
+        saver.checkpoint()
+        checkpoint.mark_file_done(filename, saver.outputs())
+        # 閉じたチャンクはファイルの完了を記録してから完成させる (完成したチャンクは再開時も変わらない)
+        saver.commit()
+        ingest_manifest.add(filename, client.file_records.get(filename, 0), args.spec, args.from_time)
+
+    backend = None
+    if args.replay == "synthetic":
+        backend = ReplayJVLink.synthetic(
+            files=args.synthetic_files,
+            races_per_file=args.synthetic_races,
+            rate=args.replay_rate,
+            download_delay=args.replay_download_delay,
+        )
+    elif args.replay:
+        backend = ReplayJVLink.from_path(
+            args.replay, rate=args.replay_rate, download_delay=args.replay_download_delay
+        )
+
+    records = 0
+    completed = False
+    started = time.perf_counter()
     try:
-        with JVLinkClient() as client:
-            client.open(args.spec, args.from_time, args.option)
+        with JVLinkClient(sid=args.sid, backend=backend) as client:
+            client.open(args.spec, args.from_time, args.option, wait=not args.stream)
+            checkpoint.set_open_result(client.read_count, client.download_count, client.last_timestamp)
+
+            if args.workers > 0:
+                # 読み込み (このスレッド)・パース (ワーカープロセス)・書き出し (書き込みスレッド) を並行させる
+                with IngestPipeline(
+                    saver,
+                    workers=args.workers,
+                    batch_records=args.buffer_records,
+                    flush_interval=args.flush_interval,
+                    on_file_end=on_file_end,
+                ) as pipeline:
+                    for line in client.read(
+                        as_bytes=args.as_bytes, on_file_end=pipeline.file_end, skip_files=skip_files
+                    ):
+                        if line:
+                            if streamer is not None and streamer.accepts(line):
+                                streamer.submit(client.current_file, line)
+                            elif dedup is None or not dedup.is_duplicate(line):
+                                pipeline.submit(line)
+                            records += 1
+                print(f"Pipeline stats: {pipeline.stats}")
+            else:
+                for line in client.read(
+                    as_bytes=args.as_bytes, on_file_end=on_file_end, skip_files=skip_files
+                ):
+                    if line:
+                        if streamer is not None and streamer.accepts(line):
+                            streamer.submit(client.current_file, line)
+                        elif dedup is None or not dedup.is_duplicate(line):
+                            saver.save(line)
+                        records += 1
 
-            for line in client.read():
-                if line:
-                    saver.save(line)
+            if client.read_completed:
+                saver.checkpoint()
+                checkpoint.mark_completed()
+                completed = True
+                print(f"Completed. Last timestamp: {client.last_timestamp}")
+            if client.skipped_files:
+                skipped_records = sum(ingest_manifest.records(name) or 0 for name in client.skipped_files)
+                print(f"Skipped {len(client.skipped_files)} already ingested JV files (~{skipped_records} records)")
 
     except Exception as e:
         print(f"[ERROR] Failed: {e}")
@@ -35,8 +287,30 @@ def main():
 
         traceback.print_exc()
     finally:
-        saver.close()
+        if completed:
+            saver.close()
+        else:
+            # 書き込み中のチャンクは .part のまま残し、再開時にチェックポイントの位置へ戻す
+            saver.abort()
+        if streamer is not None:
+            try:
+                streamer.close()
+                print(f"Streaming stats: {streamer.stats}")
+            except Exception as e:
+                print(f"[ERROR] Failed to close streams: {e}")
+                completed = False
+        if metrics is not None:
+            metrics.close()
+        elapsed = time.perf_counter() - started
+        print(f"Ingested {records} records in {elapsed:.2f}s ({records / max(elapsed, 1e-9):,.0f} records/s)")
+        if saver.stats:
+            print(f"File handle stats: {saver.stats}")
+        if dedup is not None:
+            print(f"Skipped duplicate records: {dedup.stats} (forgotten race keys: {dedup.evicted})")
+
+    # 途中で失敗した場合は非0で終了する (backfill.py 等の呼び出し元が再実行を判断する)
+    return 0 if completed else 1
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
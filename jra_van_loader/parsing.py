@@ -1,43 +1,480 @@
+import codecs
 import logging
-from typing import Dict, Any, List
+import re
+from datetime import date
+from operator import itemgetter
+from typing import Callable, Dict, Any, List, Iterable, Optional, Union
 # 相対インポートではなく絶対インポートにする（スクリプト実行時のトラブル回避）
 # ただしパッケージ構造に依存するため、実行環境に合わせて調整が必要だが
 # ここでは jra_van_loader パッケージ内であることを前提とする
 try:
-    from .schema.definitions import RECORD_SPECS, Field
+    from .schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
 except ImportError:
     # 単体テストなどでパスが通っていない場合
-    from schema.definitions import RECORD_SPECS, Field
+    from schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
 
 logger = logging.getLogger(__name__)
 
+# JVRead (文字列) / JVGets (バイト配列) のどちらの読み込み結果も受け付ける
+RawRecord = Union[str, bytes, bytearray, memoryview]
+
+# フィールド連結用の区切りバイト
+# CP932 の2バイト文字の第2バイトは 0x40 以上なので、0x00 が文字の途中に現れることはない
+_SEP = b"\x00"
+
+
+# ---------------------------------------------------------------------------
+# 型変換 (Field.dtype)
+# デコード・strip 済みの文字列を受け取り、変換できない値は None を返す
+# ---------------------------------------------------------------------------
+
+def convert_code(value: str) -> Optional[str]:
+    """
+    ゼロ埋めのコード値 (先頭の0を保持したまま文字列で返す)
+    """
+    return value or None
+
+
+def convert_int(value: str) -> Optional[int]:
+    # 符号付きの値 ("+010", "-004" 等) もそのまま int() で変換できる
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def convert_date(value: str) -> Optional[str]:
+    """
+    YYYYMMDD を ISO 形式 (YYYY-MM-DD) に変換する
+    """
+    if len(value) != 8 or not value.isdigit():
+        return None
+    try:
+        # 存在しない日付 (00000000, 2月30日など) を弾く
+        date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    except ValueError:
+        return None
+    return f"{value[0:4]}-{value[4:6]}-{value[6:8]}"
+
+
+def make_decimal_converter(scale: int) -> Callable[[str], Optional[float]]:
+    """
+    小数点を含まない数値 (例: オッズ "0123") を scale 桁の小数に変換する関数を返す
+    """
+    divisor = 10 ** scale
+
+    def convert_decimal(value: str) -> Optional[float]:
+        number = convert_int(value)
+        if number is None:
+            return None
+        return round(number / divisor, scale)
+
+    return convert_decimal
+
+
+def get_converter(field: Field) -> Optional[Callable[[str], Any]]:
+    """
+    Field.dtype に対応する変換関数を返す (str は変換不要なので None)
+    """
+    if field.dtype == "code":
+        return convert_code
+    if field.dtype == "int":
+        return convert_int
+    if field.dtype == "date":
+        return convert_date
+    if field.dtype == "decimal":
+        return make_decimal_converter(field.scale)
+    return None
+
+
+class RecordPlan:
+    """
+    レコード種別ごとに事前コンパイルした抽出プラン
+
+    Field定義からスライス・フィールド名・定義の最大終了位置を一度だけ計算しておき、
+    レコード毎のループ・境界チェック・max_end 再計算を省く。
+    """
+    __slots__ = ("record_spec", "fields", "groups", "names", "slices", "extract", "max_end", "converters")
+
+    def __init__(self, record_spec: str, fields: List[SchemaItem]):
+        self.record_spec = record_spec
+        # 単一フィールドと繰り返し項目 (Repeat) を分けて扱う
+        self.fields = [f for f in fields if not isinstance(f, Repeat)]
+        self.groups = [GroupPlan(f) for f in fields if isinstance(f, Repeat)]
+        self.names = [f.name for f in self.fields]
+        self.slices = [slice(f.start, f.start + f.length) for f in self.fields]
+        # itemgetter に slice を渡すと、1回の呼び出しで全フィールドのバイト列をタプルで返す
+        # (終端を超える slice は Python 側で自動的に切り詰められるため、元の境界チェックと同じ結果になる)
+        if len(self.slices) == 1:
+            single = self.slices[0]
+            self.extract = lambda raw_bytes: (raw_bytes[single],)
+        elif self.slices:
+            self.extract = itemgetter(*self.slices)
+        else:
+            self.extract = lambda raw_bytes: ()
+        self.max_end = max((f.start + f.length for f in fields), default=0)
+        # 型変換が必要なフィールドだけ (index, 変換関数) を保持する
+        self.converters = [
+            (i, converter) for i, converter in enumerate(get_converter(f) for f in self.fields)
+            if converter is not None
+        ]
+
+    def convert_fields(self, values: List[str]) -> List[Any]:
+        """
+        decode_fields の結果を Field.dtype に従って型変換する
+        """
+        for i, converter in self.converters:
+            values[i] = converter(values[i])
+        return values
+
+    def build_dict(self, raw_bytes: Union[bytes, memoryview], typed: bool = False,
+                   expand_groups: bool = False) -> Dict[str, Any]:
+        """
+        レコード全体をパースした辞書を返す (JvParser.parse / RecordView.to_dict の本体)
+
+        繰り返し項目は既定ではデコードしない (O6 は1レコードで4896要素になるため、取り込み経路では
+        raw_data に残し、必要な時だけ RecordView や BigQuery のビューで展開する)。
+        expand_groups=True の場合は {項目名: [値, ...]} の列指向の配列として出力する。
+        """
+        return self.finish_dict(raw_bytes, self.decode_fields(raw_bytes), typed, expand_groups)
+
+    def finish_dict(self, raw_bytes: Union[bytes, memoryview], values: List[str], typed: bool = False,
+                    expand_groups: bool = False) -> Dict[str, Any]:
+        """
+        デコード済みのフィールド値 (decode_fields の結果) から build_dict と同じ辞書を組み立てる
+        """
+        parsed_data = {"record_type": self.record_spec, "_parsed": True} # メタデータ
+        if typed:
+            values = self.convert_fields(values)
+        parsed_data.update(zip(self.names, values))
+        if expand_groups:
+            for group in self.groups:
+                parsed_data[group.name] = group.decode_columns(raw_bytes, typed)
+
+        # 定義されていない残りの部分を raw_body として保持 (ELT用)
+        # 定義の最大終了位置はプランにキャッシュ済み
+        if self.max_end < len(raw_bytes):
+            # ボディ部はバイナリデータを含む可能性もあるが、テキストベースならデコード
+            # エラー時は replace
+            parsed_data["raw_body"] = codecs.decode(raw_bytes[self.max_end:], 'cp932', 'replace').strip()
+
+        # 生データも含めるか？ -> DataSaver側で制御
+
+        return parsed_data
+
+    def decode_fields(self, raw_bytes: Union[bytes, memoryview]) -> List[str]:
+        """
+        全フィールドを抽出してデコードする
+
+        フィールドを区切りバイトで連結して1回だけデコードし、分割する。
+        不正なバイト列や区切りバイトを含むデータの場合はフィールド単位のデコードにフォールバックする
+        (フォールバック時の結果は従来のフィールド単位デコードと完全に一致する)。
+        """
+        chunks = self.extract(raw_bytes)
+        try:
+            values = _SEP.join(chunks).decode("cp932").split("\x00")
+            if len(values) == len(chunks):
+                return [v.strip() for v in values]
+        except UnicodeDecodeError:
+            pass
+        return [_decode_field(chunk) for chunk in chunks]
+
+    def build_many(self, raw_records: List[Union[bytes, memoryview]], typed: bool = False,
+                   expand_groups: bool = False) -> List[Dict[str, Any]]:
+        """
+        同じ種別のレコードをまとめて build_dict する
+
+        全レコードの全フィールドを区切りバイトで連結して1回だけデコードし、レコードごとに切り分ける。
+        連結したデコードに失敗した場合 (不正なバイト列・区切りバイトを含むデータ) は
+        レコードごとの build_dict にフォールバックする (結果は build_dict と完全に一致する)。
+        """
+        extract = self.extract
+        chunks = [chunk for raw_bytes in raw_records for chunk in extract(raw_bytes)]
+        width = len(self.names)
+        try:
+            values = _SEP.join(chunks).decode("cp932").split("\x00")
+        except UnicodeDecodeError:
+            values = None
+        if width == 0 or values is None or len(values) != len(chunks):
+            return [self.build_dict(raw_bytes, typed, expand_groups) for raw_bytes in raw_records]
+        values = [v.strip() for v in values]
+        finish = self.finish_dict
+        return [
+            finish(raw_bytes, values[i:i + width], typed, expand_groups)
+            for raw_bytes, i in zip(raw_records, range(0, len(values), width))
+        ]
+
+
+class GroupPlan:
+    """
+    繰り返し項目 (Repeat) の抽出プラン
+
+    繰り返し部分をまとめて1回デコードし、要素ごとのストライドで各項目を切り出して
+    項目ごとのリスト (列指向の配列) にする。
+    """
+    __slots__ = ("name", "start", "count", "stride", "end", "fields", "converters", "pattern", "blank_row")
+
+    def __init__(self, repeat: Repeat):
+        self.name = repeat.name
+        self.start = repeat.start
+        self.count = repeat.count
+        self.stride = repeat.stride
+        self.end = repeat.start + repeat.length
+        self.fields = sorted(repeat.fields, key=lambda f: f.start)
+        self.converters = [get_converter(f) for f in self.fields]
+        # 1要素分の正規表現 (項目ごとにキャプチャ、隙間は読み飛ばす)
+        # findall で全要素を一度に切り出す
+        parts = []
+        pos = 0
+        for f in self.fields:
+            if f.start > pos:
+                parts.append(f"(?:.{{{f.start - pos}}})")
+            parts.append(f"(.{{{f.length}}})")
+            pos = f.start + f.length
+        if self.stride > pos:
+            parts.append(f"(?:.{{{self.stride - pos}}})")
+        self.pattern = re.compile("".join(parts), re.DOTALL)
+        self.blank_row = tuple(" " * f.length for f in self.fields)
+
+    def decode_columns(self, raw_bytes: Union[bytes, memoryview], typed: bool = False) -> Dict[str, List[Any]]:
+        """
+        繰り返し項目を {項目名: [要素0, 要素1, ...]} の列指向の形でデコードする
+
+        全項目が空欄の要素 (出走していない馬番・存在しない組番) は除外する。
+        """
+        columns = self._decode(raw_bytes, typed)
+        return {f.name: list(col) for f, col in zip(self.fields, columns)}
+
+    def decode_rows(self, raw_bytes: Union[bytes, memoryview], typed: bool = False) -> List[Dict[str, Any]]:
+        """
+        繰り返し項目を [{項目名: 値, ...}, ...] の形でデコードする (RecordView の属性アクセス用)
+
+        要素ごとに dict を作るため、大きな繰り返し項目を大量に処理する場合は decode_columns を使う。
+        """
+        names = [f.name for f in self.fields]
+        return [dict(zip(names, row)) for row in zip(*self._decode(raw_bytes, typed))]
+
+    def _decode(self, raw_bytes: Union[bytes, memoryview], typed: bool) -> List[List[Any]]:
+        region = raw_bytes[self.start:self.end]
+        try:
+            text = codecs.decode(region, 'cp932')
+            # オッズ・票数は ASCII なので文字位置 = バイト位置になる。2バイト文字を含む場合はバイト単位で切り出す
+            if len(text) != len(region):
+                text = None
+        except UnicodeDecodeError:
+            text = None
+
+        if text is not None:
+            rows = self.pattern.findall(text)
+            if len(self.fields) == 1:
+                rows = [(value,) for value in rows]
+            if self.blank_row in rows:
+                rows = [row for row in rows if row != self.blank_row]
+            columns = [[v.strip() for v in col] for col in zip(*rows)] if rows else [[] for _ in self.fields]
+        else:
+            stop = self.count * self.stride
+            columns = [
+                [_decode_field(region[o:o + f.length]) for o in range(f.start, stop, self.stride)]
+                for f in self.fields
+            ]
+            if any(not any(row) for row in zip(*columns)):
+                rows = [row for row in zip(*columns) if any(row)]
+                columns = [list(col) for col in zip(*rows)] if rows else [[] for _ in self.fields]
+
+        if typed:
+            columns = [
+                [converter(v) for v in col] if converter is not None else col
+                for col, converter in zip(columns, self.converters)
+            ]
+        return columns
+
+
+def _decode_field(val_bytes: Union[bytes, memoryview]) -> str:
+    # memoryview には decode メソッドがないため codecs.decode を使う
+    try:
+        return codecs.decode(val_bytes, 'cp932').strip()
+    except UnicodeDecodeError:
+        return codecs.decode(val_bytes, 'cp932', 'replace').strip()
+
+
+def _decode_raw(raw_bytes: Union[bytes, bytearray, memoryview]) -> str:
+    return codecs.decode(raw_bytes, 'cp932', 'replace')
+
+
+def compile_plans(specs: Dict[str, List[SchemaItem]]) -> Dict[str, RecordPlan]:
+    """
+    RECORD_SPECS 形式のスキーマ定義からレコード種別ごとの抽出プランを生成する
+    """
+    return {record_spec: RecordPlan(record_spec, fields) for record_spec, fields in specs.items()}
+
+
+# スキーマはモジュール読み込み時に一度だけコンパイルする
+_DEFAULT_PLANS = compile_plans(RECORD_SPECS)
+
+# レース単位のキー (全レコード共通ヘッダ)
+RACE_KEY_FIELDS = ("Year", "MonthDay", "JyoCD", "Kaiji", "Nichiji", "RaceNum")
+
+
+class RecordView:
+    """
+    1レコードの遅延ビュー
+
+    生のバイト列だけを保持し、フィールドはアクセスされた時点でデコードする。
+    レコード種別ごとに JvParser.view が生成するサブクラスは、フィールド名を __slots__ に持ち、
+    デコード済みの値をそのスロットにキャッシュする (2回目以降のアクセスは通常の属性参照)。
+    record_type / race_key だけを見て読み飛ばすような処理では dict もフィールド文字列も作られない。
+    """
+    __slots__ = ("_raw",)
+
+    # サブクラスで上書きされるクラス属性
+    _plan: RecordPlan = RecordPlan("", [])
+    _key_plan: RecordPlan = RecordPlan("", [])
+    _index: Dict[str, int] = {}
+    _groups: Dict[str, "GroupPlan"] = {}
+    _converters: Dict[str, Callable[[str], Any]] = {}
+    _typed: bool = False
+
+    def __init__(self, raw_bytes: Union[bytes, memoryview]):
+        self._raw = raw_bytes
+
+    def __getattr__(self, name: str) -> Any:
+        # スロット未設定 (未デコード) のフィールドにアクセスされたときだけ呼ばれる
+        index = self._index.get(name)
+        if index is not None:
+            field_slice = self._plan.slices[index]
+            value = _decode_field(self._raw[field_slice])
+            converter = self._converters.get(name)
+            if converter is not None:
+                value = converter(value)
+        else:
+            # 繰り返し項目はアクセスされたときにまとめてデコードする (要素ごとの dict の配列)
+            group = self._groups.get(name)
+            if group is None:
+                raise AttributeError(name)
+            value = group.decode_rows(self._raw, self._typed)
+        setattr(self, name, value)
+        return value
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name: str, default: Any = None) -> Any:
+        if name not in self._index and name not in self._groups:
+            return default
+        return getattr(self, name)
+
+    def columns(self, name: str) -> Dict[str, List[Any]]:
+        """
+        繰り返し項目を {項目名: [値, ...]} の列指向の形で返す
+        (要素ごとの dict を作らないため、オッズ配列を集計するだけの処理に向く)
+        """
+        group = self._groups.get(name)
+        if group is None:
+            raise KeyError(name)
+        return group.decode_columns(self._raw, self._typed)
+
+    @property
+    def record_type(self) -> str:
+        return self._plan.record_spec
+
+    @property
+    def raw_bytes(self) -> Union[bytes, memoryview]:
+        """
+        レコード全体の CP932 バイト列
+        """
+        return self._raw
+
+    @property
+    def race_key(self) -> tuple:
+        """
+        レース単位のキー (開催年, 月日, 場コード, 回次, 日次, レース番号)
+        """
+        # キー項目だけをまとめて1回でデコードする
+        key_plan = self._key_plan
+        values = key_plan.decode_fields(self._raw)
+        if self._typed:
+            values = key_plan.convert_fields(values)
+        return tuple(values)
+
+    def to_dict(self, expand_groups: bool = False) -> Dict[str, Any]:
+        """
+        JvParser.parse と同じ形式の辞書に変換する (シリアライズ用)
+        """
+        return self._plan.build_dict(self._raw, self._typed, expand_groups)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.record_type} race_key={self.race_key}>"
+
+
+def make_view_class(plan: RecordPlan, typed: bool = False) -> type:
+    """
+    レコード種別ごとの RecordView サブクラスを生成する
+    """
+    converters = {}
+    if typed:
+        converters = {plan.names[i]: converter for i, converter in plan.converters}
+    by_name = {f.name: f for f in plan.fields}
+    key_fields = [by_name[name] for name in RACE_KEY_FIELDS if name in by_name]
+    return type(f"{plan.record_spec}View", (RecordView,), {
+        "__slots__": tuple(plan.names) + tuple(group.name for group in plan.groups),
+        "_plan": plan,
+        "_key_plan": RecordPlan(plan.record_spec, key_fields),
+        "_index": {name: i for i, name in enumerate(plan.names)},
+        "_groups": {group.name: group for group in plan.groups},
+        "_converters": converters,
+        "_typed": typed,
+    })
+
+
 class JvParser:
     """
     JV-Linkの固定長データをパースするクラス
     """
-    def __init__(self):
-        self.specs = RECORD_SPECS
+    def __init__(self, specs: Optional[Dict[str, List[SchemaItem]]] = None, typed: bool = False,
+                 expand_groups: bool = False):
+        # typed=True の場合は Field.dtype に従って int / date 等に変換する
+        # (False の場合は従来通り全フィールドを文字列で返す)
+        self.typed = typed
+        # expand_groups=True の場合は繰り返し項目を列指向の配列として出力する (取り込み経路では False)
+        self.expand_groups = expand_groups
+        if specs is None:
+            self.specs = RECORD_SPECS
+            self.plans = _DEFAULT_PLANS
+        else:
+            self.specs = specs
+            self.plans = compile_plans(specs)
+        self.view_classes = {
+            record_spec: make_view_class(plan, typed) for record_spec, plan in self.plans.items()
+        }
 
-    def parse(self, raw_data: str) -> Dict[str, Any]:
+    def parse(self, raw_data: RawRecord) -> Dict[str, Any]:
         """
-        生データ文字列をパースして辞書を返す
+        生データをパースして辞書を返す
+
+        raw_data には JVRead の文字列だけでなく、JVGets で取得した CP932 のバイト列
+        (bytes / memoryview) も渡せる。バイト列の場合はレコード全体のエンコードを行わず、
+        出力する各フィールドを1回だけデコードする。
         """
+        if not isinstance(raw_data, str):
+            return self.parse_bytes(raw_data)
+
         if not raw_data or len(raw_data) < 2:
             return {"raw_data": raw_data, "error": "Too short"}
 
         record_spec = raw_data[0:2]
-        
-        if record_spec not in self.specs:
+        plan = self.plans.get(record_spec)
+
+        if plan is None:
             # 未定義のレコード種別は生データのまま返す
             return {
                 "record_type": record_spec,
-                "raw_data": raw_data, 
+                "raw_data": raw_data,
                 "_parsed": False
             }
 
-        schema = self.specs[record_spec]
-        parsed_data = {"record_type": record_spec, "_parsed": True} # メタデータ
-
         # byteエンコーディングしてバイト位置でスライスする必要がある
         # JRA-VANデータはShift_JIS (CP932)
         try:
@@ -46,39 +483,88 @@ class JvParser:
             logger.warning(f"Failed to encode raw data to cp932. Parsing as string (positions may be off).")
             return {"record_type": record_spec, "raw_data": raw_data, "error": "Encoding failed"}
 
-        for field in schema:
-            # バイト位置で抽出
-            start = field.start
-            length = field.length
-            
-            if start + length > len(raw_bytes):
-                # データ長不足
-                val_bytes = raw_bytes[start:]
+        return plan.build_dict(raw_bytes, self.typed, self.expand_groups)
+
+    def parse_bytes(self, raw_bytes: Union[bytes, bytearray, memoryview]) -> Dict[str, Any]:
+        """
+        CP932 のバイト列をそのままパースして辞書を返す
+        """
+        if len(raw_bytes) < 2:
+            return {"raw_data": _decode_raw(raw_bytes), "error": "Too short"}
+
+        record_spec = codecs.decode(raw_bytes[0:2], 'cp932', 'replace')
+        plan = self.plans.get(record_spec)
+
+        if plan is None:
+            # 未定義のレコード種別は生データのまま返す
+            return {
+                "record_type": record_spec,
+                "raw_data": _decode_raw(raw_bytes),
+                "_parsed": False
+            }
+
+        return plan.build_dict(raw_bytes, self.typed, self.expand_groups)
+
+    def parse_many(self, raw_records: Iterable[RawRecord]) -> List[Dict[str, Any]]:
+        """
+        複数レコードをまとめてパースする (parse と同一の結果をリストで返す)
+
+        レコードを種別ごとに振り分けてプランを1回だけ引き、種別ごとに RecordPlan.build_many で
+        まとめてデコードする。短すぎる・未定義の種別・CP932 に変換できないレコードは parse で処理する。
+        """
+        results: List[Optional[Dict[str, Any]]] = []
+        # 種別ごとの (プラン, 結果の位置, バイト列)
+        batches: Dict[str, Any] = {}
+        plans = self.plans
+        for raw_data in raw_records:
+            results.append(None)
+            if isinstance(raw_data, str):
+                plan = plans.get(raw_data[0:2]) if len(raw_data) >= 2 else None
+                try:
+                    raw_bytes = raw_data.encode('cp932') if plan is not None else None
+                except UnicodeEncodeError:
+                    raw_bytes = None
             else:
-                val_bytes = raw_bytes[start : start + length]
-            
-            # デコード
-            try:
-                val_str = val_bytes.decode('cp932').strip()
-            except UnicodeDecodeError:
-                val_str = val_bytes.decode('cp932', errors='replace').strip()
-            
-            # 型変換 (現時点では全て文字列だが、将来的にはint/date対応も可)
-            parsed_data[field.name] = val_str
+                raw_bytes = raw_data
+                plan = plans.get(codecs.decode(raw_bytes[0:2], 'cp932', 'replace')) if len(raw_bytes) >= 2 else None
+            if plan is None or raw_bytes is None:
+                results[-1] = self.parse(raw_data)
+                continue
+            batch = batches.get(plan.record_spec)
+            if batch is None:
+                batch = batches[plan.record_spec] = (plan, [], [])
+            batch[1].append(len(results) - 1)
+            batch[2].append(raw_bytes)
 
-        # 定義されていない残りの部分を raw_body として保持 (ELT用)
-        # 最後のフィールドの終了位置・定義の最大終了位置を探す
-        max_end = max((f.start + f.length for f in schema), default=0)
-        
-        if max_end < len(raw_bytes):
-            body_bytes = raw_bytes[max_end:]
-            try:
-                # ボディ部はバイナリデータを含む可能性もあるが、テキストベースならデコード
-                # エラー時は replace
-                parsed_data["raw_body"] = body_bytes.decode('cp932', errors='replace').strip()
-            except:
-                parsed_data["raw_body"] = str(body_bytes) # Fallback
+        for plan, positions, raw_list in batches.values():
+            for i, parsed in zip(positions, plan.build_many(raw_list, self.typed, self.expand_groups)):
+                results[i] = parsed
+        return results
 
-        # 生データも含めるか？ -> DataSaver側で制御
+    def view(self, raw_data: RawRecord) -> Optional[RecordView]:
+        """
+        生データの遅延ビューを返す (フィールドはアクセス時にデコードされる)
 
-        return parsed_data
+        未定義のレコード種別・短すぎるレコード・CP932 に変換できない文字列の場合は None を返す
+        (それらは parse で raw_data のまま扱う)。
+        """
+        if isinstance(raw_data, str):
+            try:
+                raw_bytes = raw_data.encode('cp932')
+            except UnicodeEncodeError:
+                return None
+        else:
+            raw_bytes = raw_data
+        if len(raw_bytes) < 2:
+            return None
+        view_class = self.view_classes.get(codecs.decode(raw_bytes[0:2], 'cp932', 'replace'))
+        if view_class is None:
+            return None
+        return view_class(raw_bytes)
+
+    def view_many(self, raw_records: Iterable[RawRecord]) -> List[Optional[RecordView]]:
+        """
+        複数レコードの遅延ビューをまとめて返す
+        """
+        view = self.view
+        return [view(raw_data) for raw_data in raw_records]
@@ -0,0 +1,202 @@
+"""
+JVRead の読み込み・パース・書き出しを並行して行う取り込みパイプライン。
+
+- 読み込み: 呼び出し元のスレッド (COM の呼び出しはメインスレッドから行う) が submit() でレコードを渡す。
+  レコードは batch_records 件、または flush_interval 秒ごとにバッチにまとめる
+- パース: バッチを ProcessPoolExecutor のワーカーに渡し、パースと JSONL のエンコードを並列に行う
+- 書き出し: 書き込みスレッドがバッチを投入した順に結果を受け取り、DataSaver.write_parts() で書き出す
+
+投入済みで書き出し前のバッチは max_pending 個まで (これを超えると submit() が待つ)。
+JV ファイルの終わり (file_end) もバッチと同じキューに入れるため、on_file_end はそのファイルの
+レコードをすべて書き出した後に書き込みスレッドから呼ばれる。
+パース・書き出しでエラーが起きた場合は以降のバッチを捨て、submit() / close() で例外を送出する。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Optional
+
+try:
+    from .parsing import JvParser
+    from .storage import FetchClock, prepare_record
+    from .sinks import encode_records
+except ImportError:
+    from parsing import JvParser
+    from storage import FetchClock, prepare_record
+    from sinks import encode_records
+
+logger = logging.getLogger(__name__)
+
+# ワーカープロセスごとに1回だけ生成するパーサ
+_worker_parser = None
+
+
+def _init_worker(typed: bool):
+    global _worker_parser
+    _worker_parser = JvParser(typed=typed)
+
+
+def parse_batch(raw_records: list, fetched_from: datetime, encode: bool) -> list:
+    """
+    バッチをパースしてレコード種別ごとにまとめる (ワーカープロセスで実行される)
+
+    fetched_from は読み込みスレッドで FetchClock.reserve() したバッチ先頭の取得時刻
+
+    encode=True の場合はレコード種別ごとに JSONL のバイト列にエンコードして返す
+    戻り値: (レコード種別, レコードの list または JSONL バイト列, 件数) のリスト
+    """
+    groups = {}
+    clock = FetchClock(fetched_from)
+    for raw_data in raw_records:
+        record = prepare_record(_worker_parser, raw_data, clock.next())
+        groups.setdefault(record.get("record_type", "UNKNOWN"), []).append(record)
+    return [
+        (record_type, encode_records(records) if encode else records, len(records))
+        for record_type, records in groups.items()
+    ]
+
+
+class IngestPipeline:
+    """
+    DataSaver への書き込みを並列化するパイプライン
+
+    使い方:
+        with IngestPipeline(saver, workers=4, on_file_end=on_file_end) as pipeline:
+            for line in client.read(on_file_end=pipeline.file_end):
+                pipeline.submit(line)
+    """
+    def __init__(
+        self,
+        saver,
+        workers: Optional[int] = None,
+        batch_records: int = 1000,
+        flush_interval: Optional[float] = 1.0,
+        max_pending: Optional[int] = None,
+        on_file_end: Optional[Callable[[str], None]] = None,
+    ):
+        self.saver = saver
+        self.batch_records = max(1, batch_records)
+        self.flush_interval = flush_interval
+        self.on_file_end = on_file_end
+        # JSONL のシンクはエンコード済みのバイト列を受け取れるので、エンコードもワーカーで行う
+        self.encode = hasattr(saver.sink, "write_encoded")
+
+        workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(saver.parser.typed,)
+        )
+        self.queue = queue.Queue(maxsize=max_pending or workers * 2)
+        self.error = None
+        self._aborted = False
+        self.stats = {"batches": 0, "records": 0, "backpressure_waits": 0}
+
+        self._batch = []
+        self._batch_started = None
+        # DataSaver と同じ時計で、バッチをまたいでも取得時刻が読み込み順に増えるようにする
+        self.clock = saver.clock
+        self._date_str = None
+
+        self._writer = threading.Thread(target=self._write_loop, name="ingest-writer", daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(abort=exc_type is not None)
+
+    def submit(self, raw_data):
+        """
+        1レコードを投入する
+        """
+        if self._batch_started is None:
+            # バッチごとに時計を1回だけ読む (レコードの取得時刻は _cut で予約する)
+            now = self.clock.tick()
+            self._date_str = now.strftime('%Y%m%d')
+            self._batch_started = time.monotonic()
+        if isinstance(raw_data, memoryview):
+            # memoryview はプロセス間で受け渡せないので bytes にする
+            raw_data = raw_data.tobytes()
+        self._batch.append(raw_data)
+
+        if len(self._batch) >= self.batch_records or (
+            self.flush_interval is not None
+            and time.monotonic() - self._batch_started >= self.flush_interval
+        ):
+            self._cut()
+
+    def file_end(self, filename: str):
+        """
+        JV ファイルの終わりを通知する (JVLinkClient.read の on_file_end に設定する)
+        """
+        self._cut()
+        self._put(("file_end", filename))
+
+    def _cut(self):
+        if not self._batch:
+            return
+        fetched_from = self.clock.reserve(len(self._batch))
+        future = self.executor.submit(parse_batch, self._batch, fetched_from, self.encode)
+        self._put(("batch", self._date_str, future))
+        self.stats["batches"] += 1
+        self.stats["records"] += len(self._batch)
+        self._batch = []
+        self._batch_started = None
+
+    def _put(self, item):
+        # キューが空くまで待つ (バックプレッシャー)。待っている間に書き込み側が失敗したら中断する
+        waited = False
+        while True:
+            if self.error is not None:
+                raise RuntimeError(f"Ingest pipeline failed: {self.error}") from self.error
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if not waited:
+                    self.stats["backpressure_waits"] += 1
+                    waited = True
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None or self._aborted:
+                # 失敗・中断後は残りのバッチを捨てる
+                if item[0] == "batch":
+                    item[2].cancel()
+                continue
+            try:
+                if item[0] == "batch":
+                    _, date_str, future = item
+                    self.saver.write_parts(date_str, future.result())
+                elif self.on_file_end is not None:
+                    self.on_file_end(item[1])
+            except BaseException as e:
+                logger.error(f"Ingest pipeline writer failed: {e}")
+                self.error = e
+
+    def close(self, abort: bool = False):
+        """
+        残りのバッチを書き出して終了する。abort=True の場合は書き出し前のバッチを捨てる
+        """
+        if self._writer is None:
+            return
+        try:
+            if abort:
+                self._aborted = True
+            elif self.error is None:
+                self._cut()
+        finally:
+            # 書き込みスレッドはキューを読み続けるので、終了の印は必ず入れられる
+            self.queue.put(None)
+            self._writer.join()
+            self._writer = None
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.error is not None and not abort:
+            raise RuntimeError(f"Ingest pipeline failed: {self.error}") from self.error
@@ -1,59 +1,271 @@
 """
 既存のJSONLデータを新しいスキーマで再パースするスクリプト。
 raw_data から拡張フィールドを抽出して新しいJSONLを生成する。
+
+レコード種別ごとのスキーマ (Field 定義) のフィンガープリントを出力先の状態ファイルに記録し、
+前回の再パースからスキーマも入力ファイルも変わっていないファイルはスキップする。
+残りのファイルはプロセスプールで並列に処理し、一時ファイルに書き出してから置き換える。
+1種別のファイル (RA_*.jsonl 等) は columnar.parse_records で BATCH_LINES 行ずつ列指向でまとめてパースする。
+状態ファイルはファイル単位で更新するため、中断しても次回は未完了のファイルから再開できる。
+gzip 圧縮したチャンク (*.jsonl.gz, main.py --compression gzip の出力) は gzip のまま再パースする。
+
+使い方:
+    python reparse.py --input output_v2 --output output_v3 --workers 4
 """
+import argparse
+import gzip
+import hashlib
 import json
 import os
 import sys
 import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from glob import glob
 
 sys.path.insert(0, os.path.dirname(__file__))
+from columnar import parse_records
 from parsing import JvParser
+from schema.definitions import RECORD_SPECS
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def reparse_jsonl(input_dir: str, output_dir: str):
-    parser = JvParser()
-    os.makedirs(output_dir, exist_ok=True)
+STATE_FILENAME = "_reparse_state.json"
+
+# 列指向でまとめてパースする行数
+BATCH_LINES = 10000
+
+# ワーカープロセスごとに1回だけ生成するパーサ
+_parsers = {}
+
+
+def schema_fingerprint(fields: list, typed: bool = False) -> str:
+    """
+    Field / Repeat 定義のリストからフィンガープリントを計算する
+    (NamedTuple はネストしたリストも含めて JSON の配列として直列化できる)
+    """
+    payload = json.dumps({"fields": fields, "typed": typed}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def file_fingerprint(filename: str, typed: bool = False) -> str:
+    """
+    ファイル名の先頭 (RA_20240101.jsonl の RA) からレコード種別を判定し、そのスキーマのフィンガープリントを返す
+    種別を判定できないファイル (複数種別が混在する RACE_*.jsonl 等) は全種別のスキーマから計算する
+    """
+    record_type = filename.split("_")[0]
+    if record_type in RECORD_SPECS:
+        return schema_fingerprint(RECORD_SPECS[record_type], typed)
+    return schema_fingerprint(sorted(RECORD_SPECS.items()), typed)
+
+
+def load_state(output_dir: str) -> dict:
+    path = os.path.join(output_dir, STATE_FILENAME)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
-    files = glob(os.path.join(input_dir, "*.jsonl"))
+
+def save_state(output_dir: str, state: dict):
+    # 一時ファイルに書いてディスクに同期してから置き換える (書き込み途中で中断しても状態ファイルが壊れない)
+    path = os.path.join(output_dir, STATE_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def source_signature(filepath: str) -> dict:
+    stat = os.stat(filepath)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def plan_reparse(input_dir: str, output_dir: str, state: dict, typed: bool = False, force: bool = False) -> list:
+    """
+    再パースが必要なファイルを (入力パス, 出力パス, フィンガープリント) のリストで返す
+    """
+    files = sorted(glob(os.path.join(input_dir, "*.jsonl")) + glob(os.path.join(input_dir, "*.jsonl.gz")))
     logger.info(f"Found {len(files)} JSONL files in {input_dir}")
 
+    tasks = []
+    skipped = 0
     for filepath in files:
         filename = os.path.basename(filepath)
         output_path = os.path.join(output_dir, filename)
-        count = 0
-        
-        with open(filepath, 'r', encoding='utf-8') as fin, \
-             open(output_path, 'w', encoding='utf-8') as fout:
-            
-            for line in fin:
-                try:
-                    old_rec = json.loads(line)
-                    raw_data = old_rec.get('raw_data', '')
-                    
-                    if not raw_data:
-                        fout.write(line)
-                        continue
-                    
-                    # 新しいスキーマで再パース
-                    new_rec = parser.parse(raw_data)
-                    
-                    # 元のメタデータを保持
-                    new_rec['fetched_at'] = old_rec.get('fetched_at', '')
-                    new_rec['raw_data'] = raw_data
-                    
-                    fout.write(json.dumps(new_rec, ensure_ascii=False) + '\n')
-                    count += 1
-                except Exception as e:
-                    logger.warning(f"Error parsing line in {filename}: {e}")
-                    fout.write(line)
-        
-        logger.info(f"Re-parsed {filename}: {count} records -> {output_path}")
+        fingerprint = file_fingerprint(filename, typed)
+        entry = state["files"].get(filename)
+        unchanged = (
+            entry is not None
+            and entry.get("fingerprint") == fingerprint
+            and entry.get("source") == source_signature(filepath)
+            and os.path.exists(output_path)
+        )
+        if unchanged and not force:
+            skipped += 1
+            continue
+        tasks.append((filepath, output_path, fingerprint))
+
+    logger.info(f"{len(tasks)} files to re-parse, {skipped} unchanged files skipped")
+    return tasks
+
+
+def reparse_file(filepath: str, output_path: str, typed: bool = False) -> tuple:
+    """
+    1ファイルを再パースする (ワーカープロセスで実行される)
+    戻り値: (レコード数, エラー数)
+    """
+    parser = _parsers.get(typed)
+    if parser is None:
+        parser = _parsers[typed] = JvParser(typed=typed)
+
+    filename = os.path.basename(filepath)
+    record_type = filename.split("_")[0]
+    if record_type not in RECORD_SPECS:
+        record_type = None
+    tmp_path = output_path + ".tmp"
+    count = 0
+    errors = 0
+
+    compressed = filepath.endswith(".gz")
+    opener = gzip.open if compressed else open
+    with opener(filepath, 'rt', encoding='utf-8') as fin, open(tmp_path, 'wb') as fout:
+        # 出力は sinks.OutputChunk と同じく、バイナリのファイルに (gzip の場合は GzipFile を重ねて) 書く
+        stream = gzip.GzipFile(fileobj=fout, mode='wb') if compressed else fout
+
+        batch = []
+        for line in fin:
+            batch.append(line)
+            if len(batch) >= BATCH_LINES:
+                lines, batch_count, batch_errors = reparse_lines(batch, parser, record_type, typed, filename)
+                stream.write(''.join(lines).encode('utf-8'))
+                count += batch_count
+                errors += batch_errors
+                batch = []
+        lines, batch_count, batch_errors = reparse_lines(batch, parser, record_type, typed, filename)
+        stream.write(''.join(lines).encode('utf-8'))
+        count += batch_count
+        errors += batch_errors
+
+        if stream is not fout:
+            stream.close()
+        fout.flush()
+        os.fsync(fout.fileno())
+
+    # 書き込みが完了してディスクに同期してから出力ファイルを置き換える
+    os.replace(tmp_path, output_path)
+    return count, errors
+
+
+def reparse_lines(lines: list, parser: JvParser, record_type: str, typed: bool, filename: str) -> tuple:
+    """
+    JSONL の行をまとめて再パースする
+    record_type のレコードは parse_records で列指向にまとめてパースし、それ以外 (種別の異なるレコード・
+    CP932 に変換できない行) は parser.parse で1件ずつパースする。パースできない行は元のまま出力する。
+    戻り値: (出力する行, レコード数, エラー数)
+    """
+    out = list(lines)
+    records = [None] * len(lines)
+    # 列指向でパースする行の (位置, CP932 バイト列)
+    columnar = []
+    count = 0
+    errors = 0
+
+    for i, line in enumerate(lines):
+        try:
+            old_rec = json.loads(line)
+        except Exception as e:
+            logger.warning(f"Error parsing line in {filename}: {e}")
+            errors += 1
+            continue
+        raw_data = old_rec.get('raw_data', '')
+        if not raw_data:
+            continue
+        records[i] = old_rec
+        if record_type is not None and raw_data[0:2] == record_type:
+            try:
+                columnar.append((i, raw_data.encode('cp932')))
+                continue
+            except UnicodeEncodeError:
+                pass
+
+    parsed = {}
+    if columnar:
+        try:
+            parsed = dict(zip(
+                [i for i, _ in columnar],
+                parse_records([raw for _, raw in columnar], record_type, typed=typed),
+            ))
+        except Exception as e:
+            logger.warning(f"Columnar parse failed in {filename}, parsing records one by one: {e}")
+
+    for i, old_rec in enumerate(records):
+        if old_rec is None:
+            continue
+        raw_data = old_rec['raw_data']
+        try:
+            # 新しいスキーマで再パース
+            new_rec = parsed[i] if i in parsed else parser.parse(raw_data)
+
+            # 元のメタデータを保持
+            new_rec['fetched_at'] = old_rec.get('fetched_at', '')
+            new_rec['raw_data'] = raw_data
+
+            out[i] = json.dumps(new_rec, ensure_ascii=False) + '\n'
+            count += 1
+        except Exception as e:
+            logger.warning(f"Error parsing line in {filename}: {e}")
+            errors += 1
+
+    return out, count, errors
+
+
+def reparse_jsonl(input_dir: str, output_dir: str, workers: int = None, typed: bool = False, force: bool = False):
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_state(output_dir)
+    tasks = plan_reparse(input_dir, output_dir, state, typed=typed, force=force)
+    if not tasks:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(reparse_file, filepath, output_path, typed): (filepath, output_path, fingerprint)
+            for filepath, output_path, fingerprint in tasks
+        }
+        for future in as_completed(futures):
+            filepath, output_path, fingerprint = futures[future]
+            filename = os.path.basename(filepath)
+            try:
+                count, errors = future.result()
+            except Exception as e:
+                logger.error(f"Failed to re-parse {filename}: {e}")
+                continue
+
+            # 完了したファイルごとに状態を保存する (中断後の再実行で続きから処理できる)
+            state["files"][filename] = {
+                "fingerprint": fingerprint,
+                "source": source_signature(filepath),
+                "records": count,
+                "errors": errors,
+            }
+            save_state(output_dir, state)
+            logger.info(f"Re-parsed {filename}: {count} records ({errors} errors) -> {output_path}")
+
+
+def main():
+    base_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Re-parse JSONL files with the current schema")
+    parser.add_argument("--input", default=os.path.join(base_dir, "output_v2"), help="Input directory")
+    parser.add_argument("--output", default=os.path.join(base_dir, "output_v3"), help="Output directory")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--typed", action="store_true", help="Convert fields by their schema dtype")
+    parser.add_argument("--force", action="store_true", help="Re-parse all files even if unchanged")
+    args = parser.parse_args()
+
+    reparse_jsonl(args.input, args.output, workers=args.workers, typed=args.typed, force=args.force)
+
 
 if __name__ == "__main__":
-    input_dir = os.path.join(os.path.dirname(__file__), "output_v2")
-    output_dir = os.path.join(os.path.dirname(__file__), "output_v3")
-    reparse_jsonl(input_dir, output_dir)
+    main()
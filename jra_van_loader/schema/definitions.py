@@ -1,30 +1,67 @@
-from typing import List, Tuple, Dict, Any, NamedTuple
+from typing import List, Tuple, Dict, Any, NamedTuple, Union
 
 class Field(NamedTuple):
     name: str
     start: int
     length: int
-    dtype: str = "str" # str, int, date, etc.
+    dtype: str = "str" # str, code, int, date, decimal
     desc: str = ""
+    scale: int = 0 # decimal の小数桁数 (例: オッズ "0123" -> 12.3 なら 1)
+
+
+class Repeat(NamedTuple):
+    """
+    繰り返し項目 (固定長の構造体の配列)
+
+    fields の start は繰り返し要素の先頭からの相対位置。
+    例: 単勝オッズ (馬番2 + オッズ4 + 人気2 = 8バイト) x 28頭
+    """
+    name: str
+    start: int
+    count: int
+    fields: List[Field]
+    desc: str = ""
+
+    @property
+    def stride(self) -> int:
+        # 繰り返し要素1件のバイト長
+        return max(f.start + f.length for f in self.fields)
+
+    @property
+    def length(self) -> int:
+        # 繰り返し項目全体のバイト長 (Field と同じく start + length で終了位置になる)
+        return self.count * self.stride
+
+
+SchemaItem = Union[Field, Repeat]
 
 # JRA-VAN レコード定義
 # (フィールド名, 開始位置(0-indexed, CP932バイト), 長さ(byte), データ型, 説明)
 #
+# データ型 (JvParser(typed=True) のときに変換される):
+#   str     : 前後の空白を除いた文字列
+#   code    : ゼロ埋めのコード値。先頭の0を保持した文字列 (空欄は None)
+#   int     : 整数 (空欄・数字以外は None)
+#   date    : YYYYMMDD -> "YYYY-MM-DD" (空欄・00000000・不正な日付は None)
+#   decimal : 小数点なしの数値。scale 桁の小数として解釈 (空欄・数字以外は None)
+#
 # 戦略: ELTアプローチ
 # 主要フィールドはパースしてカラム化し、残りは raw_body として保持。
 # 詳細なパースが必要な場合はBigQuery側で SUBSTR 等を使う。
+# オッズ・払戻・票数のように同じ構造が並ぶ部分は Repeat で定義する。取り込み時はデコードせず raw_data に残し、
+# RecordView (Python) や loader_bq.py --group-views の BigQuery ビューで必要な時に展開する。
 
 # 共通ヘッダ (全レコード共通, 27バイト)
 COMMON_HEADER: List[Field] = [
     Field("RecordSpec", 0, 2, "str", "レコード種別"),
-    Field("DataKubun", 2, 1, "str", "データ区分"),
-    Field("MakeDate", 3, 8, "str", "データ作成日"),
-    Field("Year", 11, 4, "str", "開催年"),
-    Field("MonthDay", 15, 4, "str", "開催月日"),
-    Field("JyoCD", 19, 2, "str", "場コード"),
-    Field("Kaiji", 21, 2, "str", "回次"),
-    Field("Nichiji", 23, 2, "str", "日次"),
-    Field("RaceNum", 25, 2, "str", "レース番号"),
+    Field("DataKubun", 2, 1, "code", "データ区分"),
+    Field("MakeDate", 3, 8, "date", "データ作成日"),
+    Field("Year", 11, 4, "int", "開催年"),
+    Field("MonthDay", 15, 4, "code", "開催月日"),
+    Field("JyoCD", 19, 2, "code", "場コード"),
+    Field("Kaiji", 21, 2, "code", "回次"),
+    Field("Nichiji", 23, 2, "code", "日次"),
+    Field("RaceNum", 25, 2, "code", "レース番号"),
 ]
 
 # RA: レース詳細 (約1272バイト)
@@ -35,43 +72,185 @@ COMMON_HEADER: List[Field] = [
 #   616: TrackCD(2)  ※芝/ダ・左右を示す (10=芝左, 23=ダ右 等)
 #   697: Kyori(4)    ※距離 (1200, 1400, ... 3600)
 RA_SCHEMA: List[Field] = COMMON_HEADER + [
-    Field("YoubiCD", 27, 1, "str", "曜日コード"),
-    Field("TokuNum", 28, 4, "str", "特別競走番号"),
+    Field("YoubiCD", 27, 1, "code", "曜日コード"),
+    Field("TokuNum", 28, 4, "code", "特別競走番号"),
     Field("Hondai", 32, 60, "str", "レース名本題"),
     Field("Fukudai", 92, 60, "str", "副題"),
     Field("Kakko", 152, 60, "str", "括弧付き名称"),
-    Field("TrackCD", 616, 2, "str", "トラックコード"),
-    Field("Kyori", 697, 4, "str", "距離"),
+    Field("TrackCD", 616, 2, "code", "トラックコード"),
+    Field("Kyori", 697, 4, "int", "距離"),
     # 以降は raw_body として保持
 ]
 
 # SE: 馬毎レース情報 (約555バイト)
 SE_SCHEMA: List[Field] = COMMON_HEADER + [
-    Field("Wakuban", 27, 1, "str", "枠番"),
-    Field("Umaban", 28, 2, "str", "馬番"),
-    Field("KettoNum", 30, 10, "str", "血統登録番号"),
+    Field("Wakuban", 27, 1, "int", "枠番"),
+    Field("Umaban", 28, 2, "code", "馬番"),
+    Field("KettoNum", 30, 10, "code", "血統登録番号"),
     Field("Bamei", 40, 36, "str", "馬名"),
     # 以降は raw_body として保持
 ]
 
 # JG: 競走馬除外情報
 JG_SCHEMA: List[Field] = COMMON_HEADER + [
-    Field("HorseID", 27, 10, "str", "血統登録番号"),
+    Field("HorseID", 27, 10, "code", "血統登録番号"),
     Field("HorseName", 37, 36, "str", "馬名"),
 ]
 
-RECORD_SPECS: Dict[str, List[Field]] = {
+# 払戻・票数の繰り返し要素
+def _pay_fields(kumi_length: int, ninki_length: int) -> List[Field]:
+    return [
+        Field("Kumi", 0, kumi_length, "code", "馬番・組番"),
+        Field("Pay", kumi_length, 9, "int", "払戻金"),
+        Field("Ninki", kumi_length + 9, ninki_length, "int", "人気順"),
+    ]
+
+
+def _hyo_fields(kumi_length: int, ninki_length: int) -> List[Field]:
+    return [
+        Field("Kumi", 0, kumi_length, "code", "馬番・組番"),
+        Field("Hyo", kumi_length, 11, "int", "票数"),
+        Field("Ninki", kumi_length + 11, ninki_length, "int", "人気順"),
+    ]
+
+
+# HR: 払戻 (719バイト)
+HR_SCHEMA: List[SchemaItem] = COMMON_HEADER + [
+    Field("TorokuTosu", 27, 2, "int", "登録頭数"),
+    Field("SyussoTosu", 29, 2, "int", "出走頭数"),
+    Field("FuseirituFlag", 31, 9, "code", "不成立フラグ (券種毎9桁)"),
+    Field("TokubaraiFlag", 40, 9, "code", "特払フラグ (券種毎9桁)"),
+    Field("HenkanFlag", 49, 9, "code", "返還フラグ (券種毎9桁)"),
+    Field("HenkanUma", 58, 28, "code", "返還馬番情報 (馬番01-28)"),
+    Field("HenkanWaku", 86, 8, "code", "返還枠番情報 (枠番1-8)"),
+    Field("HenkanDoWaku", 94, 8, "code", "返還同枠情報 (枠番1-8)"),
+    Repeat("PayTansyo", 102, 3, _pay_fields(2, 2), "単勝払戻"),
+    Repeat("PayFukusyo", 141, 5, _pay_fields(2, 2), "複勝払戻"),
+    Repeat("PayWakuren", 206, 3, _pay_fields(2, 2), "枠連払戻"),
+    Repeat("PayUmaren", 245, 3, _pay_fields(4, 3), "馬連払戻"),
+    Repeat("PayWide", 293, 7, _pay_fields(4, 3), "ワイド払戻"),
+    # 405-452: 予備
+    Repeat("PayUmatan", 453, 6, _pay_fields(4, 3), "馬単払戻"),
+    Repeat("PaySanrenpuku", 549, 3, _pay_fields(6, 3), "3連複払戻"),
+    Repeat("PaySanrentan", 603, 6, _pay_fields(6, 4), "3連単払戻"),
+]
+
+# H1: 票数1 (28955バイト)
+H1_SCHEMA: List[SchemaItem] = COMMON_HEADER + [
+    Field("TorokuTosu", 27, 2, "int", "登録頭数"),
+    Field("SyussoTosu", 29, 2, "int", "出走頭数"),
+    Field("HatubaiFlag", 31, 7, "code", "発売フラグ (券種毎7桁)"),
+    Field("FukuChakuBaraiKey", 38, 1, "code", "複勝着払キー"),
+    Field("HenkanUma", 39, 28, "code", "返還馬番情報 (馬番01-28)"),
+    Field("HenkanWaku", 67, 8, "code", "返還枠番情報 (枠番1-8)"),
+    Field("HenkanDoWaku", 75, 8, "code", "返還同枠情報 (枠番1-8)"),
+    Repeat("HyoTansyo", 83, 28, _hyo_fields(2, 2), "単勝票数"),
+    Repeat("HyoFukusyo", 503, 28, _hyo_fields(2, 2), "複勝票数"),
+    Repeat("HyoWakuren", 923, 36, _hyo_fields(2, 2), "枠連票数"),
+    Repeat("HyoUmaren", 1463, 153, _hyo_fields(4, 3), "馬連票数"),
+    Repeat("HyoWide", 4217, 153, _hyo_fields(4, 3), "ワイド票数"),
+    Repeat("HyoUmatan", 6971, 306, _hyo_fields(4, 3), "馬単票数"),
+    Repeat("HyoSanrenpuku", 12479, 816, _hyo_fields(6, 3), "3連複票数"),
+    Repeat("HyoTotal", 28799, 14, [Field("Hyo", 0, 11, "int", "票数合計")], "票数合計 (券種毎 + 返還分)"),
+]
+
+# H6: 票数 3連単 (102890バイト)
+H6_SCHEMA: List[SchemaItem] = COMMON_HEADER + [
+    Field("TorokuTosu", 27, 2, "int", "登録頭数"),
+    Field("SyussoTosu", 29, 2, "int", "出走頭数"),
+    Field("HatubaiFlag", 31, 1, "code", "発売フラグ 3連単"),
+    Field("HenkanUma", 32, 18, "code", "返還馬番情報 (馬番01-18)"),
+    Repeat("HyoSanrentan", 50, 4896, _hyo_fields(6, 4), "3連単票数"),
+    Repeat("HyoTotal", 102866, 2, [Field("Hyo", 0, 11, "int", "票数合計")], "票数合計 (3連単 + 返還分)"),
+]
+
+# O1-O6: オッズ (共通: 発表月日時分・登録頭数・出走頭数)
+ODDS_HEADER: List[Field] = COMMON_HEADER + [
+    Field("HappyoTime", 27, 8, "code", "発表月日時分"),
+    Field("TorokuTosu", 35, 2, "int", "登録頭数"),
+    Field("SyussoTosu", 37, 2, "int", "出走頭数"),
+]
+
+
+def _odds_fields(kumi_length: int, odds_length: int, ninki_length: int) -> List[Field]:
+    return [
+        Field("Kumi", 0, kumi_length, "code", "馬番・組番"),
+        Field("Odds", kumi_length, odds_length, "decimal", "オッズ", 1),
+        Field("Ninki", kumi_length + odds_length, ninki_length, "int", "人気順"),
+    ]
+
+
+# O1: オッズ 単勝・複勝・枠連 (962バイト)
+O1_SCHEMA: List[SchemaItem] = ODDS_HEADER + [
+    Field("TansyoFlag", 39, 1, "code", "発売フラグ 単勝"),
+    Field("FukusyoFlag", 40, 1, "code", "発売フラグ 複勝"),
+    Field("WakurenFlag", 41, 1, "code", "発売フラグ 枠連"),
+    Field("FukuChakuBaraiKey", 42, 1, "code", "複勝着払キー"),
+    Repeat("OddsTansyo", 43, 28, _odds_fields(2, 4, 2), "単勝オッズ"),
+    Repeat("OddsFukusyo", 267, 28, [
+        Field("Kumi", 0, 2, "code", "馬番"),
+        Field("OddsLow", 2, 4, "decimal", "最低オッズ", 1),
+        Field("OddsHigh", 6, 4, "decimal", "最高オッズ", 1),
+        Field("Ninki", 10, 2, "int", "人気順"),
+    ], "複勝オッズ"),
+    Repeat("OddsWakuren", 603, 36, _odds_fields(2, 5, 2), "枠連オッズ"),
+    Field("TotalHyosuTansyo", 927, 11, "int", "単勝票数合計"),
+    Field("TotalHyosuFukusyo", 938, 11, "int", "複勝票数合計"),
+    Field("TotalHyosuWakuren", 949, 11, "int", "枠連票数合計"),
+]
+
+# O2: オッズ 馬連 (2042バイト)
+O2_SCHEMA: List[SchemaItem] = ODDS_HEADER + [
+    Field("UmarenFlag", 39, 1, "code", "発売フラグ 馬連"),
+    Repeat("OddsUmaren", 40, 153, _odds_fields(4, 6, 3), "馬連オッズ"),
+    Field("TotalHyosuUmaren", 2029, 11, "int", "馬連票数合計"),
+]
+
+# O3: オッズ ワイド (2654バイト)
+O3_SCHEMA: List[SchemaItem] = ODDS_HEADER + [
+    Field("WideFlag", 39, 1, "code", "発売フラグ ワイド"),
+    Repeat("OddsWide", 40, 153, [
+        Field("Kumi", 0, 4, "code", "組番"),
+        Field("OddsLow", 4, 5, "decimal", "最低オッズ", 1),
+        Field("OddsHigh", 9, 5, "decimal", "最高オッズ", 1),
+        Field("Ninki", 14, 3, "int", "人気順"),
+    ], "ワイドオッズ"),
+    Field("TotalHyosuWide", 2641, 11, "int", "ワイド票数合計"),
+]
+
+# O4: オッズ 馬単 (4031バイト)
+O4_SCHEMA: List[SchemaItem] = ODDS_HEADER + [
+    Field("UmatanFlag", 39, 1, "code", "発売フラグ 馬単"),
+    Repeat("OddsUmatan", 40, 306, _odds_fields(4, 6, 3), "馬単オッズ"),
+    Field("TotalHyosuUmatan", 4018, 11, "int", "馬単票数合計"),
+]
+
+# O5: オッズ 3連複 (12293バイト)
+O5_SCHEMA: List[SchemaItem] = ODDS_HEADER + [
+    Field("SanrenpukuFlag", 39, 1, "code", "発売フラグ 3連複"),
+    Repeat("OddsSanrenpuku", 40, 816, _odds_fields(6, 6, 3), "3連複オッズ"),
+    Field("TotalHyosuSanrenpuku", 12280, 11, "int", "3連複票数合計"),
+]
+
+# O6: オッズ 3連単 (83285バイト)
+O6_SCHEMA: List[SchemaItem] = ODDS_HEADER + [
+    Field("SanrentanFlag", 39, 1, "code", "発売フラグ 3連単"),
+    Repeat("OddsSanrentan", 40, 4896, _odds_fields(6, 7, 4), "3連単オッズ"),
+    Field("TotalHyosuSanrentan", 83272, 11, "int", "3連単票数合計"),
+]
+
+RECORD_SPECS: Dict[str, List[SchemaItem]] = {
     "JG": JG_SCHEMA,
     "RA": RA_SCHEMA,
     "SE": SE_SCHEMA,
-    "HR": COMMON_HEADER,
-    "H1": COMMON_HEADER,
-    "H6": COMMON_HEADER,
+    "HR": HR_SCHEMA,
+    "H1": H1_SCHEMA,
+    "H6": H6_SCHEMA,
     "WF": COMMON_HEADER,
-    "O1": COMMON_HEADER,
-    "O2": COMMON_HEADER,
-    "O3": COMMON_HEADER,
-    "O4": COMMON_HEADER,
-    "O5": COMMON_HEADER,
-    "O6": COMMON_HEADER,
+    "O1": O1_SCHEMA,
+    "O2": O2_SCHEMA,
+    "O3": O3_SCHEMA,
+    "O4": O4_SCHEMA,
+    "O5": O5_SCHEMA,
+    "O6": O6_SCHEMA,
 }
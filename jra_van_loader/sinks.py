@@ -0,0 +1,563 @@
+"""
+DataSaver の出力先 (シンク) の実装。
+
+DataSaver はパース済みレコードをレコード種別・日付ごとのバッチにまとめ、
+write(record_type, date_str, records) でシンクに渡す。
+
+- JsonlSink: レコード種別ごとの日次 JSONL に追記する。
+  ローテーション (サイズ・件数) や gzip 圧縮を指定するとチャンクファイルに分割して書き出す
+- ParquetSink: RECORD_SPECS から型付きの Arrow スキーマを組み立て、列指向 (Parquet) で保存する
+
+チャンクは書き込み中は "{ファイル名}.part" とし、完成したら本来の名前にリネームして
+_manifest.jsonl に1行追記する。リネーム済みのファイルは取り込み中でも loader_bq.py でロードできる。
+ローテーション・日付の切り替わりで閉じたチャンクは .part のまま残し、commit() (main.py では JV ファイルの
+完了をチェックポイントに記録した後) で完成させる。完成したチャンクには取り込みが完了した JV ファイルの
+レコードだけが入るため、再開時の restore_outputs で削除・変更されることはない。
+エラー時は abort() でチャンクを完成させずにファイルを閉じる (.part は再開時に restore_outputs が戻す)。
+"""
+import gzip
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime
+from glob import glob
+from typing import Any, Dict, List, Optional
+
+try:
+    from .schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
+except ImportError:
+    from schema.definitions import RECORD_SPECS, Field, Repeat, SchemaItem
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - Parquet 出力を使わない環境では不要
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "_manifest.jsonl"
+PART_SUFFIX = ".part"
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def encode_records(records: List[Dict[str, Any]]) -> bytes:
+    """
+    レコードのリストを JSONL のバイト列にまとめてエンコードする
+    """
+    return ("\n".join(map(_encoder.encode, records)) + "\n").encode('utf-8')
+
+
+class ChunkManifest:
+    """
+    完成したチャンクファイルの一覧 (_manifest.jsonl) を管理する
+    """
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+
+    def next_seq(self, record_type: str, date_str: str, extension: str) -> int:
+        """
+        既存のチャンク (書き込み途中の .part を含む) の次の連番を返す
+        """
+        pattern = re.compile(
+            re.escape(f"{record_type}_{date_str}_") + r"(\d{4})" + re.escape(extension)
+            + f"(?:{re.escape(PART_SUFFIX)})?$"
+        )
+        seq = 0
+        for path in glob(os.path.join(self.output_dir, f"{record_type}_{date_str}_*")):
+            m = pattern.match(os.path.basename(path))
+            if m:
+                seq = max(seq, int(m.group(1)))
+        return seq + 1
+
+    def append(self, entry: Dict[str, Any]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class OutputChunk:
+    """
+    1つの出力ファイル (チャンク)
+
+    part_path を指定した場合は part_path に書き込み、finish() で path にリネームする。
+    compression="gzip" の場合はストリーミングで gzip 圧縮する。
+    ファイルハンドルは open() で開き、suspend() で一時的に閉じられる (再度 open() すると追記を再開する)。
+    """
+    def __init__(self, path: str, part_path: Optional[str] = None, compression: Optional[str] = None):
+        self.path = path
+        self.part_path = part_path
+        self.compression = compression
+        self.records = 0
+        self.raw_bytes = 0
+        self.file = None
+        self.stream = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.file is not None
+
+    def open(self):
+        # Shift_JISではなくUTF-8で保存 (BigQuery等はUTF-8推奨)
+        # エンコード済みのバイト列を書き込むためバイナリモードで開く
+        self.file = open(self.part_path or self.path, 'ab')
+        # 再オープン時の gzip は新しいメンバーとして追記される (連結された gzip として読める)
+        self.stream = gzip.GzipFile(fileobj=self.file, mode='ab') if self.compression == "gzip" else self.file
+
+    def write(self, data: bytes, records: int):
+        self.stream.write(data)
+        if self.stream is self.file:
+            self.file.flush()
+        self.records += records
+        self.raw_bytes += len(data)
+
+    def sync(self):
+        if not self.is_open:
+            return
+        if self.stream is not self.file:
+            # 圧縮済みのデータを出力ファイルまで書き出す (Z_SYNC_FLUSH)
+            self.stream.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def position(self) -> Dict[str, Any]:
+        """
+        現在の書き込み位置 (チェックポイント用)。ファイルサイズは sync() 後の値を使うこと
+        """
+        location = self.part_path or self.path
+        return {
+            "path": self.path,
+            "part_path": self.part_path,
+            "compression": self.compression,
+            "records": self.records,
+            "bytes": os.path.getsize(location) if os.path.exists(location) else 0,
+        }
+
+    def suspend(self):
+        """
+        ファイルハンドルを閉じる (ディスクに同期してから閉じるので、閉じている間もデータは失われない)
+        """
+        if not self.is_open:
+            return
+        if self.stream is not self.file:
+            self.stream.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        self.stream = None
+
+    def finish(self) -> Dict[str, Any]:
+        """
+        ファイルを閉じて完成させ、manifest に記録する内容を返す
+        """
+        self.suspend()
+        if self.part_path:
+            os.replace(self.part_path, self.path)
+        return {
+            "file": os.path.basename(self.path),
+            "records": self.records,
+            "raw_bytes": self.raw_bytes,
+            "bytes": os.path.getsize(self.path),
+            "finished_at": datetime.now().isoformat(),
+        }
+
+
+class JsonlSink:
+    """
+    レコード種別ごとの日次 JSONL ファイルに書き出すシンク
+
+    既定では従来どおり {種別}_{日付}.jsonl (例: RA_20240101.jsonl) に追記する。
+    max_bytes (非圧縮バイト数) / max_records / compression のいずれかを指定するとチャンクモードになり、
+    {種別}_{日付}_{連番}.jsonl[.gz] に分割して書き出す。ローテーションはバッチ単位で判定する。
+
+    BigQuery の JSON ロードが扱える圧縮形式は gzip のみのため、compression は "gzip" だけを受け付ける。
+
+    同時に開くファイルハンドルは max_open_files 個までで、超えた場合は最も長く使われていないものを閉じる (LRU)。
+    閉じたファイルは次の書き込み時に開き直して追記する。
+    rollover(date_str) でその日付のファイルをすべて閉じる (日付の切り替わり)。
+    チャンクモードでは、ローテーション・rollover で閉じたチャンクは commit() / close() で完成させる。
+    ハンドルの開閉回数は stats に記録する。
+
+    on_open を設定すると、新しいファイルに初めて書き込む前にその位置 (OutputChunk.position) で呼ばれる。
+    """
+    def __init__(
+        self,
+        output_dir: str,
+        fsync: bool = False,
+        compression: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        max_records: Optional[int] = None,
+        max_open_files: int = 64,
+    ):
+        if compression not in (None, "gzip"):
+            raise ValueError(f"Unsupported JSONL compression: {compression}")
+        self.output_dir = output_dir
+        self.fsync = fsync
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.max_open_files = max(1, max_open_files)
+        self.chunked = bool(compression or max_bytes or max_records)
+        self.extension = ".jsonl.gz" if compression == "gzip" else ".jsonl"
+        self.manifest = ChunkManifest(output_dir) if self.chunked else None
+        # 書き込み中のファイル (キー: (種別, 日付))。ハンドルを開いているものは open_keys に LRU 順で持つ
+        self.files = {}
+        self.open_keys = OrderedDict()
+        # 閉じたが commit() 前のチャンク ((種別, 日付), OutputChunk)
+        self.sealed = []
+        self.stats = {"opened": 0, "reopened": 0, "evicted": 0, "finished": 0, "rollovers": 0}
+        self.on_open = None
+
+    def _new_chunk(self, record_type: str, date_str: str) -> OutputChunk:
+        if not self.chunked:
+            return OutputChunk(os.path.join(self.output_dir, f"{record_type}_{date_str}{self.extension}"))
+        seq = self.manifest.next_seq(record_type, date_str, self.extension)
+        path = os.path.join(self.output_dir, f"{record_type}_{date_str}_{seq:04d}{self.extension}")
+        return OutputChunk(path, part_path=path + PART_SUFFIX, compression=self.compression)
+
+    def _acquire(self, key) -> OutputChunk:
+        """
+        key のファイルを開いた状態で返す (必要なら LRU のハンドルを閉じる)
+        """
+        chunk = self.files.get(key)
+        if chunk is None:
+            chunk = self.files[key] = self._new_chunk(*key)
+            if self.on_open is not None:
+                self.on_open(dict(chunk.position(), record_type=key[0], date=key[1]))
+        elif chunk.is_open:
+            self.open_keys.move_to_end(key)
+            return chunk
+        else:
+            self.stats["reopened"] += 1
+
+        while len(self.open_keys) >= self.max_open_files:
+            lru_key, _ = self.open_keys.popitem(last=False)
+            self.files[lru_key].suspend()
+            self.stats["evicted"] += 1
+        chunk.open()
+        self.stats["opened"] += 1
+        self.open_keys[key] = None
+        return chunk
+
+    def _should_rotate(self, chunk: OutputChunk) -> bool:
+        return bool(
+            (self.max_bytes and chunk.raw_bytes >= self.max_bytes)
+            or (self.max_records and chunk.records >= self.max_records)
+        )
+
+    def _seal(self, key):
+        """
+        key のファイルを閉じる。チャンクは commit() まで .part のまま残す
+        """
+        chunk = self.files.pop(key)
+        self.open_keys.pop(key, None)
+        if self.chunked:
+            chunk.suspend()
+            self.sealed.append((key, chunk))
+        else:
+            chunk.finish()
+            self.stats["finished"] += 1
+
+    def commit(self):
+        """
+        ローテーション・日付の切り替わりで閉じたチャンクを完成させ、manifest に記録する
+        """
+        for (record_type, date_str), chunk in self.sealed:
+            entry = chunk.finish()
+            self.stats["finished"] += 1
+            self.manifest.append({"record_type": record_type, "date": date_str, **entry})
+            logger.info("Finished chunk %s (%s records)", entry["file"], entry["records"])
+        self.sealed = []
+
+    def write(self, record_type: str, date_str: str, records: List[Dict[str, Any]]):
+        """
+        バッチを1回のシリアライズ・1回の write で書き出す
+        """
+        self.write_encoded(record_type, date_str, encode_records(records), len(records))
+
+    def write_encoded(self, record_type: str, date_str: str, payload: bytes, count: int):
+        """
+        エンコード済みの JSONL (count 件分) を書き出す
+        """
+        key = (record_type, date_str)
+        chunk = self._acquire(key)
+        chunk.write(payload, count)
+        if self.fsync:
+            chunk.sync()
+        if self.chunked and self._should_rotate(chunk):
+            self._seal(key)
+
+    def rollover(self, date_str: str):
+        """
+        date_str の日付のファイルをすべて閉じる
+        """
+        keys = [key for key in self.files if key[1] == date_str]
+        for key in keys:
+            self._seal(key)
+        if keys:
+            self.stats["rollovers"] += 1
+
+    def checkpoint(self):
+        for chunk in self.files.values():
+            chunk.sync()
+
+    def outputs(self) -> List[Dict[str, Any]]:
+        """
+        書き込み中のファイルの位置の一覧 (checkpoint() の直後に呼ぶ)
+        """
+        chunks = list(self.files.items()) + self.sealed
+        return [
+            dict(chunk.position(), record_type=record_type, date=date_str)
+            for (record_type, date_str), chunk in chunks
+        ]
+
+    def close(self):
+        for key in list(self.files):
+            self._seal(key)
+        if self.chunked:
+            self.commit()
+
+    def abort(self):
+        """
+        エラー時の終了: ファイルを閉じるだけで、チャンクは完成させない
+        """
+        for chunk in self.files.values():
+            chunk.suspend()
+        for _, chunk in self.sealed:
+            chunk.suspend()
+        self.files = {}
+        self.open_keys = OrderedDict()
+        self.sealed = []
+
+
+def _arrow_type(field: Field, typed: bool):
+    if not typed:
+        return pa.string()
+    if field.dtype == "int":
+        return pa.int64()
+    if field.dtype == "decimal":
+        return pa.float64()
+    if field.dtype == "date":
+        return pa.date32()
+    return pa.string()
+
+
+def _arrow_field(item: Field, typed: bool):
+    return pa.field(item.name, _arrow_type(item, typed))
+
+
+def arrow_schema(fields: Optional[List[SchemaItem]] = None, typed: bool = False):
+    """
+    Field 定義から JvParser.parse + DataSaver の出力に対応する Arrow スキーマを生成する
+    fields=None の場合は未定義の種別・パースできなかったレコード用のスキーマを返す
+    """
+    columns = [pa.field("record_type", pa.string()), pa.field("_parsed", pa.bool_())]
+    if fields is None:
+        columns.append(pa.field("error", pa.string()))
+    else:
+        # 繰り返し項目は JvParser.parse が出力しないため (raw_data に残る) 列にしない
+        columns.extend(_arrow_field(item, typed) for item in fields if not isinstance(item, Repeat))
+        columns.append(pa.field("raw_body", pa.string()))
+    columns.append(pa.field("fetched_at", pa.string()))
+    columns.append(pa.field("raw_data", pa.string()))
+    return pa.schema(columns)
+
+
+def _as_input_type(data_type):
+    # 日付は JvParser では "YYYY-MM-DD" 文字列なので、文字列として取り込んでから date32 にキャストする
+    if pa.types.is_date(data_type):
+        return pa.string()
+    return data_type
+
+
+def write_parquet(table, path: str, compression: str, row_group_records: int):
+    """
+    Arrow のテーブルを Parquet として path に保存する (一時ファイルに書いてから置き換える)
+    """
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, compression=compression, row_group_size=row_group_records)
+    os.replace(tmp_path, path)
+
+
+def convert_arrow_part(part_path: str, path: str, compression: str, row_group_records: int) -> int:
+    """
+    書き込み中のチャンク (Arrow IPC ストリーム) を Parquet に変換して path に保存し、part_path を削除する
+    末尾が切り詰められたストリームも、最後の完全なバッチまで読める
+    戻り値: レコード数
+    """
+    with pa.memory_map(part_path) as source:
+        table = pa.ipc.open_stream(source).read_all()
+        write_parquet(table, path, compression, row_group_records)
+        records = table.num_rows
+    # Windows ではメモリマップを閉じてからでないと削除できない
+    del table
+    os.remove(part_path)
+    return records
+
+
+class ParquetSink:
+    """
+    レコード種別・日付ごとの Parquet チャンク (例: SE_20240101_0001.parquet) に書き出すシンク
+
+    列の型は RECORD_SPECS の Field.dtype から決める (typed=False の場合はすべて文字列)。
+    Parquet はフッターを書くまで読めず、途中まで書いたファイルから復旧できないため、
+    書き込み中のチャンクは .part として Arrow IPC ストリーム形式で追記し、max_records 件に達したとき
+    (ローテーション) と rollover() で閉じる。閉じたチャンクは commit() / close() で Parquet
+    (row_group_records 件ごとの行グループ) に変換して manifest に記録する。
+    受け取ったバッチは row_group_records 件に達するまで溜めてから1つのバッチとしてストリームに書き出す。
+    checkpoint() は溜めたレコードを書き出してディスクに同期するだけでチャンクは閉じない。
+    IPC ストリームはバッチ単位で読めるため、再開時は記録したバイト数に切り詰めてから変換する
+    (checkpoint.IngestCheckpoint.restore_outputs)。ストリームは開き直せないため、ハンドルの LRU プールは使わない。
+    """
+    extension = ".parquet"
+
+    def __init__(
+        self,
+        output_dir: str,
+        typed: bool = False,
+        compression: str = "zstd",
+        row_group_records: int = 50000,
+        max_records: Optional[int] = None,
+        specs: Optional[Dict[str, List[SchemaItem]]] = None,
+    ):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for Parquet output (pip install pyarrow)")
+        self.output_dir = output_dir
+        self.typed = typed
+        self.compression = compression
+        self.row_group_records = max(1, row_group_records)
+        self.max_records = max_records
+        self.specs = RECORD_SPECS if specs is None else specs
+        self.manifest = ChunkManifest(output_dir)
+        self.schemas = {}
+        self.writers = {}
+        self.pending = {}
+        # 閉じたが commit() 前のチャンク ((種別, 日付), パス, レコード数, バイト数)
+        self.sealed = []
+        self.on_open = None
+
+    def _schema(self, record_type: str):
+        schema = self.schemas.get(record_type)
+        if schema is None:
+            schema = self.schemas[record_type] = arrow_schema(self.specs.get(record_type), self.typed)
+        return schema
+
+    def write(self, record_type: str, date_str: str, records: List[Dict[str, Any]]):
+        key = (record_type, date_str)
+        pending = self.pending.setdefault(key, [])
+        pending.extend(records)
+        if len(pending) >= self.row_group_records:
+            self._write_batch(key)
+
+    def _position(self, key, path: str, records: int, size: int) -> Dict[str, Any]:
+        record_type, date_str = key
+        return {
+            "path": path, "part_path": path + PART_SUFFIX, "compression": None, "format": "arrow",
+            "parquet_compression": self.compression, "row_group_records": self.row_group_records,
+            "records": records, "bytes": size, "record_type": record_type, "date": date_str,
+        }
+
+    def _write_batch(self, key):
+        records = self.pending.pop(key, None)
+        if not records:
+            return
+        record_type, date_str = key
+        schema = self._schema(record_type)
+        input_schema = pa.schema([f.with_type(_as_input_type(f.type)) for f in schema])
+        table = pa.Table.from_pylist(records, schema=input_schema)
+        if input_schema != schema:
+            table = table.cast(schema)
+
+        entry = self.writers.get(key)
+        if entry is None:
+            seq = self.manifest.next_seq(record_type, date_str, self.extension)
+            path = os.path.join(self.output_dir, f"{record_type}_{date_str}_{seq:04d}{self.extension}")
+            if self.on_open is not None:
+                self.on_open(self._position(key, path, 0, 0))
+            file = open(path + PART_SUFFIX, 'wb')
+            entry = self.writers[key] = [pa.ipc.new_stream(file, schema), file, path, 0]
+        entry[0].write_table(table)
+        entry[3] += len(records)
+        if self.max_records and entry[3] >= self.max_records:
+            self._seal(key)
+
+    def _seal(self, key):
+        """
+        key のチャンクのストリームを閉じる。Parquet への変換は commit() で行う
+        """
+        writer, file, path, records = self.writers.pop(key)
+        writer.close()
+        file.flush()
+        os.fsync(file.fileno())
+        size = file.tell()
+        file.close()
+        self.sealed.append((key, path, records, size))
+
+    def commit(self):
+        """
+        ローテーション・日付の切り替わりで閉じたチャンクを Parquet に変換し、manifest に記録する
+        """
+        for (record_type, date_str), path, records, _ in self.sealed:
+            convert_arrow_part(path + PART_SUFFIX, path, self.compression, self.row_group_records)
+            self.manifest.append({
+                "record_type": record_type,
+                "date": date_str,
+                "file": os.path.basename(path),
+                "records": records,
+                "bytes": os.path.getsize(path),
+                "finished_at": datetime.now().isoformat(),
+            })
+            logger.info("Finished chunk %s (%s records)", os.path.basename(path), records)
+        self.sealed = []
+
+    def rollover(self, date_str: str):
+        """
+        date_str の日付のチャンクをすべて書き出して閉じる
+        """
+        for key in [key for key in self.pending if key[1] == date_str]:
+            self._write_batch(key)
+        for key in [key for key in self.writers if key[1] == date_str]:
+            self._seal(key)
+
+    def checkpoint(self):
+        for key in list(self.pending):
+            self._write_batch(key)
+        for _, file, _, _ in self.writers.values():
+            file.flush()
+            os.fsync(file.fileno())
+
+    def outputs(self) -> List[Dict[str, Any]]:
+        # checkpoint() の直後に呼ぶ (バッチの境界で同期済みのバイト数を返す)
+        return [
+            self._position(key, path, records, file.tell())
+            for key, (_, file, path, records) in self.writers.items()
+        ] + [self._position(key, path, records, size) for key, path, records, size in self.sealed]
+
+    def close(self):
+        for key in list(self.pending):
+            self._write_batch(key)
+        for key in list(self.writers):
+            self._seal(key)
+        self.commit()
+
+    def abort(self):
+        """
+        エラー時の終了: ストリームを閉じるだけで、Parquet への変換はしない
+        """
+        for writer, file, _, _ in self.writers.values():
+            try:
+                # ストリームの終端を書くだけ (再開時は記録したバイト数に切り詰める)
+                writer.close()
+            finally:
+                file.close()
+        self.writers = {}
+        self.pending = {}
+        self.sealed = []
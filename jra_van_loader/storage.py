@@ -1,52 +1,244 @@
-import json
+import codecs
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+from typing import Optional
 try:
     from .parsing import JvParser
+    from .sinks import JsonlSink
 except ImportError:
     from parsing import JvParser
+    from sinks import JsonlSink
+
+class FetchClock:
+    """
+    レコードごとの取得時刻 (fetched_at) を発行する
+
+    時計は tick() (バッファ・バッチの開始時) に1回だけ読み、以降のレコードには 1 マイクロ秒ずつ
+    進めた時刻を付ける。発行する時刻は単調増加するので、同じキーのレコードが同じバッファに複数あっても
+    (速報の後に確定の DataKubun を読んだ場合など) ORDER BY fetched_at DESC
+    (loader_bq.py の MERGE・02_build_serving_tables.sql) で後に読んだレコードが選ばれる。
+    """
+    def __init__(self, start: Optional[datetime] = None):
+        self._second = None
+        self._prefix = None
+        self._micro = 0
+        if start is not None:
+            self._start(start)
+
+    def _start(self, at: datetime):
+        # 秒までの ISO 形式を保持し、レコードごとにはマイクロ秒の部分だけを付け足す
+        self._second = at.replace(microsecond=0)
+        self._prefix = self._second.isoformat()
+        self._micro = at.microsecond
+
+    def position(self) -> Optional[datetime]:
+        """
+        次に発行する時刻 (tick() の前は None)
+        """
+        if self._second is None:
+            return None
+        return self._second + timedelta(microseconds=self._micro)
+
+    def tick(self) -> datetime:
+        """
+        時計を読み直し、その時刻を返す (前回発行した時刻より前には戻らない)
+        """
+        now = datetime.now()
+        floor = self.position()
+        if floor is not None and now < floor:
+            now = floor
+        self._start(now)
+        return now
+
+    def next(self) -> str:
+        """
+        1レコード分の取得時刻 (ISO 形式の文字列) を発行する
+        """
+        if self._micro >= 1000000:
+            self._start(self.position())
+        value = f"{self._prefix}.{self._micro:06d}"
+        self._micro += 1
+        return value
+
+    def reserve(self, count: int) -> datetime:
+        """
+        count レコード分の時刻を予約し、その先頭の時刻を返す
+        (別プロセスのワーカーが FetchClock(先頭の時刻) で同じ時刻を発行する)
+        """
+        start = self.position()
+        self._start(start + timedelta(microseconds=count))
+        return start
+
+
+def prepare_record(parser: JvParser, raw_data, fetched_at: str) -> dict:
+    """
+    1レコードをパースし、取得時刻と生データを付与した保存用の dict を返す
+
+    raw_data は JVRead の文字列、または JVGets の CP932 バイト列 (bytes / memoryview)
+    """
+    # パース実行
+    parsed_record = parser.parse(raw_data)
+
+    # タイムスタンプ付与
+    parsed_record["fetched_at"] = fetched_at
+
+    # 生データの保持 (ELTのため必須)
+    # parsing.py で raw_data を含めていない場合に追加
+    if "raw_data" not in parsed_record:
+        if isinstance(raw_data, str):
+            parsed_record["raw_data"] = raw_data
+        else:
+            # バイト列の場合はレコード全体のデコードはここで1回だけ行う
+            parsed_record["raw_data"] = codecs.decode(raw_data, 'cp932', 'replace')
+    return parsed_record
+
 
 class DataSaver:
-    def __init__(self, output_dir: str):
+    """
+    パース結果をレコード種別ごとの日次 JSONL に保存する
+
+    レコードはファイルごとのバッファに溜め、buffer_records 件に達するか
+    前回の書き出しから flush_interval 秒経過した時点でまとめて書き出す (flush)。
+    時計はバッファごと (tick ごと) に1回だけ読み、ファイル名の日付に使う。各レコードの取得時刻
+    (fetched_at) は FetchClock で読み込み順に 1 マイクロ秒ずつずらす。
+    日付が変わった場合は前日分のファイルをシンクの rollover() で閉じて完成させる。
+
+    書き出し先は sink (sinks.py) で差し替えられる。省略時は JsonlSink で、
+    バッファ内のレコードを1回のシリアライズ・1回の write で書き込む。
+    fsync=True の場合は flush のたびに、それ以外は checkpoint() / close() 時にディスクへ同期する。
+    """
+    def __init__(self, output_dir: str, typed: bool = False, buffer_records: int = 1000,
+                 flush_interval: float = 1.0, fsync: bool = False, sink=None):
         self.output_dir = output_dir
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        self.files = {}
-        self.parser = JvParser()
-
-    def save(self, raw_data: str):
-        # 取得時刻
-        fetched_at = datetime.now().isoformat()
-        
-        # パース実行
-        parsed_record = self.parser.parse(raw_data)
+        # typed=True の場合は Field.dtype に従って int / date 等に変換して保存する
+        self.parser = JvParser(typed=typed)
+        self.sink = sink if sink is not None else JsonlSink(output_dir, fsync=fsync)
+
+        self.buffer_records = max(1, buffer_records)
+        self.flush_interval = flush_interval
+        self.buffers = {}
+        self.pending = 0
+        self._tick_started = None
+        self.clock = FetchClock()
+        self._date_str = None
+
+    def _tick(self):
+        """
+        新しいバッファの開始時に取得時刻を1回だけ取得する
+        """
+        now = self.clock.tick()
+        self._set_date(now.strftime('%Y%m%d'))
+        self._tick_started = time.monotonic()
+
+    def _set_date(self, date_str: str):
+        if self._date_str is not None and date_str != self._date_str:
+            # 日付の切り替わり: バッファは書き出し済みなので、前日分のファイルを完成させる
+            self.sink.rollover(self._date_str)
+        self._date_str = date_str
+
+    def save(self, raw_data):
+        """
+        1レコードをパースしてバッファに追加する
+
+        raw_data は JVRead の文字列、または JVGets の CP932 バイト列 (bytes / memoryview)
+        """
+        if self._tick_started is None:
+            self._tick()
+
+        parsed_record = prepare_record(self.parser, raw_data, self.clock.next())
         record_type = parsed_record.get("record_type", "UNKNOWN")
-        
-        # タイムスタンプ付与
-        parsed_record["fetched_at"] = fetched_at
-        
-        # 生データの保持 (ELTのため必須)
-        # parsing.py で raw_data を含めていない場合に追加
-        if "raw_data" not in parsed_record:
-            parsed_record["raw_data"] = raw_data
 
-        # ファイル名決定
-        # レコード種別ごとに日次ファイルを作成する
+        # 出力先の決定
+        # レコード種別ごとに日次ファイルを作成する (ファイル名はシンクが決める)
         # 例: RA_20240101.jsonl
         # これにより、BigQueryロード時にテーブル分割やパーティション分割が容易になる
-        
-        date_str = datetime.now().strftime('%Y%m%d')
-        filename = f"{record_type}_{date_str}.jsonl"
-        filepath = os.path.join(self.output_dir, filename)
-        
-        if filepath not in self.files:
-            # Shift_JISではなくUTF-8で保存 (BigQuery等はUTF-8推奨)
-            self.files[filepath] = open(filepath, 'a', encoding='utf-8')
-        
-        json.dump(parsed_record, self.files[filepath], ensure_ascii=False)
-        self.files[filepath].write('\n')
+        key = (record_type, self._date_str)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = []
+        buffer.append(parsed_record)
+        self.pending += 1
+
+        if self.pending >= self.buffer_records or (
+            self.flush_interval is not None
+            and time.monotonic() - self._tick_started >= self.flush_interval
+        ):
+            self.flush()
+
+    def save_many(self, raw_records):
+        """
+        複数レコードをまとめて保存する
+        """
+        for raw_data in raw_records:
+            if raw_data:
+                self.save(raw_data)
+
+    def write_parts(self, date_str: str, parts):
+        """
+        別プロセスでパース済みのバッチを書き出す (pipeline.py の書き込みステージから呼ばれる)
+
+        parts は (レコード種別, レコードの list またはエンコード済みの JSONL バイト列, 件数) のリスト
+        """
+        if self.pending:
+            self.flush()
+        self._set_date(date_str)
+        for record_type, payload, count in parts:
+            if isinstance(payload, bytes):
+                self.sink.write_encoded(record_type, date_str, payload, count)
+            else:
+                self.sink.write(record_type, date_str, payload)
+
+    def flush(self):
+        """
+        バッファのレコードをレコード種別・日付ごとのバッチとしてシンクに書き出す
+        """
+        for (record_type, date_str), records in self.buffers.items():
+            if records:
+                self.sink.write(record_type, date_str, records)
+        self.buffers = {}
+        self.pending = 0
+        self._tick_started = None
+
+    def checkpoint(self):
+        """
+        バッファを書き出し、シンクの出力をディスクに同期する (耐久性チェックポイント)
+        """
+        self.flush()
+        self.sink.checkpoint()
+
+    def commit(self):
+        """
+        ローテーション・日付の切り替わりで閉じたチャンクを完成させる
+        (JV ファイルの完了をチェックポイントに記録した後に呼ぶ)
+        """
+        self.sink.commit()
+
+    def outputs(self) -> list:
+        """
+        書き込み中の出力ファイルの位置 (パス・バイト数・レコード数) の一覧 (checkpoint() の直後に呼ぶ)
+        """
+        return self.sink.outputs()
+
+    @property
+    def stats(self) -> dict:
+        """
+        シンクのファイルハンドルの開閉回数 (opened / reopened / evicted / finished / rollovers)
+        """
+        return dict(getattr(self.sink, "stats", {}))
 
     def close(self):
-        for f in self.files.values():
-            f.close()
-        self.files = {}
+        self.flush()
+        self.sink.close()
+
+    def abort(self):
+        """
+        エラー時の終了: バッファを捨て、チャンクを完成させずにファイルを閉じる
+        (チェックポイント後のレコードは再開時に restore_outputs が取り除く)
+        """
+        self.buffers = {}
+        self.pending = 0
+        self._tick_started = None
+        self.sink.abort()
@@ -0,0 +1,587 @@
+"""
+鮮度が必要なレコード種別 (オッズ O1〜O6 等) を BigQuery に直接ストリーミングするシンク。
+
+通常の経路 (DataSaver → JSONL ファイル → loader_bq.py のロードジョブ) はファイルの区切りと
+ロードジョブの待ち時間だけ遅れる。StreamingSink は取り込みループから JV ファイル名と一緒に
+レコードを受け取り、レコード種別ごとの小さなバッチとして書き込み先 (エンドポイント) に追記する。
+
+書き込み先はレコード種別ごとの committed ストリームで、追記は必ずオフセット付きで行う。
+- 同じオフセットへの再送は OffsetAlreadyExists で拒否されるため、応答が失われた追記の再送で
+  行が重複しない
+- JV ファイルごと・レコード種別ごとにコミット済みの行数を _stream_state.json に記録し、
+  中断後に同じ JV ファイルを読み直したときはコミット済みの行を読み飛ばす
+- 追記の前に内容 (JV ファイル・先頭行・行数・オフセット) を pending として記録しておき、
+  再起動時にストリームを確定 (finalize) して得た行数から、その追記が反映されたかを判定する
+
+エンドポイントは次の2つ。
+- FakeWriteEndpoint: ローカル検証用。ストリームと行を指定ディレクトリのファイルに保存する
+- StorageWriteEndpoint: BigQuery Storage Write API (google-cloud-bigquery-storage が必要)
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    from .parsing import JvParser
+    from .storage import FetchClock, prepare_record
+except ImportError:
+    from parsing import JvParser
+    from storage import FetchClock, prepare_record
+
+logger = logging.getLogger(__name__)
+
+STREAM_STATE_FILENAME = "_stream_state.json"
+DEFAULT_STREAM_TYPES = ("O1", "O2", "O3", "O4", "O5", "O6")
+
+
+def _load_bq_metrics():
+    """
+    bq_metrics モジュールを返す (google-cloud-bigquery がない環境では None: 追記の統計は記録しない)
+    """
+    try:
+        from . import bq_metrics
+    except ImportError:
+        try:
+            import bq_metrics
+        except ImportError:
+            return None
+    return bq_metrics
+
+
+class OffsetAlreadyExists(Exception):
+    """
+    指定オフセットの行は既にコミット済み (応答が失われた追記の再送)
+    """
+
+
+class OffsetOutOfRange(Exception):
+    """
+    指定オフセットがストリームの末尾より先 (状態ファイルとストリームの不整合)
+    """
+
+
+def record_type_of(raw_data) -> str:
+    """
+    生レコード (文字列 / CP932 バイト列) の先頭2バイトのレコード種別
+    """
+    head = raw_data[:2]
+    if isinstance(head, str):
+        return head
+    return bytes(head).decode('ascii', 'replace')
+
+
+class FakeWriteEndpoint:
+    """
+    Storage Write API の committed ストリームを模したローカルの書き込み先
+
+    ストリームの状態は {directory}/_streams.json、追記された行は {directory}/{テーブル名}.jsonl に保存する
+    (プロセスをまたいだ再開の検証ができる)。
+    lose_ack_every=N の場合、N 回に1回は行を書き込んだ後に ConnectionError を送出する (応答の消失)。
+    """
+    def __init__(self, directory: str, lose_ack_every: int = 0):
+        self.directory = directory
+        self.lose_ack_every = lose_ack_every
+        self.appends = 0
+        os.makedirs(directory, exist_ok=True)
+        self.state_path = os.path.join(directory, "_streams.json")
+        self.streams: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.streams = json.load(f)
+
+    def _save(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.streams, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def table_for(self, record_type: str) -> str:
+        return record_type
+
+    def create_stream(self, table: str) -> str:
+        name = f"{table}/streams/{uuid.uuid4().hex[:12]}"
+        self.streams[name] = {"table": table, "rows": 0, "finalized": False}
+        self._save()
+        return name
+
+    def append_rows(self, stream: str, rows: List[Dict[str, Any]], offset: int):
+        state = self.streams[stream]
+        if state["finalized"]:
+            raise RuntimeError(f"Stream {stream} is finalized")
+        if offset < state["rows"]:
+            raise OffsetAlreadyExists(f"{stream}: offset {offset} < {state['rows']}")
+        if offset > state["rows"]:
+            raise OffsetOutOfRange(f"{stream}: offset {offset} > {state['rows']}")
+        with open(os.path.join(self.directory, f"{state['table']}.jsonl"), 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+        state["rows"] += len(rows)
+        self._save()
+        self.appends += 1
+        if self.lose_ack_every and self.appends % self.lose_ack_every == 0:
+            raise ConnectionError(f"{stream}: response lost after append at offset {offset}")
+
+    def finalize(self, stream: str) -> int:
+        state = self.streams[stream]
+        state["finalized"] = True
+        self._save()
+        return state["rows"]
+
+    def close(self):
+        pass
+
+
+class StorageWriteEndpoint:
+    """
+    BigQuery Storage Write API の committed ストリームへの書き込み先
+
+    行はテーブル名 {dataset}.{レコード種別} に追記する。テーブルがなければ RECORD_SPECS から
+    生成したスキーマ (loader_bq.bigquery_schema) で作成する。行は既存テーブルのスキーマから組み立てた
+    protobuf メッセージに変換して送るため、自動検出でロードされたテーブルにも追記できる。
+    """
+    def __init__(self, client, dataset_id: str, typed: bool = False, write_client=None):
+        from google.cloud import bigquery_storage_v1
+
+        self.client = client
+        self.dataset_id = dataset_id
+        self.typed = typed
+        self.write_client = write_client or bigquery_storage_v1.BigQueryWriteClient()
+        self.tables: Dict[str, Any] = {}
+        self.stream_tables: Dict[str, str] = {}
+        self.connections: Dict[str, Any] = {}
+
+    def table_for(self, record_type: str) -> str:
+        return f"{self.client.project}.{self.dataset_id}.{record_type}"
+
+    def _table(self, table_id: str):
+        """
+        テーブルのスキーマと、それに対応する protobuf のメッセージクラスを返す (テーブルごとに1回)
+        """
+        cached = self.tables.get(table_id)
+        if cached is not None:
+            return cached
+        from google.api_core.exceptions import NotFound
+        from google.cloud import bigquery
+
+        try:
+            from .loader_bq import bigquery_schema
+            from .schema.definitions import RECORD_SPECS
+        except ImportError:
+            from loader_bq import bigquery_schema
+            from schema.definitions import RECORD_SPECS
+
+        try:
+            table = self.client.get_table(table_id)
+        except NotFound:
+            record_type = table_id.rsplit(".", 1)[-1]
+            table = bigquery.Table(table_id, schema=bigquery_schema(RECORD_SPECS.get(record_type, []), self.typed))
+            table = self.client.create_table(table, exists_ok=True)
+            logger.info("Created %s for streaming", table_id)
+        descriptor, message_class = _proto_for_schema(table.schema)
+        cached = self.tables[table_id] = (table.schema, descriptor, message_class)
+        return cached
+
+    def create_stream(self, table_id: str) -> str:
+        from google.cloud.bigquery_storage_v1 import types
+
+        self._table(table_id)
+        project, dataset, table = table_id.split(".")
+        stream = self.write_client.create_write_stream(
+            parent=self.write_client.table_path(project, dataset, table),
+            write_stream=types.WriteStream(type_=types.WriteStream.Type.COMMITTED),
+        )
+        self.stream_tables[stream.name] = table_id
+        return stream.name
+
+    def _connection(self, stream: str, table_id: str):
+        connection = self.connections.get(stream)
+        if connection is None:
+            from google.cloud.bigquery_storage_v1 import types, writer
+
+            _, descriptor, _ = self._table(table_id)
+            template = types.AppendRowsRequest(
+                write_stream=stream,
+                proto_rows=types.AppendRowsRequest.ProtoData(
+                    writer_schema=types.ProtoSchema(proto_descriptor=descriptor)
+                ),
+            )
+            connection = self.connections[stream] = writer.AppendRowsStream(self.write_client, template)
+        return connection
+
+    def append_rows(self, stream: str, rows: List[Dict[str, Any]], offset: int):
+        from google.api_core import exceptions
+        from google.cloud.bigquery_storage_v1 import types
+
+        table_id = self.stream_tables[stream]
+        schema, _, message_class = self._table(table_id)
+        serialized = []
+        for row in rows:
+            message = message_class()
+            _fill_message(message, schema, row)
+            serialized.append(message.SerializeToString())
+        request = types.AppendRowsRequest(
+            offset=offset,
+            proto_rows=types.AppendRowsRequest.ProtoData(rows=types.ProtoRows(serialized_rows=serialized)),
+        )
+        try:
+            self._connection(stream, table_id).send(request).result()
+        except exceptions.AlreadyExists as e:
+            raise OffsetAlreadyExists(str(e)) from e
+        except exceptions.OutOfRange as e:
+            raise OffsetOutOfRange(str(e)) from e
+        except Exception:
+            # 接続を張り直してから再送する
+            self._close_connection(stream)
+            raise
+
+    def _close_connection(self, stream: str):
+        connection = self.connections.pop(stream, None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.debug("Closing append connection for %s failed: %s", stream, e)
+
+    def finalize(self, stream: str) -> int:
+        self._close_connection(stream)
+        return self.write_client.finalize_write_stream(name=stream).row_count
+
+    def close(self):
+        for stream in list(self.connections):
+            self._close_connection(stream)
+
+
+# BigQuery の列型 -> protobuf のフィールド型名 (DATE は 1970-01-01 からの日数、TIMESTAMP は UTC のマイクロ秒)
+_PROTO_TYPES = {
+    "STRING": "TYPE_STRING",
+    "INTEGER": "TYPE_INT64",
+    "INT64": "TYPE_INT64",
+    "FLOAT": "TYPE_DOUBLE",
+    "FLOAT64": "TYPE_DOUBLE",
+    "BOOLEAN": "TYPE_BOOL",
+    "BOOL": "TYPE_BOOL",
+    "DATE": "TYPE_INT32",
+    "TIMESTAMP": "TYPE_INT64",
+}
+
+
+def _descriptor_proto(name: str, schema):
+    from google.protobuf import descriptor_pb2
+
+    message = descriptor_pb2.DescriptorProto(name=name)
+    for number, field in enumerate(schema, start=1):
+        proto_field = message.field.add(name=field.name, number=number)
+        proto_field.label = (
+            descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED if field.mode == "REPEATED"
+            else descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+        )
+        if field.field_type in ("RECORD", "STRUCT"):
+            nested_name = f"{field.name}_t"
+            message.nested_type.append(_descriptor_proto(nested_name, field.fields))
+            proto_field.type = descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE
+            proto_field.type_name = nested_name
+        else:
+            proto_field.type = getattr(
+                descriptor_pb2.FieldDescriptorProto, _PROTO_TYPES.get(field.field_type, "TYPE_STRING")
+            )
+    return message
+
+
+def _proto_for_schema(schema):
+    """
+    テーブルのスキーマから (DescriptorProto, メッセージクラス) を作る
+    """
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+    descriptor = _descriptor_proto("StreamRow", schema)
+    file_proto = descriptor_pb2.FileDescriptorProto(name=f"stream_row_{uuid.uuid4().hex}.proto")
+    file_proto.message_type.append(descriptor)
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    message_class = message_factory.GetMessageClass(pool.FindMessageTypeByName("StreamRow"))
+    return descriptor, message_class
+
+
+def _proto_value(field_type: str, value):
+    if field_type == "STRING":
+        return value if isinstance(value, str) else str(value)
+    if field_type in ("INTEGER", "INT64"):
+        return int(value)
+    if field_type in ("FLOAT", "FLOAT64"):
+        return float(value)
+    if field_type in ("BOOLEAN", "BOOL"):
+        return bool(value)
+    if field_type == "DATE":
+        return (date.fromisoformat(value) - date(1970, 1, 1)).days
+    if field_type == "TIMESTAMP":
+        # タイムゾーンのない時刻はロードジョブと同じく UTC として扱う
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return int(parsed.timestamp() * 1_000_000)
+    return str(value)
+
+
+def _fill_message(message, schema, row: Dict[str, Any]):
+    """
+    1行の dict をメッセージに詰める (スキーマにない列と、変換できない値は捨てる)
+    """
+    for field in schema:
+        value = row.get(field.name)
+        if value is None or value == "":
+            continue
+        if field.field_type in ("RECORD", "STRUCT"):
+            if field.mode == "REPEATED":
+                target = getattr(message, field.name)
+                for item in value:
+                    _fill_message(target.add(), field.fields, item)
+            else:
+                _fill_message(getattr(message, field.name), field.fields, value)
+            continue
+        try:
+            if field.mode == "REPEATED":
+                getattr(message, field.name).extend(_proto_value(field.field_type, v) for v in value)
+            else:
+                setattr(message, field.name, _proto_value(field.field_type, value))
+        except (TypeError, ValueError):
+            continue
+
+
+class StreamingSink:
+    """
+    record_types のレコードを JV ファイル単位のオフセット付きでエンドポイントに追記する
+
+    バッチはレコード種別ごとに、batch_records 件に達するか、先頭のレコードから max_latency 秒
+    経過した時点、および JV ファイルの切り替わり・終了時に送る。経過時間はレコードを受け取るたびに
+    全種別のバッファについて確認し、レコードが届かない間 (ダウンロード待ちなど) はタイマースレッドが
+    flush_interval 秒ごと (省略時は max_latency / 2 秒、0 でタイマーなし) に確認する。
+    1つのバッチは1つの JV ファイルの連続した行だけを含む。
+    取り込みループ (submit)・パイプラインの書き込みスレッド (file_end)・タイマースレッドから
+    呼ばれるためロックで保護する。タイマースレッドでの送信の失敗は次の submit / file_end / close で送出する。
+    """
+    def __init__(self, endpoint, state_path: str, record_types: Iterable[str] = DEFAULT_STREAM_TYPES,
+                 typed: bool = False, batch_records: int = 500, max_latency: float = 1.0,
+                 max_retries: int = 5, flush_interval: Optional[float] = None):
+        self.endpoint = endpoint
+        self.state_path = state_path
+        self.record_types = frozenset(record_types)
+        self.parser = JvParser(typed=typed)
+        # 取得時刻はバッファの開始時に時計を1回だけ読み、レコードごとに読み込み順で増やす
+        self.clock = FetchClock()
+        self.batch_records = max(1, batch_records)
+        self.max_latency = max_latency
+        self.max_retries = max_retries
+        self.lock = threading.RLock()
+        # 追記の試行ごとの行数・所要時間・エラーを bq_metrics に記録する (configure されている場合)
+        self.bq_metrics = _load_bq_metrics()
+
+        # レコード種別ごとのバッファ: JV ファイル・先頭行の番号・行・先頭の受け取り時刻
+        self.buffers: Dict[str, Dict[str, Any]] = {}
+        # (JV ファイル, レコード種別) -> 今回の読み込みで受け取った行数
+        self.seen: Dict[tuple, int] = {}
+        self.stats = {"rows": 0, "batches": 0, "retries": 0, "already_committed": 0,
+                      "skipped_rows": 0, "max_latency": 0.0}
+
+        self.state = {"streams": {}, "files": {}, "pending": {}}
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        self._recover()
+
+        self.flush_interval = max_latency / 2 if flush_interval is None else flush_interval
+        self._timer_error: Optional[BaseException] = None
+        self._stop = threading.Event()
+        self._timer = None
+        if self.flush_interval > 0:
+            self._timer = threading.Thread(target=self._run_timer, name="stream-flush", daemon=True)
+            self._timer.start()
+
+    def _save_state(self):
+        # 一時ファイルに書いてから置き換える (checkpoint.py と同じ)
+        self.state["updated_at"] = datetime.now().isoformat()
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def _recover(self):
+        """
+        前回の実行のストリームを確定し、応答を確認できなかった追記 (pending) が反映されたかを判定する
+        """
+        if not self.state["streams"]:
+            return
+        for record_type, stream in self.state["streams"].items():
+            row_count = self.endpoint.finalize(stream["name"])
+            pending = self.state["pending"].pop(record_type, None)
+            if pending is None:
+                continue
+            if row_count >= pending["offset"] + pending["rows"]:
+                # 追記は反映済み: JV ファイルのコミット済み行数を進める
+                committed = self.state["files"].setdefault(pending["file"], {})
+                committed[record_type] = pending["start"] + pending["rows"]
+                logger.info("Recovered committed batch of %s rows (%s, %s)",
+                            pending["rows"], pending["file"], record_type)
+            else:
+                logger.info("Discarding uncommitted batch of %s rows (%s, %s)",
+                            pending["rows"], pending["file"], record_type)
+        # 以降の追記は新しいストリームに行う
+        self.state["streams"] = {}
+        self._save_state()
+
+    def accepts(self, raw_data) -> bool:
+        return record_type_of(raw_data) in self.record_types
+
+    def submit(self, jv_file: Optional[str], raw_data):
+        """
+        取り込みループから1レコードを受け取る (jv_file は JVLinkClient.current_file)
+        """
+        record_type = record_type_of(raw_data)
+        jv_file = jv_file or ""
+        with self.lock:
+            self._raise_timer_error()
+            index = self.seen.get((jv_file, record_type), 0)
+            self.seen[(jv_file, record_type)] = index + 1
+            if index < self.state["files"].get(jv_file, {}).get(record_type, 0):
+                # 以前の実行でコミット済みの行
+                self.stats["skipped_rows"] += 1
+                return
+
+            buffer = self.buffers.get(record_type)
+            if buffer is not None and buffer["file"] != jv_file:
+                self._send(record_type)
+                buffer = None
+            now = time.monotonic()
+            if buffer is None:
+                buffer = self.buffers[record_type] = {"file": jv_file, "start": index, "rows": [], "first": now}
+                self.clock.tick()
+            buffer["rows"].append(prepare_record(self.parser, raw_data, self.clock.next()))
+
+            if len(buffer["rows"]) >= self.batch_records:
+                self._send(record_type)
+            self.flush_due(now)
+
+    def flush_due(self, now: Optional[float] = None):
+        """
+        先頭のレコードから max_latency 秒経過したバッファを (レコード種別によらず) すべて送る
+        """
+        with self.lock:
+            now = time.monotonic() if now is None else now
+            for record_type, buffer in list(self.buffers.items()):
+                if now - buffer["first"] >= self.max_latency:
+                    self._send(record_type)
+
+    def _run_timer(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush_due()
+            except BaseException as e:
+                # 取り込みループ側で送出して中断させる (追記の結果は再起動時に pending から判定する)
+                logger.error("Timed flush failed: %s", e)
+                self._timer_error = e
+                return
+
+    def _raise_timer_error(self):
+        if self._timer_error is not None:
+            error, self._timer_error = self._timer_error, None
+            raise error
+
+    def _stream(self, record_type: str) -> Dict[str, Any]:
+        stream = self.state["streams"].get(record_type)
+        if stream is None:
+            name = self.endpoint.create_stream(self.endpoint.table_for(record_type))
+            stream = self.state["streams"][record_type] = {"name": name, "offset": 0}
+            self._save_state()
+        return stream
+
+    def _send(self, record_type: str):
+        buffer = self.buffers.pop(record_type, None)
+        if not buffer or not buffer["rows"]:
+            return
+        rows = buffer["rows"]
+        stream = self._stream(record_type)
+        offset = stream["offset"]
+        for row in rows:
+            row.setdefault("_batch_id", f"{record_type}_stream_{offset}")
+
+        # 追記の前に内容を記録しておく (応答前に中断した場合は再起動時に反映済みかを判定する)
+        self.state["pending"][record_type] = {
+            "file": buffer["file"], "start": buffer["start"], "rows": len(rows), "offset": offset,
+        }
+        self._save_state()
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                self.endpoint.append_rows(stream["name"], rows, offset)
+                self._record_append(record_type, stream, offset, len(rows), started)
+                break
+            except OffsetAlreadyExists as e:
+                # 前回の試行が反映されていた (応答だけが失われた)
+                self._record_append(record_type, stream, offset, 0, started, e)
+                self.stats["already_committed"] += 1
+                break
+            except OffsetOutOfRange as e:
+                self._record_append(record_type, stream, offset, 0, started, e)
+                raise
+            except Exception as e:
+                self._record_append(record_type, stream, offset, 0, started, e)
+                if attempt >= self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                logger.warning("Append of %s rows to %s failed (%s); retrying at offset %s",
+                               len(rows), record_type, e, offset)
+                time.sleep(min(0.1 * 2 ** attempt, 2.0))
+
+        stream["offset"] = offset + len(rows)
+        self.state["files"].setdefault(buffer["file"], {})[record_type] = buffer["start"] + len(rows)
+        del self.state["pending"][record_type]
+        self._save_state()
+        self.stats["rows"] += len(rows)
+        self.stats["batches"] += 1
+        self.stats["max_latency"] = max(self.stats["max_latency"], time.monotonic() - buffer["first"])
+
+    def _record_append(self, record_type: str, stream: Dict[str, Any], offset: int, rows: int,
+                       started: float, error: Optional[Exception] = None):
+        if self.bq_metrics is not None:
+            self.bq_metrics.record_append(
+                f"append {self.endpoint.table_for(record_type)}", stream["name"], offset, rows,
+                time.monotonic() - started, error,
+            )
+
+    def file_end(self, jv_file: str):
+        """
+        JV ファイルの終了時に、そのファイルのバッファを送る (取り込み完了の記録より前に呼ぶ)
+        """
+        with self.lock:
+            self._raise_timer_error()
+            for record_type, buffer in list(self.buffers.items()):
+                if buffer["file"] == jv_file:
+                    self._send(record_type)
+
+    def flush(self):
+        with self.lock:
+            for record_type in list(self.buffers):
+                self._send(record_type)
+
+    def close(self):
+        """
+        残りのバッファを送り、ストリームを確定する
+        """
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        with self.lock:
+            self._raise_timer_error()
+            self.flush()
+            for stream in self.state["streams"].values():
+                self.endpoint.finalize(stream["name"])
+            self.state["streams"] = {}
+            self._save_state()
+            self.endpoint.close()
@@ -0,0 +1,73 @@
+import argparse
+import json
+import sys
+from datetime import date
+from types import SimpleNamespace
+
+from jra_van_loader import backfill
+
+
+def test_range_is_split_at_month_starts():
+    assert backfill.split_range(date(2023, 11, 15), date(2024, 6, 10), 3) == [
+        (date(2023, 11, 15), date(2024, 1, 31)),
+        (date(2024, 2, 1), date(2024, 4, 30)),
+        (date(2024, 5, 1), date(2024, 6, 10)),
+    ]
+    chunks = backfill.build_chunks(["RACE", "BLOD"], date(2024, 1, 1), date(2024, 12, 31), 6)
+    assert [chunk["id"] for chunk in chunks] == [
+        "RACE_20240101_20240630", "RACE_20240701_20241231", "BLOD_20240101_20240630", "BLOD_20240701_20241231",
+    ]
+    assert chunks[0]["fromtime"] == "20240101000000-20240630235959"
+
+
+def chunk_id(command: list) -> str:
+    return command[command.index("--output") + 1].rsplit("/", 1)[-1]
+
+
+def fake_main(monkeypatch, returncodes: dict) -> list:
+    """Replace the main.py subprocess and return its commands; each chunk exits with its next return code (then 0)."""
+    commands = []
+
+    def run(command, stdout=None, stderr=None):
+        commands.append(command)
+        codes = returncodes.get(chunk_id(command), [])
+        return SimpleNamespace(returncode=codes.pop(0) if codes else 0)
+
+    monkeypatch.setattr(backfill.subprocess, "run", run)
+    monkeypatch.setattr(backfill.time, "sleep", lambda seconds: None)
+    return commands
+
+
+def test_failed_chunk_is_retried_until_it_succeeds(tmp_path, monkeypatch):
+    commands = fake_main(monkeypatch, {"RACE_20240101_20240131": [1, 1]})
+    manifest = backfill.BackfillManifest(str(tmp_path / backfill.MANIFEST_FILENAME))
+    chunk = backfill.build_chunks(["RACE"], date(2024, 1, 1), date(2024, 1, 31), 1)[0]
+    manifest.register(chunk)
+    args = argparse.Namespace(output=str(tmp_path), option=4, retries=2, retry_delay=0)
+
+    assert backfill.run_chunk(chunk, args, [], manifest)
+    assert [chunk_id(command) for command in commands] == ["RACE_20240101_20240131"] * 3
+    assert manifest.chunks[chunk["id"]] == {**manifest.chunks[chunk["id"]], "status": "done", "attempts": 3}
+
+
+def test_rerun_skips_done_chunks_and_retries_failed_ones(tmp_path, monkeypatch):
+    argv = ["backfill.py", "--specs", "RACE", "--start", "2024-01-01", "--end", "2024-03-31",
+            "--chunk-months", "1", "--retries", "0", "--output", str(tmp_path), "--typed"]
+    monkeypatch.setattr(sys, "argv", argv)
+    commands = fake_main(monkeypatch, {"RACE_20240201_20240229": [1]})
+    assert backfill.main() == 1
+    assert sorted(chunk_id(command) for command in commands) == [
+        "RACE_20240101_20240131", "RACE_20240201_20240229", "RACE_20240301_20240331",
+    ]
+    # Unrecognized arguments are passed on to main.py.
+    assert all(command[-1] == "--typed" for command in commands)
+
+    commands.clear()
+    assert backfill.main() == 0
+    # Only the failed chunk runs again; its attempts carry over.
+    assert [chunk_id(command) for command in commands] == ["RACE_20240201_20240229"]
+    with open(tmp_path / backfill.MANIFEST_FILENAME, encoding="utf-8") as f:
+        chunks = json.load(f)["chunks"]
+    assert {name: entry["attempts"] for name, entry in chunks.items()} == {
+        "RACE_20240101_20240131": 1, "RACE_20240201_20240229": 2, "RACE_20240301_20240331": 1,
+    }
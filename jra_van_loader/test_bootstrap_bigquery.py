@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from google.api_core.exceptions import BadRequest
+
+from jra_van_loader import bootstrap_bigquery, bq_metrics
+
+
+def write_sql(sql_dir, name, sql):
+    sql_dir.mkdir(exist_ok=True)
+    (sql_dir / name).write_text(sql, encoding="utf-8")
+
+
+def metrics_entries(path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(bq_metrics, "_metrics", None)
+    return bq_metrics.configure("bootstrap_bigquery", str(tmp_path / "bq_metrics.jsonl"))
+
+
+def test_run_sql_files_records_each_script_statement(fake_bq, tmp_path, metrics):
+    sql_dir = tmp_path / "sql"
+    write_sql(sql_dir, "01_one.sql", "SELECT 1")
+    write_sql(sql_dir, "02_script.sql", (
+        "-- Serving tables\n"
+        "CREATE OR REPLACE TABLE `${PROJECT_ID}.jra_serving.a` AS SELECT 1 AS x;\n"
+        "CREATE OR REPLACE TABLE `${PROJECT_ID}.jra_serving.b` AS SELECT 2 AS x;\n"
+    ))
+
+    bootstrap_bigquery.run_sql_files(fake_bq, sql_dir, "asia-northeast1", "test-project", None)
+
+    entries = metrics_entries(metrics.path)
+    assert [(e["label"], e["statement_type"]) for e in entries] == [
+        ("01_one.sql", "SELECT"),
+        ("02_script.sql", "SCRIPT"),
+        ("02_script.sql [1]", "CREATE"),
+        ("02_script.sql [2]", "CREATE"),
+    ]
+    script = entries[1]
+    assert [e["parent_job_id"] for e in entries] == [None, None, script["job_id"], script["job_id"]]
+    # The script's own job is not counted again next to its statements.
+    summary = metrics.summary()
+    assert summary["jobs"] == 4
+    assert script["job_id"] not in {e["job_id"] for e in summary["top"]}
+
+
+def test_failing_statement_is_recorded_and_stops_the_run(fake_bq, tmp_path, metrics):
+    sql_dir = tmp_path / "sql"
+    write_sql(sql_dir, "02_script.sql", "SELECT 1;\nMERGE `test-project.jra_core.RA_latest` T USING x;\nSELECT 3;\n")
+    write_sql(sql_dir, "03_checks.sql", "SELECT 4")
+    fake_bq.fail_next("query", "MERGE")
+
+    with pytest.raises(BadRequest):
+        bootstrap_bigquery.run_sql_files(fake_bq, sql_dir, "asia-northeast1", "test-project", None)
+
+    entries = metrics_entries(metrics.path)
+    assert [(e["label"], bool(e["error"])) for e in entries] == [
+        ("02_script.sql", True),
+        ("02_script.sql [1]", False),
+        ("02_script.sql [2]", True),
+    ]
+
+
+def test_audit_table_gains_new_columns(fake_bq, monkeypatch):
+    audit_table_id = "test-project.jra_ops.bq_jobs"
+    old_schema = [field for field in bq_metrics.AUDIT_TABLE_SCHEMA if field.name != "parent_job_id"]
+    fake_bq.create_table(bq_metrics.bigquery.Table(audit_table_id, schema=old_schema))
+    monkeypatch.setattr(bq_metrics, "_metrics", None)
+    metrics = bq_metrics.configure("bootstrap_bigquery", None, fake_bq, audit_table_id)
+    bq_metrics.track_job(fake_bq.query("SELECT 1"), "select")
+
+    metrics.close()
+
+    assert [field.name for field in fake_bq.get_table(audit_table_id).schema][-1] == "parent_job_id"
+    assert [row["label"] for row in fake_bq.inserted[audit_table_id]] == ["select"]
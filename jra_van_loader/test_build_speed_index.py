@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+
+from jra_van_loader import build_speed_index
+from jra_van_loader.parsing import JvParser
+from jra_van_loader.schema.definitions import RECORD_SPECS
+
+
+def fixed_width(record_type: str, length: int, **values) -> str:
+    """A raw record with values at their Field offsets (other bytes are spaces)."""
+    buf = bytearray(b" " * length)
+    buf[0:2] = record_type.encode("cp932")
+    header = {"Year": "2024", "MonthDay": "0106", "JyoCD": "06", "Kaiji": "01", "Nichiji": "01"}
+    fields = build_speed_index.SE_SOURCE_FIELDS if record_type == "SE" else RECORD_SPECS[record_type]
+    for field in fields:
+        value = {**header, **values}.get(field.name)
+        if value is not None:
+            encoded = value.encode("cp932")
+            buf[field.start:field.start + len(encoded)] = encoded
+    return buf.decode("cp932")
+
+
+def write_raw(path, raws):
+    with open(path, "w", encoding="utf-8") as f:
+        for raw in raws:
+            f.write(json.dumps({"raw_data": raw, "fetched_at": "2024-01-06T09:00:00"}, ensure_ascii=False) + "\n")
+
+
+def test_jsonl_source_frame_joins_runners_to_races(tmp_path, caplog):
+    write_raw(tmp_path / "RA_20240106.jsonl", [
+        fixed_width("RA", 1272, RaceNum="01", TrackCD="10", Kyori="1600"),
+        fixed_width("RA", 1272, RaceNum="02", TrackCD="24", Kyori="1800"),
+        fixed_width("RA", 1272, RaceNum="03", TrackCD="51", Kyori="3000"),
+    ])
+    write_raw(tmp_path / "SE_20240106.jsonl", [
+        fixed_width("SE", 555, RaceNum="01", Umaban="01", KettoNum="2020100001", Bamei="テストホース", Time="1345",
+                    SexCD="1", Barei="04", Futan="570"),
+        fixed_width("SE", 555, RaceNum="01", Umaban="02", KettoNum="2020100002", Bamei="サンプル", Time="1351",
+                    SexCD="2", Barei="05", Futan="555"),
+        fixed_width("SE", 555, RaceNum="02", Umaban="01", KettoNum="2020100001", Bamei="テストホース", Time="0000"),
+        fixed_width("SE", 555, RaceNum="03", Umaban="01", KettoNum="2020100003", Bamei="ジャンプ", Time="3210"),
+    ])
+
+    caplog.set_level("WARNING")
+    frame = build_speed_index.load_jsonl_source_frame(str(tmp_path))
+
+    assert list(frame.columns) == build_speed_index.SOURCE_COLUMNS
+    assert frame["horse_name"].tolist() == ["テストホース", "サンプル", "テストホース", "ジャンプ"]
+    assert frame["surface"].tolist() == ["芝", "芝", "ダ", ""]
+    assert np.allclose(frame["time_sec"], [94.5, 95.1, 0.0, 201.0])
+    assert frame["distance"].tolist() == [1600.0, 1600.0, 1800.0, 3000.0]
+    assert frame["num_horses"].tolist() == [2, 2, 1, 1]
+    assert frame["sex"].tolist()[:2] == ["牡", "牝"]
+    assert frame["age"].tolist()[:2] == [4.0, 5.0]
+    assert frame["weight"].tolist()[:2] == [57.0, 55.5]
+    # The covariates RA_SCHEMA cannot provide are left empty, with a warning.
+    assert frame["track_condition"].isna().all() and frame["class_name"].isna().all()
+    assert "without these covariates" in caplog.text
+
+    # Unfinished runs and jump races are dropped the same way as rows from the analysis view.
+    normalized = build_speed_index.normalize_source_frame(frame)
+    assert normalized["horse_key"].tolist() == ["2020100001", "2020100002"]
+
+
+def test_time_is_not_an_ingest_column():
+    # The speed-index fields do not change what main.py writes for SE: raw_body starts after Bamei.
+    raw = fixed_width("SE", 555, RaceNum="01", Umaban="01", Bamei="テストホース", Time="1345")
+    parsed = JvParser().parse(raw)
+    assert "Time" not in parsed
+    assert parsed["raw_body"] == raw.encode("cp932")[76:].decode("cp932").strip()
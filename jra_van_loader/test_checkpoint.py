@@ -0,0 +1,194 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+from glob import glob
+
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import pytest
+
+from jra_van_loader.checkpoint import CHECKPOINT_FILENAME, IngestCheckpoint
+from jra_van_loader.sinks import MANIFEST_FILENAME, PART_SUFFIX, JsonlSink, ParquetSink
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SINKS = {
+    "jsonl": lambda output_dir: JsonlSink(output_dir),
+    "gzip_rotation": lambda output_dir: JsonlSink(output_dir, compression="gzip", max_records=4),
+    "parquet": lambda output_dir: ParquetSink(output_dir, row_group_records=2),
+    "parquet_rotation": lambda output_dir: ParquetSink(output_dir, row_group_records=2, max_records=8),
+}
+# (JV file, records). The crash happens in the middle of the second file.
+JV_FILES = [("A.jvd", 6), ("B.jvd", 5)]
+CRASH_AT = 3
+
+
+def record(jv_file: str, i: int) -> dict:
+    return {"record_type": "SE", "_parsed": True, "Umaban": f"{i + 1:02d}", "raw_data": f"{jv_file}:{i}"}
+
+
+def open_files(sink) -> list:
+    if isinstance(sink, ParquetSink):
+        return [entry[1] for entry in sink.writers.values()]
+    return [chunk.file for chunk in sink.files.values() if chunk.is_open]
+
+
+def ingest(output_dir: str, kind: str, crash_in: str | None = None):
+    """Run a main.py-style ingest loop. With crash_in the process dies in that JV file after a torn write."""
+    checkpoint = IngestCheckpoint(os.path.join(output_dir, CHECKPOINT_FILENAME), output_dir, "RACE", "20240101", 1)
+    if checkpoint.resuming:
+        checkpoint.restore_outputs()
+    sink = SINKS[kind](output_dir)
+    sink.on_open = checkpoint.record_output
+    for jv_file, count in JV_FILES:
+        if jv_file in checkpoint.completed_files:
+            continue
+        for i in range(count):
+            if jv_file == crash_in and i == CRASH_AT:
+                for f in open_files(sink):
+                    f.write(b'{"torn')
+                    f.flush()
+                os._exit(3)
+            sink.write("SE", "20240106", [record(jv_file, i)])
+        sink.checkpoint()
+        checkpoint.mark_file_done(jv_file, sink.outputs())
+        sink.commit()
+    sink.close()
+    checkpoint.mark_completed()
+
+
+def crash_ingest(output_dir: str, kind: str):
+    code = (
+        f"import sys; sys.path[:0] = {[HERE, os.path.dirname(HERE)]!r}\n"
+        f"import test_checkpoint\n"
+        f"test_checkpoint.ingest({output_dir!r}, {kind!r}, crash_in='B.jvd')\n"
+    )
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 3
+
+
+def read_outputs(output_dir: str) -> list:
+    values = []
+    for path in sorted(glob(os.path.join(output_dir, "SE_*"))):
+        if path.endswith(".parquet"):
+            values.extend(pq.read_table(path).column("raw_data").to_pylist())
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            values.extend(json.loads(line)["raw_data"] for line in f)
+    return values
+
+
+def manifest_records(output_dir: str) -> dict:
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {entry["file"]: entry["records"] for entry in map(json.loads, f)}
+
+
+@pytest.mark.parametrize("kind", sorted(SINKS))
+def test_resume_after_crash_restores_checkpoint(tmp_path, kind):
+    output_dir = str(tmp_path)
+    crash_ingest(output_dir, kind)
+
+    checkpoint = IngestCheckpoint(os.path.join(output_dir, CHECKPOINT_FILENAME), output_dir, "RACE", "20240101", 1)
+    assert checkpoint.resuming and checkpoint.completed_files == {"A.jvd"}
+    checkpoint.restore_outputs()
+
+    # Back to exactly the records of the completed JV file, and no partial chunks.
+    assert read_outputs(output_dir) == [f"A.jvd:{i}" for i in range(6)]
+    assert glob(os.path.join(output_dir, "*" + PART_SUFFIX)) == []
+    if kind != "jsonl":
+        chunks = manifest_records(output_dir)
+        assert sorted(chunks) == sorted(os.path.basename(p) for p in glob(os.path.join(output_dir, "SE_*")))
+        assert sum(chunks.values()) == 6
+
+
+@pytest.mark.parametrize("kind", sorted(SINKS))
+def test_resumed_ingest_has_every_record_once(tmp_path, kind):
+    output_dir = str(tmp_path)
+    crash_ingest(output_dir, kind)
+    ingest(output_dir, kind)
+
+    expected = [f"{jv_file}:{i}" for jv_file, count in JV_FILES for i in range(count)]
+    assert read_outputs(output_dir) == expected
+    if kind != "jsonl":
+        assert sum(manifest_records(output_dir).values()) == len(expected)
+
+
+def test_parquet_checkpoint_keeps_chunk_open(tmp_path):
+    output_dir = str(tmp_path)
+    checkpoint = IngestCheckpoint(os.path.join(output_dir, CHECKPOINT_FILENAME), output_dir, "RACE", "20240101", 1)
+    sink = ParquetSink(output_dir, row_group_records=2)
+    sink.on_open = checkpoint.record_output
+    for jv_file, count in JV_FILES:
+        for i in range(count):
+            sink.write("SE", "20240106", [record(jv_file, i)])
+        sink.checkpoint()
+        checkpoint.mark_file_done(jv_file, sink.outputs())
+
+        # The JV file end neither finishes the chunk nor starts a new file.
+        [position] = checkpoint.state["outputs"].values()
+        assert position["path"].endswith("SE_20240106_0001.parquet")
+        assert os.path.getsize(position["part_path"]) == position["bytes"]
+        with open(position["part_path"], "rb") as f:
+            assert pyarrow.ipc.open_stream(f).read_all().num_rows == position["records"]
+    assert manifest_records(output_dir) == {}
+
+    sink.close()
+    assert manifest_records(output_dir) == {"SE_20240106_0001.parquet": 11}
+    assert pq.ParquetFile(os.path.join(output_dir, "SE_20240106_0001.parquet")).metadata.num_row_groups == 6
+
+
+def run_main(monkeypatch, output_dir: str, fail_after: int | None = None) -> int:
+    """Run main.py on 3 synthetic JV files (40 records each); with fail_after the read fails mid-file."""
+    monkeypatch.syspath_prepend(HERE)
+    import main
+    from jvlink.replay import ReplayJVLink
+
+    argv = [
+        "main.py", "--spec", "RACE", "--replay", "synthetic", "--synthetic-files", "3", "--synthetic-races", "2",
+        "--output", output_dir, "--buffer-records", "1", "--rotate-records", "5",
+    ]
+    with monkeypatch.context() as m:
+        if fail_after is not None:
+            synthetic = ReplayJVLink.synthetic.__func__
+            m.setattr(ReplayJVLink, "synthetic", classmethod(
+                lambda cls, **kwargs: synthetic(cls, fail_after=fail_after, **kwargs)
+            ))
+        m.setattr("sys.argv", argv)
+        return main.main()
+
+
+def finished_chunks(output_dir: str) -> dict:
+    contents = {}
+    for name in manifest_records(output_dir):
+        with open(os.path.join(output_dir, name), "rb") as f:
+            contents[name] = f.read()
+    return contents
+
+
+def test_main_failure_leaves_only_completed_jv_files_in_finished_chunks(tmp_path, monkeypatch):
+    output_dir = str(tmp_path)
+    # The read fails 20 records into the third JV file (races 5 and 6).
+    assert run_main(monkeypatch, output_dir, fail_after=100) == 1
+
+    loaded = finished_chunks(output_dir)
+    assert loaded, "chunks rotated in completed JV files are finished"
+    for content in loaded.values():
+        assert {json.loads(line)["RaceNum"] for line in content.splitlines()} <= {"01", "02", "03", "04"}
+    assert glob(os.path.join(output_dir, "*" + PART_SUFFIX)), "chunks of the failed JV file stay .part"
+
+    assert run_main(monkeypatch, output_dir) == 0
+
+    # Chunks that a loader may have picked up before the restart are untouched, and every
+    # record ends up in exactly one finished chunk.
+    final = finished_chunks(output_dir)
+    assert {name: final.get(name) for name in loaded} == loaded
+    assert glob(os.path.join(output_dir, "*" + PART_SUFFIX)) == []
+    assert sum(manifest_records(output_dir).values()) == 120
+    race_nums = [json.loads(line)["RaceNum"] for content in final.values() for line in content.splitlines()]
+    assert sorted(set(race_nums)) == ["01", "02", "03", "04", "05", "06"]
+    assert all(race_nums.count(num) == 20 for num in set(race_nums))
@@ -0,0 +1,36 @@
+from jra_van_loader.dedup import RecordDeduplicator
+from jra_van_loader.jvlink.replay import synthetic_record
+from jra_van_loader.parsing import JvParser
+
+
+def test_identical_records_are_skipped_per_type():
+    dedup = RecordDeduplicator(JvParser())
+    o1 = synthetic_record("O1", 0)
+    updated = o1[:2] + b"1" + o1[3:]
+
+    assert [dedup.is_duplicate(raw) for raw in (o1, o1.decode("cp932"), updated, memoryview(o1))] == [
+        False, True, False, True,
+    ]
+    # The same bytes under another race key are a different record.
+    assert not dedup.is_duplicate(synthetic_record("O1", 1))
+    assert dedup.stats == {"O1": 2}
+
+
+def test_only_listed_types_and_known_records_are_checked():
+    dedup = RecordDeduplicator(JvParser(), record_types=["O1"])
+    se = synthetic_record("SE", 0)
+    unknown = b"ZZ" + synthetic_record("SE", 0)[2:]
+
+    assert [dedup.is_duplicate(raw) for raw in (se, se, unknown, unknown, b"O")] == [False] * 5
+    assert dedup.stats == {}
+
+
+def test_least_recently_used_race_keys_are_forgotten():
+    dedup = RecordDeduplicator(JvParser(), max_keys=2)
+    race0, race1, race2 = (synthetic_record("O1", i) for i in range(3))
+
+    assert [dedup.is_duplicate(raw) for raw in (race0, race1, race0, race2)] == [False, False, True, False]
+    # race1 was used least recently, so adding race2 forgot it; race0 is still remembered.
+    assert len(dedup.seen) == 2 and dedup.evicted == 1
+    assert dedup.is_duplicate(race0)
+    assert not dedup.is_duplicate(race1)
@@ -0,0 +1,81 @@
+import glob
+import os
+
+import pytest
+
+from jra_van_loader.ingest_manifest import INGEST_MANIFEST_FILENAME, IngestManifest
+from jra_van_loader.jvlink.client import JVLinkClient
+from jra_van_loader.jvlink.replay import ReplayJVLink
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_with_manifest(manifest: IngestManifest, files: int = 3):
+    """Read synthetic JV files (40 records each), skipping the manifest's files."""
+    backend = ReplayJVLink.synthetic(files=files, races_per_file=2)
+    ended = []
+    with JVLinkClient(sid="test", backend=backend) as client:
+        client.open("RACE", "20240101000000", 1)
+        records = [line for line in client.read(on_file_end=ended.append, skip_files=manifest) if line]
+        return client, backend, records, ended
+
+
+def test_listed_files_are_skipped_with_jvskip(tmp_path):
+    manifest = IngestManifest(str(tmp_path / INGEST_MANIFEST_FILENAME))
+    manifest.add("SYNTH00001.jvd", 40, "RACE", "20240101000000")
+
+    client, backend, records, ended = read_with_manifest(manifest)
+
+    assert client.read_completed
+    assert client.skipped_files == ["SYNTH00001.jvd"]
+    assert ended == ["SYNTH00000.jvd", "SYNTH00002.jvd"]
+    assert len(records) == 80
+    # Only the first record of the skipped file was read; JVSkip dropped the other 39.
+    assert backend.records_skipped == 39
+    assert backend.records_returned == 81
+
+
+def test_manifest_survives_a_torn_last_line_and_keeps_the_latest_entry(tmp_path):
+    path = str(tmp_path / INGEST_MANIFEST_FILENAME)
+    manifest = IngestManifest(path)
+    manifest.add("SYNTH00000.jvd", 10, "RACE", "20240101000000")
+    manifest.add("SYNTH00000.jvd", 40, "RACE", "20240101000000")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"file": "SYNTH00001.jvd", "rec')
+
+    reloaded = IngestManifest(path)
+    assert len(reloaded) == 1
+    assert reloaded.records("SYNTH00000.jvd") == 40
+    assert "SYNTH00001.jvd" not in reloaded
+
+
+def run_main(monkeypatch, output_dir: str, *extra) -> int:
+    monkeypatch.syspath_prepend(HERE)
+    import main
+
+    argv = [
+        "main.py", "--spec", "RACE", "--replay", "synthetic", "--synthetic-files", "3", "--synthetic-races", "2",
+        "--output", output_dir, *extra,
+    ]
+    monkeypatch.setattr("sys.argv", argv)
+    return main.main()
+
+
+def written_records(output_dir: str) -> int:
+    count = 0
+    for path in glob.glob(os.path.join(output_dir, "[A-Z]*.jsonl")):
+        with open(path, "rb") as f:
+            count += sum(1 for _ in f)
+    return count
+
+
+@pytest.mark.parametrize("reingest", [False, True])
+def test_second_run_skips_files_ingested_by_the_first(tmp_path, monkeypatch, reingest):
+    output_dir = str(tmp_path / "out")
+    assert run_main(monkeypatch, output_dir) == 0
+    assert written_records(output_dir) == 120
+    assert len(IngestManifest(os.path.join(output_dir, INGEST_MANIFEST_FILENAME))) == 3
+
+    # The first run's checkpoint is completed, so only the ingest manifest skips the files.
+    assert run_main(monkeypatch, output_dir, *(["--reingest"] if reingest else [])) == 0
+    assert written_records(output_dir) == (240 if reingest else 120)
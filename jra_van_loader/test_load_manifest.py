@@ -0,0 +1,78 @@
+import json
+import os
+
+from jra_van_loader.load_manifest import PENDING, LoadManifest
+
+
+def write_lines(path, records, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def test_plan_loads_new_file_whole(tmp_path):
+    path = tmp_path / "RA_20240106.jsonl"
+    write_lines(path, [{"n": 1}, {"n": 2}])
+
+    piece = LoadManifest(str(tmp_path)).plan(str(path))
+
+    assert (piece.start, piece.end) == (0, os.path.getsize(path))
+
+
+def test_plan_skips_loaded_file_and_returns_appended_range(tmp_path):
+    path = tmp_path / "RA_20240106.jsonl"
+    write_lines(path, [{"n": 1}, {"n": 2}])
+    manifest = LoadManifest(str(tmp_path))
+    manifest.record([manifest.plan(str(path))], "RA_1")
+    loaded = os.path.getsize(path)
+
+    assert manifest.plan(str(path)) is None
+
+    write_lines(path, [{"n": 3}], mode="a")
+    piece = LoadManifest(str(tmp_path)).plan(str(path))
+
+    assert (piece.start, piece.end) == (loaded, os.path.getsize(path))
+
+
+def test_plan_leaves_out_partial_last_line(tmp_path):
+    path = tmp_path / "RA_20240106.jsonl"
+    write_lines(path, [{"n": 1}])
+    complete = os.path.getsize(path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"n": 2')
+
+    piece = LoadManifest(str(tmp_path)).plan(str(path))
+
+    assert piece.end == complete
+
+
+def test_plan_reloads_rewritten_file(tmp_path):
+    path = tmp_path / "RA_20240106.jsonl"
+    write_lines(path, [{"n": 1}, {"n": 2}])
+    manifest = LoadManifest(str(tmp_path))
+    manifest.record([manifest.plan(str(path))], "RA_1")
+
+    write_lines(path, [{"n": 9}, {"n": 2}, {"n": 3}])
+    piece = manifest.plan(str(path))
+
+    assert (piece.start, piece.end) == (0, os.path.getsize(path))
+
+
+def test_pending_batch_survives_restart_until_loaded(tmp_path):
+    path = tmp_path / "RA_20240106.jsonl"
+    write_lines(path, [{"n": 1}])
+    manifest = LoadManifest(str(tmp_path))
+    piece = manifest.plan(str(path))
+    manifest.begin([piece], "RA_1")
+
+    reopened = LoadManifest(str(tmp_path))
+    assert reopened.pending_batches([piece]) == {"RA_1"}
+    # A pending batch does not count as loaded.
+    assert reopened.plan(str(path)) == piece
+
+    reopened.record([piece], "RA_2")
+    assert reopened.pending_batches([piece]) == set()
+    assert LoadManifest(str(tmp_path)).pending_batches([piece]) == set()
+    with open(reopened.path, encoding="utf-8") as f:
+        states = [json.loads(line)["state"] for line in f]
+    assert states == [PENDING, "loaded"]
@@ -0,0 +1,215 @@
+import json
+
+import pytest
+from google.cloud import bigquery
+
+from jra_van_loader import loader_bq
+from jra_van_loader.jvlink.replay import synthetic_record
+from jra_van_loader.load_manifest import LoadManifest
+from jra_van_loader.schema.definitions import RECORD_SPECS
+from jra_van_loader.storage import DataSaver
+
+PROJECT = "test-project"
+RAW = f"{PROJECT}.{loader_bq.DEFAULT_RAW_DATASET}"
+CORE = f"{PROJECT}.{loader_bq.DEFAULT_CORE_DATASET}"
+
+
+def ra_record(race_num: int, name: str = "") -> dict:
+    return {
+        "record_type": "RA", "_parsed": True, "RecordSpec": "RA", "Year": "2024", "MonthDay": "0106",
+        "JyoCD": "06", "Kaiji": "01", "Nichiji": "01", "RaceNum": f"{race_num:02d}", "Hondai": name,
+        "fetched_at": "2024-01-06T09:00:00",
+    }
+
+
+def write_jsonl(path, records, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def load(client, input_dir, manifest=None, **kwargs):
+    return loader_bq.load_files(
+        client,
+        loader_bq.list_input_files(str(input_dir)),
+        raw_dataset_id=loader_bq.DEFAULT_RAW_DATASET,
+        core_dataset_id=loader_bq.DEFAULT_CORE_DATASET,
+        merge_types={"RA", "SE"},
+        manifest=manifest,
+        **kwargs,
+    )
+
+
+def test_failed_merge_then_rerun_loads_raw_once(fake_bq, tmp_path):
+    write_jsonl(tmp_path / "RA_20240106.jsonl", [ra_record(1), ra_record(2)])
+
+    fake_bq.fail_next("query", "MERGE")
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 1
+    # The batch reached raw before the MERGE failed, and is not recorded as loaded.
+    assert len(fake_bq.rows(f"{RAW}.RA")) == 2
+    assert fake_bq.rows(f"{CORE}.RA_latest") == []
+
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 0
+    raw_rows = fake_bq.rows(f"{RAW}.RA")
+    assert len(raw_rows) == 2
+    assert len({row["_batch_id"] for row in raw_rows}) == 1
+    assert len(fake_bq.rows(f"{CORE}.RA_latest")) == 2
+
+    # Nothing left to load.
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 0
+    assert len(fake_bq.rows(f"{RAW}.RA")) == 2
+
+
+def test_rerun_after_failed_merge_of_appended_range(fake_bq, tmp_path):
+    path = tmp_path / "RA_20240106.jsonl"
+    write_jsonl(path, [ra_record(1)])
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 0
+
+    write_jsonl(path, [ra_record(2)], mode="a")
+    fake_bq.fail_next("query", "MERGE")
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 1
+    # More data arrives before the rerun, so the retried batch covers a different range.
+    write_jsonl(path, [ra_record(3)], mode="a")
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 0
+
+    race_nums = sorted(row["RaceNum"] for row in fake_bq.rows(f"{RAW}.RA"))
+    assert race_nums == ["01", "02", "03"]
+    assert len(fake_bq.rows(f"{CORE}.RA_latest")) == 3
+
+
+def test_rerun_after_failed_append_without_merge(fake_bq, tmp_path):
+    write_jsonl(tmp_path / "O1_20240106.jsonl", [{"record_type": "O1", "RaceNum": "01"}])
+    manifest = LoadManifest(str(tmp_path))
+    # The load job succeeds but the manifest is never written (e.g. the process was killed).
+    original_record = manifest.record
+    manifest.record = lambda pieces, batch_id, state="loaded": (
+        original_record(pieces, batch_id, state) if state != "loaded" else None
+    )
+    assert load(fake_bq, tmp_path, manifest) == 0
+    assert len(fake_bq.rows(f"{RAW}.O1")) == 1
+
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 0
+    assert len(fake_bq.rows(f"{RAW}.O1")) == 1
+
+
+def test_main_loads_several_types_with_one_failing(fake_bq, tmp_path, monkeypatch, caplog):
+    write_jsonl(tmp_path / "RA_20240106.jsonl", [ra_record(1), ra_record(2)])
+    write_jsonl(tmp_path / "SE_20240106.jsonl", [
+        {"record_type": "SE", "Year": "2024", "MonthDay": "0106", "JyoCD": "06", "Kaiji": "01",
+         "Nichiji": "01", "RaceNum": "01", "Umaban": f"{n:02d}"}
+        for n in range(1, 4)
+    ])
+    write_jsonl(tmp_path / "O1_20240106.jsonl", [{"record_type": "O1", "RaceNum": "01"}])
+    write_jsonl(tmp_path / "O2_20240106.jsonl", [{"record_type": "O2", "RaceNum": "01"}])
+    metrics_file = tmp_path / "metrics" / "bq_metrics.jsonl"
+    metrics_file.parent.mkdir()
+    monkeypatch.setattr(loader_bq.bigquery, "Client", lambda project=None: fake_bq)
+    monkeypatch.setattr(loader_bq.bq_metrics, "_metrics", None)
+    argv = ["loader_bq.py", "--input", str(tmp_path), "--concurrency", "2", "--metrics-file", str(metrics_file)]
+
+    fake_bq.fail_next("load", ".O2")
+    caplog.set_level("INFO")
+    monkeypatch.setattr("sys.argv", argv + ["--table-stats"])
+    loader_bq.main()
+
+    assert len(fake_bq.rows(f"{RAW}.RA")) == 2
+    assert len(fake_bq.rows(f"{RAW}.SE")) == 3
+    assert len(fake_bq.rows(f"{RAW}.O1")) == 1
+    assert fake_bq.rows(f"{RAW}.O2") == []
+    assert len(fake_bq.rows(f"{CORE}.SE_latest")) == 3
+    assert "Failed processing 1 file(s) of O2" in caplog.text
+    # --table-stats logs the row count of every table a batch was loaded into.
+    assert f"Table {CORE}._stg_SE: rows=3" in caplog.text
+    assert f"Table {RAW}.O1: rows=1" in caplog.text
+    with open(metrics_file, encoding="utf-8") as f:
+        failed = [entry["label"] for entry in map(json.loads, f) if entry["error"]]
+    assert failed == [f"load {RAW}.O2"]
+
+    # Only the failed type is loaded again.
+    monkeypatch.setattr("sys.argv", argv)
+    loader_bq.main()
+    assert len(fake_bq.rows(f"{RAW}.O1")) == 1
+    assert len(fake_bq.rows(f"{RAW}.O2")) == 1
+
+
+def test_typed_merge_compares_keys_without_casts(fake_bq, tmp_path):
+    typed = {**ra_record(1), "Year": 2024, "fetched_at": "2024-01-06T09:00:00"}
+    write_jsonl(tmp_path / "RA_20240106.jsonl", [typed, {**typed, "RaceNum": "02"}])
+
+    assert load(fake_bq, tmp_path, schema_mode="explicit", typed=True) == 0
+
+    [merge] = [sql for sql in fake_bq.queries if sql.lstrip().startswith("MERGE")]
+    assert "LPAD" not in merge and "AS STRING" not in merge
+    assert "CONCAT(FORMAT('%04d', `Year`), `MonthDay`)" in merge
+    assert "REPLACE" not in merge
+    assert len(fake_bq.rows(f"{CORE}.RA_latest")) == 2
+
+
+@pytest.mark.parametrize("partitioned", [False, True], ids=["unpartitioned", "partitioned"])
+def test_merge_into_core_table_from_before_batch_ids(fake_bq, tmp_path, partitioned):
+    # RA_latest as created by a version that did not tag rows with _batch_id.
+    target_id = f"{CORE}.RA_latest"
+    columns = list(ra_record(1)) + (["race_date"] if partitioned else [])
+    table = fake_bq.create_table(
+        bigquery.Table(target_id, schema=[bigquery.SchemaField(name, "STRING") for name in columns])
+    )
+    if partitioned:
+        table.time_partitioning = bigquery.TimePartitioning(field="race_date")
+    table.rows.append({**ra_record(1, "old"), **({"race_date": "2024-01-06"} if partitioned else {})})
+    write_jsonl(tmp_path / "RA_20240106.jsonl", [ra_record(1, "new"), ra_record(2)])
+
+    assert load(fake_bq, tmp_path, LoadManifest(str(tmp_path))) == 0
+
+    assert loader_bq.BATCH_ID_COLUMN in {field.name for field in table.schema}
+    assert sorted((row["RaceNum"], row["Hondai"]) for row in table.rows) == [("01", "new"), ("02", "")]
+
+
+JSON_TYPES = {
+    "STRING": str, "INT64": int, "FLOAT64": (int, float), "DATE": str, "BOOL": bool, "TIMESTAMP": str,
+}
+
+
+@pytest.mark.parametrize("typed", [False, True])
+@pytest.mark.parametrize("record_type", sorted(RECORD_SPECS))
+def test_explicit_schema_matches_jsonl_keys(tmp_path, record_type, typed):
+    saver = DataSaver(str(tmp_path), typed=typed)
+    saver.save(synthetic_record(record_type, 0))
+    saver.close()
+    [path] = loader_bq.list_input_files(str(tmp_path))
+    with open(path, encoding="utf-8") as f:
+        [row] = map(json.loads, f)
+
+    schema = {field.name: field for field in loader_bq.schema_for_record_type(record_type, "explicit", typed)}
+    # Every written key has a column, and the only column the file lacks is the loader's batch id.
+    assert set(row) <= set(schema)
+    assert set(schema) - set(row) == {loader_bq.BATCH_ID_COLUMN}
+    for name, value in row.items():
+        if value is not None:
+            assert isinstance(value, JSON_TYPES[schema[name].field_type]), (name, value)
+
+
+def test_partitioned_merge_is_bounded_by_the_staged_race_dates(fake_bq, tmp_path, caplog):
+    week2 = {**ra_record(1, "week 2"), "MonthDay": "0113"}
+    no_date = {**ra_record(3, "no date"), "MonthDay": "0000"}
+    write_jsonl(tmp_path / "RA_20240113.jsonl", [ra_record(1), week2, no_date])
+
+    assert load(fake_bq, tmp_path) == 0
+
+    [merge] = [sql for sql in fake_bq.queries if sql.lstrip().startswith("MERGE")]
+    assert "T.`race_date` BETWEEN DATE '2024-01-06' AND DATE '2024-01-13'" in merge
+    assert "WHERE `race_date` IS NOT NULL" in merge
+    assert "Skip 1 staged rows without a valid race date" in caplog.text
+    # The row without a race date reaches raw but not the partitioned core table.
+    assert len(fake_bq.rows(f"{RAW}.RA")) == 3
+    core = sorted((row["race_date"], row["RaceNum"]) for row in fake_bq.rows(f"{CORE}.RA_latest"))
+    assert core == [("2024-01-06", "01"), ("2024-01-13", "01")]
+
+
+def test_staging_without_race_dates_skips_the_merge(fake_bq, tmp_path):
+    write_jsonl(tmp_path / "RA_20240106.jsonl", [{**ra_record(1), "MonthDay": "0000"}])
+
+    assert load(fake_bq, tmp_path) == 0
+
+    assert not [sql for sql in fake_bq.queries if sql.lstrip().startswith("MERGE")]
+    assert len(fake_bq.rows(f"{RAW}.RA")) == 1
+    assert fake_bq.rows(f"{CORE}.RA_latest") == []
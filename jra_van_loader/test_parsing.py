@@ -0,0 +1,25 @@
+import pytest
+
+from jra_van_loader.jvlink.replay import synthetic_record
+from jra_van_loader.parsing import JvParser
+
+
+def mixed_records() -> list:
+    se = synthetic_record("SE", 0)
+    records = [synthetic_record(spec, i) for i in range(3) for spec in ("RA", "SE", "O1")]
+    records += [
+        se[:100] + b"\x82" + se[101:],  # invalid CP932 (lone lead byte)
+        se[:100] + b"\x00" + se[101:],  # field containing the separator byte
+        b"ZZ" + se[2:],  # unknown record type
+        b"S",  # too short
+        se.decode("cp932"),  # str input
+    ]
+    return records
+
+
+@pytest.mark.parametrize("typed", [False, True])
+@pytest.mark.parametrize("expand_groups", [False, True])
+def test_parse_many_matches_parse(typed, expand_groups):
+    parser = JvParser(typed=typed, expand_groups=expand_groups)
+    records = mixed_records()
+    assert parser.parse_many(records) == [parser.parse(raw) for raw in records]
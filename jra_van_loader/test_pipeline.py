@@ -0,0 +1,71 @@
+import pytest
+
+from jra_van_loader.jvlink.client import JVLinkClient
+from jra_van_loader.jvlink.replay import ReplayJVLink
+from jra_van_loader.pipeline import IngestPipeline
+from jra_van_loader.storage import DataSaver
+
+
+class ListSink:
+    """Collects the written raw records in order; fail_after makes the next write raise."""
+
+    def __init__(self, fail_after=None):
+        self.raw = []
+        self.fail_after = fail_after
+
+    def write(self, record_type, date_str, records):
+        if self.fail_after is not None and len(self.raw) >= self.fail_after:
+            raise OSError("disk full")
+        self.raw.extend(record["raw_data"] for record in records)
+
+    def rollover(self, date_str):
+        pass
+
+    def checkpoint(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def ingest(tmp_path, sink, read, ends, files=4, workers=2):
+    """Read a synthetic replay through the pipeline, collecting the read records and the file_end calls."""
+    saver = DataSaver(str(tmp_path), sink=sink)
+    with JVLinkClient(sid="test", backend=ReplayJVLink.synthetic(files=files, races_per_file=2)) as client:
+        client.open("RACE", "20240101000000", 1)
+
+        def on_file_end(filename):
+            # Written records at this point, with the file's own count from the client.
+            ends.append((filename, len(sink.raw), client.file_records[filename]))
+
+        with IngestPipeline(saver, workers=workers, batch_records=7, flush_interval=None,
+                            on_file_end=on_file_end) as pipeline:
+            for line in client.read(on_file_end=pipeline.file_end):
+                if line:
+                    read.append(line)
+                    pipeline.submit(line)
+
+
+def test_batches_are_written_in_read_order_before_their_file_end(tmp_path):
+    sink, read, ends = ListSink(), [], []
+    ingest(tmp_path, sink, read, ends)
+
+    assert sink.raw == read
+    # Each file_end runs after every record of that file (and none of the next) is written.
+    assert [name for name, _, _ in ends] == [f"SYNTH{n:05d}.jvd" for n in range(4)]
+    written = 0
+    for _, written_at_end, file_records in ends:
+        written += file_records
+        assert written_at_end == written
+
+
+def test_writer_failure_stops_later_batches_and_file_ends(tmp_path):
+    sink, read, ends = ListSink(fail_after=50), [], []
+    with pytest.raises(RuntimeError, match="disk full"):
+        ingest(tmp_path, sink, read, ends)
+
+    # Each file holds 40 records. The first file is written and reported done; a batch of the
+    # second fails, and nothing after it is written or reported.
+    assert ends == [("SYNTH00000.jvd", 40, 40)]
+    assert sink.raw == read[:len(sink.raw)]
+    assert 50 <= len(sink.raw) < 80
@@ -0,0 +1,88 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from jra_van_loader import reparse
+from jra_van_loader.jvlink.replay import synthetic_record
+from jra_van_loader.parsing import JvParser
+
+
+def se_raw(i: int, name: str = "テストホース", time: str = "1345") -> str:
+    raw = bytearray(synthetic_record("SE", i).rstrip(b"\r\n"))
+    raw[28:30] = b"%02d" % (i % 18 + 1)
+    raw[40:76] = name.encode("cp932").ljust(36, b" ")
+    raw[338:342] = time.encode("ascii")
+    return raw.decode("cp932")
+
+
+def write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+
+
+def record_line(raw: str, i: int) -> str:
+    return json.dumps({"raw_data": raw, "fetched_at": f"2024-01-06T09:00:{i:02d}"}, ensure_ascii=False) + "\n"
+
+
+@pytest.mark.parametrize("typed", [False, True], ids=["untyped", "typed"])
+def test_reparse_file_matches_record_by_record_parse(tmp_path, monkeypatch, typed):
+    monkeypatch.setattr(reparse, "BATCH_LINES", 4)
+    lines = [record_line(se_raw(i, time="    " if i == 3 else "1345"), i) for i in range(9)]
+    # Lines the columnar batch leaves to JvParser.parse or copies unchanged.
+    lines.insert(2, record_line(synthetic_record("RA", 0).decode("cp932"), 2))
+    lines.insert(5, json.dumps({"raw_data": "", "fetched_at": ""}) + "\n")
+    lines.insert(7, "{not json\n")
+    source = tmp_path / "SE_20240106.jsonl"
+    write_lines(source, lines)
+    output = tmp_path / "out.jsonl"
+
+    count, errors = reparse.reparse_file(str(source), str(output), typed)
+
+    parser = JvParser(typed=typed)
+    expected = []
+    for line in lines:
+        try:
+            old = json.loads(line)
+        except ValueError:
+            expected.append(line)
+            continue
+        if not old["raw_data"]:
+            expected.append(line)
+            continue
+        new = parser.parse(old["raw_data"])
+        new["fetched_at"] = old["fetched_at"]
+        new["raw_data"] = old["raw_data"]
+        expected.append(json.dumps(new, ensure_ascii=False) + "\n")
+    with open(output, encoding="utf-8") as f:
+        assert f.readlines() == expected
+    assert (count, errors) == (10, 1)
+
+
+def test_reparse_jsonl_handles_gzip_chunks_and_skips_unchanged_files(tmp_path):
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    input_dir.mkdir()
+    plain = [record_line(se_raw(i), i) for i in range(3)]
+    compressed = [record_line(se_raw(i, name="ジーズィップ"), i) for i in range(3, 6)]
+    write_lines(input_dir / "SE_20240106.jsonl", plain)
+    with gzip.open(input_dir / "SE_20240107_0001.jsonl.gz", "wt", encoding="utf-8") as f:
+        f.writelines(compressed)
+
+    reparse.reparse_jsonl(str(input_dir), str(output_dir), workers=1)
+
+    with gzip.open(output_dir / "SE_20240107_0001.jsonl.gz", "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [r["Bamei"] for r in records] == ["ジーズィップ"] * 3
+    assert [r["raw_data"] for r in records] == [json.loads(line)["raw_data"] for line in compressed]
+    state = reparse.load_state(str(output_dir))
+    assert {name: entry["records"] for name, entry in state["files"].items()} == {
+        "SE_20240106.jsonl": 3,
+        "SE_20240107_0001.jsonl.gz": 3,
+    }
+    # No temporary files are left behind.
+    assert sorted(os.listdir(output_dir)) == sorted(
+        [reparse.STATE_FILENAME, "SE_20240106.jsonl", "SE_20240107_0001.jsonl.gz"]
+    )
+
+    assert reparse.plan_reparse(str(input_dir), str(output_dir), state) == []
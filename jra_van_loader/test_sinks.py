@@ -0,0 +1,64 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from jra_van_loader.sinks import MANIFEST_FILENAME, JsonlSink
+
+
+def record(race_num: str) -> dict:
+    return {"record_type": "RA", "RaceNum": race_num}
+
+
+def read_lines(path: str) -> list:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line)["RaceNum"] for line in f]
+
+
+def test_least_recently_used_handle_is_closed_and_reopened_for_append(tmp_path):
+    sink = JsonlSink(str(tmp_path), max_open_files=2)
+    sink.write("RA", "20240106", [record("01")])
+    sink.write("SE", "20240106", [record("01")])
+    sink.write("RA", "20240106", [record("02")])
+    # HR evicts SE, the least recently used; RA stays open.
+    sink.write("HR", "20240106", [record("01")])
+    assert list(sink.open_keys) == [("RA", "20240106"), ("HR", "20240106")]
+    assert not sink.files[("SE", "20240106")].is_open
+    sink.write("SE", "20240106", [record("02")])
+    sink.close()
+
+    assert sink.stats == {"opened": 4, "reopened": 1, "evicted": 2, "finished": 3, "rollovers": 0}
+    assert read_lines(str(tmp_path / "SE_20240106.jsonl")) == ["01", "02"]
+    assert read_lines(str(tmp_path / "RA_20240106.jsonl")) == ["01", "02"]
+
+
+def test_reopened_gzip_chunk_appends_a_member(tmp_path):
+    sink = JsonlSink(str(tmp_path), compression="gzip", max_open_files=1)
+    sink.write("RA", "20240106", [record("01")])
+    sink.write("SE", "20240106", [record("01")])
+    sink.write("RA", "20240106", [record("02"), record("03")])
+    sink.close()
+
+    assert read_lines(str(tmp_path / "RA_20240106_0001.jsonl.gz")) == ["01", "02", "03"]
+    with open(tmp_path / MANIFEST_FILENAME, encoding="utf-8") as f:
+        entries = {entry["file"]: entry["records"] for entry in map(json.loads, f)}
+    assert entries == {"RA_20240106_0001.jsonl.gz": 3, "SE_20240106_0001.jsonl.gz": 1}
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_rollover_closes_only_the_files_of_that_day(tmp_path, chunked):
+    sink = JsonlSink(str(tmp_path), max_records=100 if chunked else None)
+    sink.write("RA", "20240106", [record("01")])
+    sink.write("RA", "20240107", [record("01")])
+    sink.rollover("20240106")
+
+    assert list(sink.files) == [("RA", "20240107")]
+    assert sink.stats["rollovers"] == 1
+    if chunked:
+        # The chunk stays .part until commit().
+        assert os.path.exists(tmp_path / "RA_20240106_0001.jsonl.part")
+        sink.commit()
+        assert read_lines(str(tmp_path / "RA_20240106_0001.jsonl")) == ["01"]
+    sink.close()
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from jra_van_loader import pipeline
+from jra_van_loader.jvlink.replay import synthetic_record
+from jra_van_loader.storage import DataSaver, FetchClock
+
+
+class ListSink:
+    """Collects the written records in order."""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record_type, date_str, records):
+        self.records.extend(records)
+
+    def rollover(self, date_str):
+        pass
+
+    def checkpoint(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_records_of_one_buffer_get_increasing_fetched_at(tmp_path):
+    sink = ListSink()
+    saver = DataSaver(str(tmp_path), buffer_records=3, flush_interval=None, sink=sink)
+    # A preliminary and then a final version of the same race read into one buffer.
+    preliminary = synthetic_record("RA", 0)
+    final = b"RA2" + preliminary[3:]
+    for raw in [preliminary, final, synthetic_record("SE", 0), synthetic_record("SE", 1), final]:
+        saver.save(raw)
+    saver.close()
+
+    stamps = [record["fetched_at"] for record in sink.records]
+    assert len(stamps) == 5
+    assert stamps == sorted(stamps) and len(set(stamps)) == len(stamps)
+    ra = [record for record in sink.records if record["record_type"] == "RA"]
+    assert max(ra[:2], key=lambda r: r["fetched_at"])["DataKubun"] == "2"
+
+
+def test_clock_never_goes_back_and_carries_seconds(monkeypatch):
+    clock = FetchClock(datetime(2024, 1, 6, 9, 0, 0, 999_999))
+    assert [clock.next(), clock.next()] == ["2024-01-06T09:00:00.999999", "2024-01-06T09:00:01.000000"]
+
+    # A clock read that is not later than the last stamp continues after it.
+    monkeypatch.setattr("jra_van_loader.storage.datetime", type("Frozen", (datetime,), {
+        "now": classmethod(lambda cls: datetime(2024, 1, 6, 9, 0, 0)),
+    }))
+    assert clock.tick() == datetime(2024, 1, 6, 9, 0, 1, 1)
+    start = clock.reserve(3)
+    assert clock.next() == "2024-01-06T09:00:01.000004"
+
+    # Pipeline workers issue the reserved stamps from the batch start.
+    pipeline._init_worker(False)
+    [(_, records, _)] = pipeline.parse_batch([synthetic_record("SE", i) for i in range(3)], start, encode=False)
+    assert [r["fetched_at"] for r in records] == [f"2024-01-06T09:00:01.00000{i}" for i in (1, 2, 3)]
+
+
+def test_date_change_rolls_over_the_previous_day(tmp_path, monkeypatch):
+    now = [datetime(2024, 1, 6, 23, 59, 59)]
+    monkeypatch.setattr("jra_van_loader.storage.datetime", type("Clock", (datetime,), {
+        "now": classmethod(lambda cls: now[0]),
+    }))
+    saver = DataSaver(str(tmp_path), buffer_records=1, flush_interval=None)
+    saver.save(synthetic_record("RA", 0))
+    saver.save(synthetic_record("RA", 1))
+    now[0] = datetime(2024, 1, 7, 0, 0, 1)
+    saver.save(synthetic_record("RA", 2))
+
+    # The first write of the new day closed the previous day's file.
+    assert saver.stats["rollovers"] == 1
+    assert list(saver.sink.files) == [("RA", "20240107")]
+    saver.close()
+    with open(tmp_path / "RA_20240106.jsonl", encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+    with open(tmp_path / "RA_20240107.jsonl", encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
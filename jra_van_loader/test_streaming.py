@@ -0,0 +1,145 @@
+import json
+import os
+import time
+
+import pytest
+
+from jra_van_loader import bq_metrics
+from jra_van_loader.jvlink.replay import synthetic_record
+from jra_van_loader.streaming import STREAM_STATE_FILENAME, FakeWriteEndpoint, StreamingSink
+
+JV_FILE = "0B31.jvd"
+RECORDS = [synthetic_record("O1", i) for i in range(23)]
+
+
+class Crash(BaseException):
+    """Stands in for the process being killed (not caught by the sink's retry loop)."""
+
+
+class CrashingEndpoint(FakeWriteEndpoint):
+    """Dies on the crash_on-th append, before or after the rows reach the stream."""
+
+    def __init__(self, directory: str, crash_on: int, after_write: bool):
+        super().__init__(directory)
+        self.crash_on = crash_on
+        self.after_write = after_write
+
+    def append_rows(self, stream, rows, offset):
+        if self.appends + 1 == self.crash_on:
+            if self.after_write:
+                super().append_rows(stream, rows, offset)
+            raise Crash()
+        super().append_rows(stream, rows, offset)
+
+
+def make_sink(tmp_path, endpoint) -> StreamingSink:
+    return StreamingSink(
+        endpoint, os.path.join(tmp_path, STREAM_STATE_FILENAME), batch_records=5, max_latency=60,
+    )
+
+
+def read_all(sink, records=RECORDS):
+    for raw in records:
+        sink.submit(JV_FILE, raw)
+    sink.file_end(JV_FILE)
+
+
+def streamed_rows(endpoint_dir) -> list:
+    with open(os.path.join(endpoint_dir, "O1.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line)["raw_data"] for line in f]
+
+
+def expected_rows() -> list:
+    return [raw.decode("cp932") for raw in RECORDS]
+
+
+def test_lost_acks_do_not_duplicate_rows(tmp_path, monkeypatch):
+    metrics_path = tmp_path / "bq_metrics.jsonl"
+    monkeypatch.setattr(bq_metrics, "_metrics", None)
+    bq_metrics.configure("test", str(metrics_path))
+    monkeypatch.setattr("jra_van_loader.streaming.time.sleep", lambda seconds: None)
+    endpoint_dir = tmp_path / "endpoint"
+    sink = make_sink(tmp_path, FakeWriteEndpoint(str(endpoint_dir), lose_ack_every=2))
+
+    read_all(sink)
+    sink.close()
+
+    assert streamed_rows(endpoint_dir) == expected_rows()
+    assert sink.stats["already_committed"] == 2
+    # Rows of one batch are stamped in read order.
+    with open(os.path.join(endpoint_dir, "O1.jsonl"), encoding="utf-8") as f:
+        stamps = [json.loads(line)["fetched_at"] for line in f]
+    assert stamps == sorted(stamps) and len(set(stamps)) == len(stamps)
+    assert sink.stats["rows"] == len(RECORDS)
+
+    # Every append attempt is recorded, including the ones whose response was lost.
+    with open(metrics_path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert {entry["job_type"] for entry in entries} == {"append"}
+    assert sum(entry["rows"] for entry in entries if not entry["error"]) == len(RECORDS) - 10
+    assert sum(1 for entry in entries if entry["error"]) == 4
+
+
+@pytest.mark.parametrize("after_write", [False, True], ids=["before_write", "after_write"])
+def test_crash_mid_file_then_resume_streams_every_row_once(tmp_path, after_write):
+    endpoint_dir = str(tmp_path / "endpoint")
+    sink = make_sink(tmp_path, CrashingEndpoint(endpoint_dir, crash_on=3, after_write=after_write))
+    with pytest.raises(Crash):
+        read_all(sink)
+    # Two batches were acknowledged; the third is pending in the state file.
+    with open(tmp_path / STREAM_STATE_FILENAME, encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["files"][JV_FILE]["O1"] == 10
+    assert state["pending"]["O1"]["offset"] == 10
+
+    # The restarted ingest reads the same JV file again from the beginning.
+    sink = make_sink(tmp_path, FakeWriteEndpoint(endpoint_dir))
+    assert sink.state["files"][JV_FILE]["O1"] == (15 if after_write else 10)
+    read_all(sink)
+    sink.close()
+
+    assert streamed_rows(endpoint_dir) == expected_rows()
+    assert sink.stats["skipped_rows"] == (15 if after_write else 10)
+
+
+def test_each_submit_flushes_every_buffer_past_max_latency(tmp_path):
+    endpoint_dir = str(tmp_path / "endpoint")
+    sink = StreamingSink(
+        FakeWriteEndpoint(endpoint_dir), os.path.join(tmp_path, STREAM_STATE_FILENAME),
+        batch_records=5, max_latency=60, flush_interval=0,
+    )
+    sink.submit(JV_FILE, RECORDS[0])
+    sink.buffers["O1"]["first"] -= 61
+    # An O2 record arrives; the waiting O1 batch is sent although no O1 record followed.
+    sink.submit(JV_FILE, synthetic_record("O2", 0))
+
+    assert streamed_rows(endpoint_dir) == expected_rows()[:1]
+    assert list(sink.buffers) == ["O2"]
+    sink.close()
+
+
+def test_timer_flushes_when_no_record_arrives(tmp_path):
+    endpoint_dir = str(tmp_path / "endpoint")
+    sink = StreamingSink(
+        FakeWriteEndpoint(endpoint_dir), os.path.join(tmp_path, STREAM_STATE_FILENAME),
+        batch_records=5, max_latency=0.05,
+    )
+    sink.submit(JV_FILE, RECORDS[0])
+    deadline = time.monotonic() + 5
+    while sink.stats["batches"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert sink.stats["batches"] == 1
+    assert streamed_rows(endpoint_dir) == expected_rows()[:1]
+    sink.close()
+
+
+def test_timed_flush_failure_is_raised_by_the_next_submit(tmp_path):
+    endpoint = CrashingEndpoint(str(tmp_path / "endpoint"), crash_on=1, after_write=False)
+    sink = StreamingSink(endpoint, os.path.join(tmp_path, STREAM_STATE_FILENAME), max_latency=0.05)
+    sink.submit(JV_FILE, RECORDS[0])
+    # The timer thread stops after the failed flush.
+    sink._timer.join(timeout=5)
+
+    with pytest.raises(Crash):
+        sink.submit(JV_FILE, RECORDS[1])
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import time
+
+from jra_van_loader import loader_bq, watch
+
+RAW = "test-project.jra_raw"
+CORE = "test-project.jra_core"
+
+
+def make_batch(tmp_path, seq: int, race_nums) -> watch.MicroBatch:
+    batch = watch.MicroBatch(seq, str(tmp_path / f"batch_{seq:06d}"))
+    os.makedirs(batch.path)
+    with open(os.path.join(batch.path, "RA_20240106.jsonl"), "w", encoding="utf-8") as f:
+        for race_num in race_nums:
+            f.write(json.dumps({
+                "record_type": "RA", "Year": "2024", "MonthDay": "0106", "JyoCD": "06", "Kaiji": "01",
+                "Nichiji": "01", "RaceNum": race_num, "fetched_at": f"2024-01-06T09:00:{seq:02d}",
+            }) + "\n")
+    batch.records = len(race_nums)
+    return batch
+
+
+def load_args(tmp_path) -> argparse.Namespace:
+    return argparse.Namespace(
+        key=None, project=None, output=str(tmp_path), dataset="jra_raw", core_dataset="jra_core",
+        location="asia-northeast1", merge_types="RA", staging_prefix="_stg_", core_table_suffix="_latest",
+        skip_core_merge=False, schema_mode="autodetect", typed=False, manifest_table=None,
+        metrics_file=str(tmp_path / "bq_metrics.jsonl"), audit_table=None,
+    )
+
+
+def wait_until_idle(loader: watch.BatchLoader, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while loader.busy and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_failed_batch_is_retried_before_later_batches(tmp_path):
+    calls = []
+
+    def load(batch_dir):
+        calls.append(os.path.basename(batch_dir))
+        return 1 if calls.count("batch_000001") < 3 else 0
+
+    loader = watch.BatchLoader(load, target_latency=30, retry_interval=0.01)
+    loader.submit(make_batch(tmp_path, 1, ["01"]))
+    loader.submit(make_batch(tmp_path, 2, ["02"]))
+    wait_until_idle(loader)
+    loader.close()
+
+    assert calls == ["batch_000001"] * 3 + ["batch_000002"]
+    assert loader.stats["retries"] == 2 and loader.stats["failed_batches"] == 0
+    with open(tmp_path / "batch_000001" / watch.LOADED_MARKER, encoding="utf-8") as f:
+        assert json.load(f)["attempts"] == 3
+
+
+def test_batches_left_failing_at_close_are_not_marked_loaded(tmp_path):
+    loader = watch.BatchLoader(lambda batch_dir: 1, target_latency=30, retry_interval=60)
+    loader.submit(make_batch(tmp_path, 1, ["01"]))
+    loader.submit(make_batch(tmp_path, 2, ["02"]))
+    loader.close()
+
+    assert loader.stats["failed_batches"] == 2
+    assert not os.path.exists(tmp_path / "batch_000001" / watch.LOADED_MARKER)
+    assert not os.path.exists(tmp_path / "batch_000002" / watch.LOADED_MARKER)
+
+
+def test_retry_after_failed_merge_loads_raw_once(fake_bq, tmp_path, monkeypatch):
+    monkeypatch.setattr(loader_bq.bigquery, "Client", lambda project=None: fake_bq)
+    monkeypatch.setattr(watch.bq_metrics, "_metrics", None)
+    load, metrics = watch.make_bigquery_load(load_args(tmp_path))
+    fake_bq.fail_next("query", "MERGE")
+
+    loader = watch.BatchLoader(load, target_latency=30, retry_interval=0.01)
+    loader.submit(make_batch(tmp_path, 1, ["01", "02"]))
+    loader.submit(make_batch(tmp_path, 2, ["02", "03"]))
+    wait_until_idle(loader)
+    loader.close()
+    metrics.close()
+
+    assert loader.stats == {**loader.stats, "batches": 2, "retries": 1, "failed_batches": 0}
+    assert sorted(row["RaceNum"] for row in fake_bq.rows(f"{RAW}.RA")) == ["01", "02", "02", "03"]
+    core = {row["RaceNum"]: row["fetched_at"] for row in fake_bq.rows(f"{CORE}.RA_latest")}
+    # Batch 2 was merged after batch 1, so its newer row for race 02 wins.
+    assert core == {"01": "2024-01-06T09:00:01", "02": "2024-01-06T09:00:02", "03": "2024-01-06T09:00:02"}
+    with open(tmp_path / "bq_metrics.jsonl", encoding="utf-8") as f:
+        assert any(json.loads(line)["error"] for line in f)
+
+
+def run_watch(tmp_path, backend, **kwargs) -> list:
+    """Run one poll of a WatchSession and return the submitted batches in order."""
+    batches = []
+
+    class RecordingLoader:
+        # Never idle, so only batch_records and the age limit cut while reading.
+        idle = False
+        stats = {}
+
+        def submit(self, batch):
+            batches.append(batch)
+
+        def close(self):
+            pass
+
+    with watch.JVLinkClient(sid="test", backend=backend) as client:
+        session = watch.WatchSession(client, "RACE", str(tmp_path / "out"), RecordingLoader(), **kwargs)
+        session.run(max_polls=1)
+    return batches
+
+
+def test_batch_records_cuts_inside_a_jv_file(tmp_path):
+    backend = watch.ReplayJVLink.synthetic(files=1, races_per_file=3)
+    batches = run_watch(tmp_path, backend, batch_records=25)
+
+    assert [batch.records for batch in batches] == [25, 25, 10]
+    assert [watch.WatchSession._count_records(batch.path) for batch in batches] == [25, 25, 10]
+
+
+def test_age_limit_cuts_inside_a_jv_file(tmp_path):
+    # 60 records at 100 records/s take 0.6s; target_latency / 2 = 0.1s cuts a batch every ~10 records.
+    backend = watch.ReplayJVLink.synthetic(files=1, races_per_file=3, rate=100)
+    batches = run_watch(tmp_path, backend, target_latency=0.2)
+
+    assert len(batches) >= 3
+    assert sum(batch.records for batch in batches) == 60
+    assert max(batch.records for batch in batches) < 60
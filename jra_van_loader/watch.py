@@ -0,0 +1,472 @@
+"""
+レース当日のオッズ・結果などの更新を、JV-Link のセッションを維持したまま取り込み続けるウォッチモード。
+
+main.py を繰り返し実行する場合と異なり、JVInit は最初の1回だけ行い、
+前回の JVOpen が返した lastTimestamp を次の fromtime にして差分をポーリングする。
+読み込んだレコードはマイクロバッチ (出力ディレクトリの batch_XXXXXX/) にパースして書き出し、
+BigQuery への読み込み (loader_bq.load_files: raw への追加と core への MERGE) を別スレッドで行う。
+
+マイクロバッチは次のいずれかで区切る (target_latency は読み込みから BigQuery 反映までの目標秒数)
+- 読み込みスレッドが空いている (直前のバッチの読み込みが終わっている)
+- 最初のレコードを読んでから target_latency / 2 秒経過した
+- batch_records 件に達した
+件数と経過時間は JVRead の途中でもレコードごとに確認し、大きな JV ファイルの途中でも区切る。
+読み込みスレッドが空いたことでは JV ファイルの切れ目でだけ区切る。
+新しいデータがない間は、ポーリング間隔を target_latency / 4 秒まで伸ばす。
+
+取り込み済みの JV ファイルは _ingest_manifest.jsonl に、次回の fromtime は _watch_state.json に記録し、
+BigQuery に読み込んだバッチには _loaded.json を置く。読み込みに失敗したバッチは間隔を空けて再試行し、
+再起動時は読み込み前のバッチから読み込み直す。読み込み済みのファイルは loader_bq.py と同じ
+_load_manifest.jsonl に記録するため、再試行・再起動で同じ行を重複して読み込まない。
+
+使い方:
+    python watch.py --spec RACE --project my-project --target-latency 30
+    python watch.py --spec RACE --no-load --replay synthetic --replay-release-interval 2 --duration 30
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from glob import glob
+
+import bq_metrics
+import loader_bq
+from jvlink.client import AdaptivePoller, JVLinkClient
+from jvlink.replay import ReplayJVLink
+from storage import DataSaver
+from ingest_manifest import INGEST_MANIFEST_FILENAME, IngestManifest
+from load_manifest import LoadManifest
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+WATCH_STATE_FILENAME = "_watch_state.json"
+LOADED_MARKER = "_loaded.json"
+
+
+class MicroBatch:
+    """
+    BigQuery に1回で読み込むレコードのまとまり (出力ディレクトリ内の1ディレクトリ)
+    """
+    def __init__(self, seq: int, path: str):
+        self.seq = seq
+        self.path = path
+        self.records = 0
+        # 最初のレコードを読んだ時刻 (遅延の計測用)
+        self.first_read = None
+        # 読み込みに失敗した回数と、次に再試行する時刻
+        self.attempts = 0
+        self.retry_at = 0.0
+
+
+class BatchLoader:
+    """
+    マイクロバッチを読み込みスレッドで順に BigQuery に渡す
+
+    load: バッチのディレクトリを受け取り、失敗したファイル数を返す callable
+    読み込みに失敗したバッチは先頭に残し、retry_interval 秒から倍々に (最大 max_retry_interval 秒)
+    間隔を空けて再試行する。core への MERGE は後から読み込んだ行で上書きするため、後続のバッチは
+    先頭のバッチが読み込まれるまで待たせる。
+    close() では残りのバッチを (再試行待ちのものも) 1回ずつ読み込み、失敗したところで止める。
+    読み込めなかったバッチには _loaded.json がないため、再起動時に読み込み直す。
+    """
+    def __init__(self, load, target_latency: float, retry_interval: float = 5.0,
+                 max_retry_interval: float = 300.0):
+        self.load = load
+        self.target_latency = target_latency
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.queue = queue.Queue()
+        # 受け取った順の読み込み待ちのバッチ (読み込みスレッドだけが触る)
+        self.pending = deque()
+        self.busy = False
+        self.stats = {"batches": 0, "records": 0, "retries": 0, "failed_batches": 0, "max_latency": 0.0}
+        self._thread = threading.Thread(target=self._run, name="batch-loader", daemon=True)
+        self._thread.start()
+
+    @property
+    def idle(self) -> bool:
+        return not self.busy and self.queue.empty()
+
+    def submit(self, batch: MicroBatch):
+        self.busy = True
+        self.queue.put(batch)
+
+    def _receive(self, closing: bool) -> bool:
+        """
+        新しいバッチを受け取る (先頭のバッチが再試行待ちの間はその時刻まで待つ)
+        戻り値: close() が呼ばれたか
+        """
+        timeout = None
+        if self.pending:
+            timeout = max(0.0, self.pending[0].retry_at - time.monotonic())
+        try:
+            item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return closing
+        if item is None:
+            return True
+        self.pending.append(item)
+        return closing
+
+    def _run(self):
+        closing = False
+        while True:
+            if not closing:
+                closing = self._receive(closing)
+                # 続けて届いているバッチも受け取ってから読み込む
+                while not closing and not self.queue.empty():
+                    closing = self._receive(closing)
+            if not self.pending:
+                if closing:
+                    return
+                self.busy = not self.queue.empty()
+                continue
+            batch = self.pending[0]
+            if not closing and batch.retry_at > time.monotonic():
+                continue
+            self.busy = True
+            if self._load(batch):
+                self.pending.popleft()
+            elif closing:
+                self.stats["failed_batches"] = len(self.pending)
+                logger.error(f"{len(self.pending)} batches were not loaded; they are reloaded on restart")
+                return
+            else:
+                delay = min(self.retry_interval * 2 ** (batch.attempts - 1), self.max_retry_interval)
+                batch.retry_at = time.monotonic() + delay
+                logger.warning(f"Retrying batch {batch.seq} in {delay:.0f}s "
+                               f"({len(self.pending) - 1} later batches waiting)")
+            self.busy = bool(self.pending) or not self.queue.empty()
+
+    def _load(self, batch: MicroBatch) -> bool:
+        started = time.monotonic()
+        try:
+            failures = self.load(batch.path)
+        except Exception as e:
+            logger.exception(f"Batch {batch.seq} failed: {e}")
+            failures = None
+        if failures != 0:
+            batch.attempts += 1
+            self.stats["retries"] += 1
+            return False
+
+        loaded_at = time.monotonic()
+        latency = loaded_at - batch.first_read if batch.first_read is not None else 0.0
+        with open(os.path.join(batch.path, LOADED_MARKER), 'w', encoding='utf-8') as f:
+            json.dump({"records": batch.records, "loaded_at": datetime.now().isoformat(),
+                       "latency": round(latency, 3), "attempts": batch.attempts + 1}, f)
+        self.stats["batches"] += 1
+        self.stats["records"] += batch.records
+        self.stats["max_latency"] = max(self.stats["max_latency"], round(latency, 3))
+        message = (f"Batch {batch.seq}: {batch.records} records loaded in {loaded_at - started:.2f}s "
+                   f"(end-to-end {latency:.2f}s)")
+        if latency > self.target_latency:
+            logger.warning(message + f" exceeds target latency {self.target_latency}s")
+        else:
+            logger.info(message)
+        return True
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+class WatchSession:
+    """
+    1つの JV-Link セッションで差分を取り込み続ける
+    """
+    def __init__(
+        self,
+        client: JVLinkClient,
+        spec: str,
+        output_dir: str,
+        loader: BatchLoader,
+        fromtime: str = None,
+        typed: bool = False,
+        as_bytes: bool = False,
+        target_latency: float = 30.0,
+        batch_records: int = 50000,
+        poll_interval: float = 0.5,
+    ):
+        self.client = client
+        self.spec = spec
+        self.output_dir = output_dir
+        self.loader = loader
+        self.typed = typed
+        self.as_bytes = as_bytes
+        self.target_latency = target_latency
+        self.batch_records = batch_records
+        self.poller = AdaptivePoller(poll_interval, max(poll_interval, target_latency / 4))
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.state_path = os.path.join(output_dir, WATCH_STATE_FILENAME)
+        state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        # 前回の続き (lastTimestamp) があればそこから、なければ指定された時刻 (省略時は当日0時) から
+        self.fromtime = state.get("fromtime") or fromtime or datetime.now().strftime("%Y%m%d000000")
+        self.manifest = IngestManifest(os.path.join(output_dir, INGEST_MANIFEST_FILENAME))
+        self.batch = None
+        self.saver = None
+        self.polls = 0
+        self.records = 0
+
+        existing = sorted(glob(os.path.join(output_dir, "batch_*")))
+        self.seq = max((int(os.path.basename(p).split("_")[1]) for p in existing), default=0)
+        for path in existing:
+            if not os.path.exists(os.path.join(path, LOADED_MARKER)):
+                # 前回読み込む前に終了したバッチ
+                logger.info(f"Reloading pending batch {os.path.basename(path)}")
+                batch = MicroBatch(int(os.path.basename(path).split("_")[1]), path)
+                batch.records = self._count_records(path)
+                self.loader.submit(batch)
+
+    @staticmethod
+    def _count_records(path: str) -> int:
+        count = 0
+        for filepath in glob(os.path.join(path, "*.jsonl")):
+            with open(filepath, 'rb') as f:
+                count += sum(1 for _ in f)
+        return count
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"spec": self.spec, "fromtime": self.fromtime, "updated_at": datetime.now().isoformat()}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _add(self, raw_data):
+        if self.batch is None:
+            self.seq += 1
+            self.batch = MicroBatch(self.seq, os.path.join(self.output_dir, f"batch_{self.seq:06d}"))
+            self.batch.first_read = time.monotonic()
+            self.saver = DataSaver(output_dir=self.batch.path, typed=self.typed)
+        self.saver.save(raw_data)
+        self.batch.records += 1
+        self.cut(when_idle=False)
+
+    def _file_end(self, filename: str):
+        # ファイル1つ分をディスクに同期してから取り込み済みとして記録する
+        if self.saver is not None:
+            self.saver.checkpoint()
+        self.manifest.add(filename, self.client.file_records.get(filename, 0), self.spec, self.fromtime)
+        self.cut()
+
+    def poll(self) -> int:
+        """
+        JVOpen から JVRead の完了までを1回行う。戻り値: 読み込んだレコード数
+        """
+        self.polls += 1
+        records = 0
+        self.client.open(self.spec, self.fromtime, 1, wait=True)
+        try:
+            for line in self.client.read(as_bytes=self.as_bytes, on_file_end=self._file_end,
+                                         skip_files=self.manifest):
+                if line:
+                    self._add(line)
+                    records += 1
+        finally:
+            self.client.close_stream()
+
+        if not self.client.read_completed:
+            raise RuntimeError(f"JVRead did not complete (from {self.fromtime})")
+        if self.client.last_timestamp:
+            self.fromtime = self.client.last_timestamp
+            self._save_state()
+        self.records += records
+        return records
+
+    def cut(self, force: bool = False, when_idle: bool = True):
+        """
+        条件を満たしていれば、書き込み中のバッチを閉じて BigQuery への読み込みに回す
+
+        when_idle: 読み込みスレッドが空いていれば区切るか (JV ファイルの途中では False にし、
+                   件数と経過時間だけで区切る)
+        """
+        if self.batch is None:
+            return
+        age = time.monotonic() - self.batch.first_read
+        if not (force or (when_idle and self.loader.idle) or self.batch.records >= self.batch_records
+                or age >= self.target_latency / 2):
+            return
+        self.saver.close()
+        self.loader.submit(self.batch)
+        self.batch = None
+        self.saver = None
+
+    def run(self, duration: float = None, max_polls: int = None):
+        started = time.monotonic()
+        try:
+            while True:
+                if self.poll() > 0:
+                    self.poller.reset()
+                self.cut()
+                if max_polls is not None and self.polls >= max_polls:
+                    break
+                if duration is not None and time.monotonic() - started >= duration:
+                    break
+                self.poller.wait()
+        except KeyboardInterrupt:
+            logger.info("Interrupted, flushing the current batch")
+        finally:
+            self.cut(force=True)
+            self.loader.close()
+        logger.info(f"Watch finished: {self.polls} polls, {self.records} records, loader {self.loader.stats}")
+
+
+def make_bigquery_load(args):
+    """
+    loader_bq の読み込み・MERGE 処理でバッチを読み込む関数と、ジョブ統計の記録先 (bq_metrics) を作る
+
+    読み込み済みのファイルは出力ディレクトリの _load_manifest.jsonl (loader_bq と同じ LoadManifest) に記録する。
+    再試行・再起動で同じバッチを読み込み直しても、読み込み済みのファイルは読み飛ばし、
+    raw に追加した後で失敗したバッチの行は削除してから読み込み直す。
+    """
+    from google.cloud import bigquery
+
+    if args.key:
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = args.key
+    client = bigquery.Client(project=args.project) if args.project else bigquery.Client()
+    audit_table_id = f"{client.project}.{args.audit_table}" if args.audit_table else None
+    metrics = bq_metrics.configure("watch", args.metrics_file, client, audit_table_id)
+    loader_bq.create_dataset_if_not_exists(client, args.dataset, args.location)
+    if not args.skip_core_merge:
+        loader_bq.create_dataset_if_not_exists(client, args.core_dataset, args.location)
+    merge_types = loader_bq.parse_merge_types(args.merge_types)
+    control_table_id = f"{client.project}.{args.manifest_table}" if args.manifest_table else None
+    manifest = LoadManifest(args.output, client=client, control_table_id=control_table_id)
+
+    def load(batch_dir: str) -> int:
+        return loader_bq.load_files(
+            client,
+            loader_bq.list_input_files(batch_dir),
+            raw_dataset_id=args.dataset,
+            core_dataset_id=args.core_dataset,
+            merge_types=merge_types,
+            staging_prefix=args.staging_prefix,
+            core_table_suffix=args.core_table_suffix,
+            skip_core_merge=args.skip_core_merge,
+            schema_mode=args.schema_mode,
+            typed=args.typed,
+            manifest=manifest,
+        )
+
+    return load, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch JV-Link for race-day updates and load them into BigQuery")
+    parser.add_argument("--spec", required=True, help="Data Specification (e.g., RACE)")
+    parser.add_argument("--sid", default="AntigravityPy", help="Software ID passed to JVInit")
+    parser.add_argument(
+        "--from",
+        dest="from_time",
+        default=None,
+        help="Initial From Time (YYYYMMDDHHMMSS, default: saved state or today 00:00)",
+    )
+    parser.add_argument("--output", default="watch_output", help="Output directory for micro-batches")
+    parser.add_argument("--bytes", dest="as_bytes", action="store_true", help="Read records as cp932 bytes via JVGets")
+    parser.add_argument("--typed", action="store_true", help="Convert fields by their schema dtype")
+    parser.add_argument(
+        "--target-latency", type=float, default=30.0, help="Target seconds from JVRead to BigQuery"
+    )
+    parser.add_argument("--batch-records", type=int, default=50000, help="Max records per micro-batch")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Initial seconds between JVOpen polls")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    parser.add_argument("--max-polls", type=int, default=None, help="Stop after this many polls")
+
+    parser.add_argument("--no-load", action="store_true", help="Write micro-batches without loading them")
+    parser.add_argument("--project", "-p", help="GCP Project ID")
+    parser.add_argument("--dataset", "-d", default="jra_raw", help="Raw BigQuery dataset ID")
+    parser.add_argument("--core-dataset", default="jra_core", help="Core BigQuery dataset ID")
+    parser.add_argument("--merge-types", default="RA,SE", help="Record types to MERGE into core latest tables")
+    parser.add_argument("--core-table-suffix", default="_latest", help="Suffix for core table names")
+    parser.add_argument("--staging-prefix", default="_stg_", help="Prefix for core staging table names")
+    parser.add_argument("--skip-core-merge", action="store_true", help="Skip core MERGE synchronization")
+    parser.add_argument("--key", "-k", help="Path to Service Account JSON key")
+    parser.add_argument("--location", "-l", default="asia-northeast1", help="Dataset location")
+    parser.add_argument(
+        "--schema",
+        dest="schema_mode",
+        choices=loader_bq.SCHEMA_MODES,
+        default="autodetect",
+        help="JSONL load schema: autodetect, or explicit schemas generated from RECORD_SPECS",
+    )
+    parser.add_argument(
+        "--manifest-table",
+        help="BigQuery control table (dataset.table) recording loaded files, in addition to the local manifest",
+    )
+    parser.add_argument(
+        "--retry-interval", type=float, default=5.0, help="Initial seconds before retrying a failed batch load"
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=bq_metrics.DEFAULT_METRICS_FILE,
+        help="Local JSONL file receiving per-job BigQuery statistics",
+    )
+    parser.add_argument("--audit-table", help="BigQuery table (dataset.table) receiving per-job statistics")
+
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help="Replay recorded records (file or directory) or 'synthetic' instead of the JV-Link COM server",
+    )
+    parser.add_argument(
+        "--replay-release-interval", type=float, default=5.0, help="Seconds between replayed JV files becoming new"
+    )
+    parser.add_argument("--synthetic-files", type=int, default=10, help="JV files generated by --replay synthetic")
+    parser.add_argument(
+        "--synthetic-races", type=int, default=1, help="Races per JV file generated by --replay synthetic"
+    )
+    args = parser.parse_args()
+
+    backend = None
+    if args.replay == "synthetic":
+        backend = ReplayJVLink.synthetic(
+            files=args.synthetic_files,
+            races_per_file=args.synthetic_races,
+            release_interval=args.replay_release_interval,
+        )
+    elif args.replay:
+        backend = ReplayJVLink.from_path(args.replay, release_interval=args.replay_release_interval)
+
+    metrics = None
+    if args.no_load:
+        def load(batch_dir):
+            logger.info(f"Skipping BigQuery load of {os.path.basename(batch_dir)} (--no-load)")
+            return 0
+    else:
+        load, metrics = make_bigquery_load(args)
+
+    loader = BatchLoader(load, args.target_latency, retry_interval=args.retry_interval)
+    with JVLinkClient(sid=args.sid, backend=backend) as client:
+        session = WatchSession(
+            client,
+            args.spec,
+            args.output,
+            loader,
+            fromtime=args.from_time,
+            typed=args.typed,
+            as_bytes=args.as_bytes,
+            target_latency=args.target_latency,
+            batch_records=args.batch_records,
+            poll_interval=args.poll_interval,
+        )
+        try:
+            session.run(duration=args.duration, max_polls=args.max_polls)
+        finally:
+            if metrics is not None:
+                metrics.close()
+    return 1 if loader.stats["failed_batches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())